@@ -0,0 +1,225 @@
+import os
+import time
+import fcntl
+import shutil
+import sqlite3
+import hashlib
+import logging
+import argparse
+from contextlib import contextmanager
+import metrics
+
+# Default location and size of the cache
+CACHE_DIR = '.archive_cache'
+MAX_BYTES = 200 * 1024 ** 3
+# last_used is only rewritten when it is older than this, so hits stay read-only
+TOUCH_INTERVAL = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    version TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+STATS = ('hits', 'misses', 'stored', 'evicted', 'bytes_downloaded', 'bytes_saved', 'bytes_evicted')
+
+
+def blob_version(blob):
+    """What identifies the content of an object: its generation, else its CRC32C, else its size."""
+    for field in ('generation', 'crc32c', 'size'):
+        value = getattr(blob, field, None)
+        if value:
+            return f"{field}={value}"
+    return None
+
+
+def cache_key(bucket_name, name, version):
+    return hashlib.sha256(f"{bucket_name}/{name}@{version}".encode('utf-8')).hexdigest()
+
+
+def _link(source, destination):
+    """Hard link source to destination, copying across file systems."""
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+class ArchiveCache:
+    """Raw source archives downloaded from a bucket, kept on local disk with LRU eviction by total size.
+
+    An archive is cached under its object name and version (see
+    blob_version()), so an object that was overwritten in the bucket is
+    downloaded again. Callers get a hard link to the cached file, which stays
+    readable after the entry is evicted. Worker processes share one cache:
+    the index is SQLite and each entry has a lock file, so an archive that
+    several workers ask for at once is downloaded a single time and never
+    evicted while it is being written or linked.
+    """
+
+    def __init__(self, root=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        self._conn = None
+        self._owner = None
+        # counts of this process; totals() has those of every process that used the cache
+        self.stats = dict.fromkeys(STATS, 0)
+
+    @property
+    def conn(self):
+        """The index, reconnected after a fork so every process has its own connection."""
+        if self._owner != os.getpid():
+            self._conn = sqlite3.connect(os.path.join(self.root, 'index.db'), timeout=60, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(SCHEMA)
+            self._owner = os.getpid()
+        return self._conn
+
+    def object_path(self, key):
+        return os.path.join(self.root, 'objects', key[:2], key)
+
+    @contextmanager
+    def _locked(self, key, blocking=True):
+        """Hold the entry's lock; yields False when blocking is off and another process holds it."""
+        path = self.object_path(key) + '.lock'
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _count(self, name, value=1):
+        self.stats[name] += value
+        self.conn.execute('INSERT INTO stats (name, value) VALUES (?, ?) '
+                          'ON CONFLICT (name) DO UPDATE SET value = value + excluded.value', (name, value))
+        metrics.count(f'archive_cache_{name}', value)
+
+    def fetch(self, bucket, name, destination_path):
+        """Put the object name of bucket at destination_path, downloading it only if it is not cached.
+
+        Returns True on a cache hit.
+        """
+        blob = bucket.get_blob(name)
+        if blob is None:
+            raise FileNotFoundError(f"{name} is not in {bucket.name}")
+        version = blob_version(blob)
+        if version is None:
+            # nothing tells two versions apart, so the object is not cached
+            with metrics.stage('download'):
+                blob.download_to_filename(destination_path)
+            return False
+
+        key = cache_key(bucket.name, name, version)
+        path = self.object_path(key)
+        with self._locked(key):
+            row = self.conn.execute('SELECT size, last_used FROM entries WHERE key = ?', (key,)).fetchone()
+            hit = row is not None and os.path.exists(path)
+            if hit:
+                now = time.time()
+                if now - row[1] > TOUCH_INTERVAL:
+                    self.conn.execute('UPDATE entries SET last_used = ? WHERE key = ?', (now, key))
+                self._count('hits')
+                self._count('bytes_saved', row[0])
+            else:
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                try:
+                    with metrics.stage('download'):
+                        blob.download_to_filename(tmp_path)
+                    os.replace(tmp_path, path)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                size = os.path.getsize(path)
+                self.conn.execute('INSERT OR REPLACE INTO entries (key, name, version, size, last_used) '
+                                  'VALUES (?, ?, ?, ?, ?)', (key, name, version, size, time.time()))
+                self._count('misses')
+                self._count('stored')
+                self._count('bytes_downloaded', size)
+            _link(path, destination_path)
+        if not hit:
+            self.evict()
+        return hit
+
+    def total_bytes(self):
+        return self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def totals(self):
+        """Counts of every process that used the cache since it was created."""
+        totals = dict.fromkeys(STATS, 0)
+        totals.update(self.conn.execute('SELECT name, value FROM stats'))
+        return totals
+
+    def evict(self, max_bytes=None):
+        """Drop least recently used archives until the cache fits in max_bytes.
+
+        Entries another process is downloading or linking are skipped.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        excess = self.total_bytes() - max_bytes
+        if excess <= 0:
+            return 0
+        removed = freed = 0
+        for key, size in self.conn.execute('SELECT key, size FROM entries ORDER BY last_used').fetchall():
+            if excess <= 0:
+                break
+            with self._locked(key, blocking=False) as locked:
+                if not locked:
+                    continue
+                self.conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                try:
+                    os.remove(self.object_path(key))
+                except FileNotFoundError:
+                    pass
+            excess -= size
+            freed += size
+            removed += 1
+        if removed:
+            self._count('evicted', removed)
+            self._count('bytes_evicted', freed)
+            logging.debug(f"Evicted {removed} archives ({freed / 1e6:.1f} MB) from {self.root}")
+        return removed
+
+    def close(self):
+        if self._conn is not None and self._owner == os.getpid():
+            self._conn.close()
+        self._conn = self._owner = None
+
+
+def format_stats(stats):
+    return (f"Archive cache: {stats['hits']} hits, {stats['misses']} misses, {stats['evicted']} evicted, "
+            f"{stats['bytes_downloaded'] / 1e6:.1f} MB downloaded, {stats['bytes_saved'] / 1e6:.1f} MB saved, "
+            f"{stats['bytes_evicted'] / 1e6:.1f} MB evicted")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect or trim the raw archive cache.')
+    parser.add_argument('command', choices=['status', 'evict'])
+    parser.add_argument('--cache_dir', type=str, default=CACHE_DIR)
+    parser.add_argument('--max_gb', type=float, help='Size to trim the cache to (evict).')
+    args = parser.parse_args()
+
+    cache = ArchiveCache(args.cache_dir)
+    if args.command == 'evict':
+        cache.evict(int(args.max_gb * 1024 ** 3) if args.max_gb is not None else None)
+    entries = cache.conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+    print(f"{entries} archives, {cache.total_bytes() / 1e6:.1f} MB of {cache.max_bytes / 1e6:.0f} MB")
+    print(format_stats(cache.totals()))
+    cache.close()
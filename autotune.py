@@ -0,0 +1,143 @@
+import os
+import math
+import time
+import logging
+import argparse
+import metrics
+
+# Stages that wait on the network or the disk rather than the CPU
+IO_STAGES = ('download', 'upload', 'write')
+# Seconds between two adjustments, so each one is judged on enough finished work
+INTERVAL = 10.0
+# Weight of the newest observations in the running averages
+SMOOTHING = 0.3
+
+
+def parse_range(value):
+    """argparse type for MIN:MAX, returns (min, max)."""
+    try:
+        low, high = (int(part) for part in value.split(':'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected MIN:MAX, got {value!r}")
+    if low < 1 or high < low:
+        raise argparse.ArgumentTypeError(f"expected 1 <= MIN <= MAX, got {value!r}")
+    return low, high
+
+
+def _average(previous, value):
+    return value if previous is None else previous + SMOOTHING * (value - previous)
+
+
+class Controller:
+    """Picks how many tasks of one pool run at once, between minimum and maximum, from live measurements.
+
+    Both kinds report each finished task's wall seconds, CPU seconds and
+    seconds per stage. CPU pools: while workers spend part of their time
+    waiting on I/O, more of them than there are cores keep the cores busy,
+    so the target is the core count divided by the CPU share of a task.
+    I/O pools grow while work queues up and shrink while it does not, up
+    to the number of tasks that keep the cores busy when each spends its
+    I/O share of the time waiting. In both cases a target above the
+    backlog is of no use.
+    Every change is logged as a warning with what it was based on, and
+    settings() gives the changes and the values to pin for later runs.
+    """
+
+    def __init__(self, name, minimum, maximum, initial=None, kind='cpu', interval=INTERVAL, cores=None):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.kind = kind
+        self.interval = interval
+        self.cores = cores or os.cpu_count() or 1
+        self.target = self.initial = self._clamp(initial or (min(self.cores, maximum) if kind == 'cpu' else minimum))
+        self.cpu_share = None
+        self.io_share = None
+        self.backlog = 0
+        self.started = self.changed = time.monotonic()
+        # seconds spent at each target, for the value to pin
+        self.time_at = {}
+        # (seconds into the run, new target) of every change, for the end-of-run report
+        self.changes = []
+
+    def _clamp(self, value):
+        return max(self.minimum, min(self.maximum, int(round(value))))
+
+    def observe(self, wall, cpu=None, stages=None):
+        """One finished task: its wall seconds, CPU seconds and seconds per stage."""
+        if wall <= 0:
+            return
+        if cpu is not None:
+            self.cpu_share = _average(self.cpu_share, min(cpu / wall, 1.0))
+        if stages:
+            io = sum(seconds for name, seconds in stages.items() if name in IO_STAGES)
+            self.io_share = _average(self.io_share, min(io / wall, 1.0))
+
+    def update(self, backlog, running=None):
+        """Adjust the target from the tasks waiting to start; returns it."""
+        self.backlog = _average(self.backlog, backlog)
+        now = time.monotonic()
+        if now - self.changed < self.interval:
+            return self.target
+        if self.kind == 'cpu':
+            if self.cpu_share is None:
+                return self.target
+            wanted = self.cores / max(self.cpu_share, 0.05)
+        elif backlog > 0:
+            wanted = self.target * 1.5 + 1
+            if self.io_share is not None:
+                # beyond this the tasks contend for the CPU, not for the network
+                wanted = min(wanted, self.cores / max(1.0 - self.io_share, 0.05))
+        else:
+            wanted = self.target - 1
+        # starting more than can be busy is no use, running is what is busy now
+        wanted = min(wanted, (running if running is not None else self.target) + backlog)
+        # move half way (at least one), the measurements lag behind the change
+        # and not at all within one of it, so the target does not flap
+        step = (wanted - self.target) / 2
+        if abs(step) < 0.5:
+            step = 0
+        target = self._clamp(self.target + (math.ceil(step) if step > 0 else math.floor(step)))
+        self._switch(target, now)
+        return self.target
+
+    def _switch(self, target, now):
+        self.time_at[self.target] = self.time_at.get(self.target, 0.0) + now - self.changed
+        self.changed = now
+        if target != self.target:
+            # warning, so the change shows at the processors' default log level
+            logging.warning(f"autotune {self.name}: {self.target} -> {target} "
+                            f"(cpu share {self._share(self.cpu_share)}, io share {self._share(self.io_share)}, "
+                            f"backlog {self.backlog:.1f})")
+            metrics.count(f'autotune_{self.name}_changes')
+            self.changes.append((now - self.started, target))
+        self.target = target
+        metrics.gauge(f'autotune_{self.name}', target)
+
+    @staticmethod
+    def _share(value):
+        return 'n/a' if value is None else f"{value:.2f}"
+
+    def settings(self):
+        """The final and the most used target, the changes on the way, and what they were based on."""
+        self._switch(self.target, time.monotonic())
+        return {
+            'name': self.name,
+            'final': self.target,
+            'most_used': max(self.time_at, key=self.time_at.get),
+            'range': (self.minimum, self.maximum),
+            'cpu_share': self.cpu_share,
+            'io_share': self.io_share,
+            'initial': self.initial,
+            'changes': list(self.changes),
+        }
+
+
+def format_settings(settings, flag):
+    """Lines saying what was chosen, how it changed and how to pin it, e.g. with flag '--workers'."""
+    changes = ', '.join(f"{target} at {seconds:.0f}s" for seconds, target in settings['changes']) or 'none'
+    return (f"Autotune {settings['name']}: settled on {settings['final']} "
+            f"(most used {settings['most_used']}, range {settings['range'][0]}:{settings['range'][1]}, "
+            f"cpu share {Controller._share(settings['cpu_share'])}, io share {Controller._share(settings['io_share'])}); "
+            f"pin with {flag} {settings['most_used']}\n"
+            f"  started at {settings['initial']}, changes: {changes}")
@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+import shm_transport
+
+# Typical payloads: a small PNG, a large PNG, an RGB page at 200 dpi, a multi-page TIFF
+DEFAULT_SIZES = '64K,1M,5M,25M'
+
+
+def parse_size(value):
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if value[-1].upper() in units:
+        return int(float(value[:-1]) * units[value[-1].upper()])
+    return int(value)
+
+
+def consume(queue, done, transport):
+    # touch every payload the way a downstream stage would, without copying it
+    total = 0
+    while True:
+        item = queue.get()
+        if item is None:
+            break
+        if transport is None:
+            total += len(item) + item[-1]
+        else:
+            with transport.view(item) as view:
+                total += len(view) + view[-1]
+    done.put(total)
+
+
+def run(mode, size, count):
+    """Seconds to send count payloads of size bytes from this process to a consumer process."""
+    payload = os.urandom(size)
+    transport = shm_transport.Transport(inline_bytes=0) if mode == 'shm' else None
+    queue, done = multiprocessing.Queue(maxsize=8), multiprocessing.Queue()
+    consumer = multiprocessing.Process(target=consume, args=(queue, done, transport))
+    consumer.start()
+    start = time.perf_counter()
+    for _ in range(count):
+        queue.put(payload if transport is None else transport.put(payload))
+    queue.put(None)
+    done.get()
+    seconds = time.perf_counter() - start
+    consumer.join()
+    if transport:
+        transport.cleanup()
+    return seconds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare pickling figure bytes through a queue with shared memory handles.')
+    parser.add_argument('--sizes', type=str, default=DEFAULT_SIZES, help='Comma separated payload sizes, e.g. 64K,1M.')
+    parser.add_argument('--total', type=parse_size, default=parse_size('512M'), help='Bytes sent per size and mode.')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement, the fastest is kept.')
+    args = parser.parse_args()
+
+    print(f"{'size':>8} {'pickle MB/s':>12} {'shm MB/s':>10} {'speedup':>8}")
+    for value in args.sizes.split(','):
+        size = parse_size(value)
+        count = max(1, args.total // size)
+        pickled = min(run('pickle', size, count) for _ in range(args.repeat))
+        shared = min(run('shm', size, count) for _ in range(args.repeat))
+        mb = size * count / 1e6
+        print(f"{value:>8} {mb / pickled:>12.0f} {mb / shared:>10.0f} {pickled / shared:>7.2f}x")
@@ -0,0 +1,175 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+import metrics
+import synthetic_corpus
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+
+# processor name -> (corpus layout, command builder)
+PROCESSORS = {
+    'gz_raw': ('gz', lambda corpus, out, m, workers: [
+        'gz_raw_processor.py', '--source', corpus, '--refresh_listing', '--metrics_dir', m]),
+    'v2': ('v2', lambda corpus, out, m, workers: [
+        'v2processor.py', '--papers_dir', corpus, '--output_dir', out,
+        '--num_processes', str(workers), '--metrics_dir', m]),
+    'tarfile': ('tar', lambda corpus, out, m, workers: [
+        'tarfile_processor.py', os.path.join(corpus, 'corpus.tar'), '--metrics_dir', m]),
+}
+
+
+def corpus_bytes(corpus_dir):
+    return sum(os.path.getsize(os.path.join(corpus_dir, f)) for f in os.listdir(corpus_dir))
+
+
+def run_processor(name, corpus_options, workers, repeat=1):
+    """Run one processor end to end on a fresh corpus; returns the best of repeat runs."""
+    layout, command = PROCESSORS[name]
+    best = None
+    with tempfile.TemporaryDirectory() as root:
+        corpus_dir = os.path.join(root, 'corpus')
+        synthetic_corpus.generate_corpus(corpus_dir, layout=layout, **corpus_options)
+        input_bytes = corpus_bytes(corpus_dir)
+        if layout == 'tar':
+            input_bytes = os.path.getsize(os.path.join(corpus_dir, 'corpus.tar'))
+
+        for _ in range(repeat):
+            work_dir = os.path.join(root, 'work')
+            shutil.rmtree(work_dir, ignore_errors=True)
+            os.makedirs(work_dir)
+            metrics_dir = os.path.join(work_dir, 'metrics')
+            args = command(corpus_dir, os.path.join(work_dir, 'output'), metrics_dir, workers)
+            args[0] = os.path.join(REPO_ROOT, args[0])
+
+            start = time.perf_counter()
+            subprocess.run([sys.executable] + args, cwd=work_dir, check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            seconds = time.perf_counter() - start
+
+            summary = metrics.aggregate(metrics_dir)
+            papers = corpus_options['num_papers']
+            result = {
+                'papers': papers,
+                'seconds': seconds,
+                'papers_per_s': papers / seconds,
+                'mb_per_s': input_bytes / 1e6 / seconds,
+                'peak_rss_mb': max((w['peak_rss_bytes'] for w in summary['workers'].values()), default=0) / 1e6,
+                'stages': {stage: values['seconds'] for stage, values in summary['stages'].items()},
+            }
+            if best is None or result['seconds'] < best['seconds']:
+                best = result
+    return best
+
+
+def run_micro(corpus_options, repeat=3):
+    """Time the hot stages in-process on one generated paper set, without any I/O."""
+    import random
+    from TexSoup import TexSoup
+    import pandas as pd
+    import figure_ir
+    from engine import records
+    import tex_macros
+
+    rng = random.Random(corpus_options.get('seed', 0))
+    texts = []
+    for _ in range(min(corpus_options['num_papers'], 20)):
+        files = synthetic_corpus.make_paper(rng, figures=corpus_options.get('figures', 4),
+                                            formats=corpus_options.get('formats', (('png', 1.0),)))
+        texts.append(files['main.tex'].decode('utf-8'))
+    lines = [line for text in texts for line in text.splitlines() if line.strip()]
+
+    def best_of(func):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    return {
+        'parse_s': best_of(lambda: [TexSoup(text, tolerance=1) for text in texts]),
+        'macros_s': best_of(lambda: [tex_macros.expand(text) for text in texts]),
+        'clean_s': best_of(lambda: [records.clean_text_content(line) for line in lines]),
+        'clean_column_s': best_of(lambda: figure_ir.clean_column(pd.Series(lines), records.CLEAN_RULES)),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print a comparison table; returns the list of regressions."""
+    regressions = []
+    print(f"{'benchmark':<12} {'papers/s':>10} {'base':>10} {'MB/s':>8} {'peak MB':>8} {'base':>8}")
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if name == 'micro':
+            for key, value in sorted(result.items()):
+                base_value = base.get(key) if base else None
+                print(f"{name + '.' + key:<12} {value * 1000:>9.1f}ms {base_value * 1000 if base_value else 0:>9.1f}ms")
+                if base_value and value > base_value * (1 + tolerance):
+                    regressions.append(f"{name}.{key}")
+            continue
+        print(f"{name:<12} {result['papers_per_s']:>10.2f} {base['papers_per_s'] if base else 0:>10.2f} "
+              f"{result['mb_per_s']:>8.2f} {result['peak_rss_mb']:>8.0f} {base['peak_rss_mb'] if base else 0:>8.0f}")
+        base_stages = base.get('stages', {}) if base else {}
+        print('    ' + ', '.join(f"{stage} {seconds:.2f}s (base {base_stages.get(stage, 0):.2f}s)"
+                                for stage, seconds in sorted(result['stages'].items())))
+        if base and result['papers_per_s'] < base['papers_per_s'] * (1 - tolerance):
+            regressions.append(f"{name}.papers_per_s")
+        if base and result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f"{name}.peak_rss_mb")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the processors on a synthetic corpus.')
+    parser.add_argument('--processors', type=str, default=','.join(PROCESSORS), help='Comma separated subset to run.')
+    parser.add_argument('--papers', type=int, default=50)
+    parser.add_argument('--figures', type=int, default=4)
+    parser.add_argument('--sections', type=int, default=6)
+    parser.add_argument('--formats', type=synthetic_corpus.parse_formats, default=[('png', 1.0)])
+    parser.add_argument('--depth', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per benchmark, the fastest is kept.')
+    parser.add_argument('--no-micro', action='store_true', help='Skip the in-process stage benchmarks.')
+    parser.add_argument('--baseline', type=str, default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='Store these results as the new baseline.')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed slowdown before failing.')
+    args = parser.parse_args()
+    # without a baseline there is nothing to check against, say so before spending minutes on the runs
+    if not args.save_baseline and not os.path.exists(args.baseline):
+        parser.error(f"no baseline at {args.baseline}; record one on this machine first with --save-baseline "
+                     f"(baselines are machine specific, so none is committed)")
+
+    corpus_options = {'num_papers': args.papers, 'figures': args.figures, 'sections': args.sections,
+                      'formats': args.formats, 'depth': args.depth, 'seed': args.seed}
+    results = {}
+    for name in args.processors.split(','):
+        results[name] = run_processor(name, corpus_options, args.workers, repeat=args.repeat)
+    if not args.no_micro:
+        results['micro'] = run_micro(corpus_options)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    missing = [name for name in results if name not in baseline]
+    if missing and not args.save_baseline:
+        print(f"Not in the baseline, not checked: {', '.join(missing)}")
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Saved baseline to {args.baseline}")
+    elif regressions:
+        print(f"Regressions: {', '.join(regressions)}")
+        sys.exit(1)
@@ -0,0 +1,215 @@
+import os
+import io
+import zlib
+import struct
+import random
+import tarfile
+import argparse
+
+# Generates arXiv-style source archives for benchmarking. Everything is made
+# with the standard library so a corpus can be built on any machine, and the
+# same seed always produces byte-identical archives.
+
+WORDS = ('model data figure result method network energy field spectrum sample '
+         'signal density error training value state phase measure system function '
+         'we show that the of in and for with from this these our a an is are').split()
+
+MATH = [r'$x^2 + y^2 = r^2$', r'$\alpha \leq \beta$', r'$\sum_{i=1}^{n} x_i$', r'$E = mc^2$']
+
+
+def png_bytes(rng, width, height):
+    """A valid RGB PNG of random blocks."""
+    rows = []
+    for y in range(height):
+        row = bytearray([0])
+        for x in range(width):
+            shade = ((x // 8) * 31 + (y // 8) * 17 + rng.randrange(8)) % 256
+            row += bytes((shade, 255 - shade, (shade * 3) % 256))
+        rows.append(bytes(row))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) +
+            chunk(b'IDAT', zlib.compress(b''.join(rows), 6)) + chunk(b'IEND', b''))
+
+
+def pdf_bytes(rng, width, height, pages=1):
+    """A minimal valid PDF with a few filled rectangles per page."""
+    objects = []
+    page_ids = [3 + 2 * i for i in range(pages)]
+    objects.append(b'<< /Type /Catalog /Pages 2 0 R >>')
+    kids = ' '.join(f'{pid} 0 R' for pid in page_ids)
+    objects.append(f'<< /Type /Pages /Kids [{kids}] /Count {pages} >>'.encode())
+    for pid in page_ids:
+        ops = []
+        for _ in range(rng.randint(3, 12)):
+            x, y = rng.randrange(width), rng.randrange(height)
+            ops.append(f'{rng.random():.2f} {rng.random():.2f} {rng.random():.2f} rg '
+                       f'{x} {y} {rng.randint(5, 60)} {rng.randint(5, 60)} re f')
+        stream = '\n'.join(ops).encode()
+        objects.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width} {height}] '
+                       f'/Contents {pid + 1} 0 R >>'.encode())
+        objects.append(b'<< /Length ' + str(len(stream)).encode() + b' >>\nstream\n' + stream + b'\nendstream')
+
+    out = io.BytesIO()
+    out.write(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f'{number} 0 obj\n'.encode() + body + b'\nendobj\n')
+    xref = out.tell()
+    out.write(f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode())
+    for offset in offsets:
+        out.write(f'{offset:010d} 00000 n \n'.encode())
+    out.write(f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode())
+    return out.getvalue()
+
+
+def eps_bytes(rng, width, height):
+    lines = ['%!PS-Adobe-3.0 EPSF-3.0', f'%%BoundingBox: 0 0 {width} {height}', 'newpath']
+    for _ in range(rng.randint(3, 12)):
+        lines.append(f'{rng.randrange(width)} {rng.randrange(height)} moveto '
+                     f'{rng.randrange(width)} {rng.randrange(height)} lineto')
+    lines += ['2 setlinewidth stroke', 'showpage', '%%EOF']
+    return '\n'.join(lines).encode()
+
+
+def paragraph(rng, words):
+    out = []
+    for i in range(words):
+        out.append(rng.choice(WORDS))
+        if i % 23 == 11:
+            out.append(rng.choice(MATH))
+        if i % 41 == 20:
+            out.append(r'\cite{ref%d}' % rng.randrange(50))
+    return ' '.join(out) + '.'
+
+
+def make_paper(rng, sections=6, paragraphs=4, words=80, figures=4, formats=(('png', 1.0),),
+               depth=1, multi_file=False, image_size=(160, 120)):
+    """Return {path: bytes} for one paper's source tree."""
+    files = {}
+    kinds = [kind for kind, _ in formats]
+    weights = [weight for _, weight in formats]
+
+    figure_blocks = []
+    for i in range(figures):
+        kind = rng.choices(kinds, weights)[0]
+        folder = '/'.join(['figures'] + [f'd{level}' for level in range(1, depth)])
+        path = f'{folder}/fig{i}.{kind}'
+        width, height = image_size
+        if kind == 'png':
+            files[path] = png_bytes(rng, width, height)
+        elif kind == 'pdf':
+            files[path] = pdf_bytes(rng, width, height)
+        else:
+            files[path] = eps_bytes(rng, width, height)
+
+        if kind == 'eps' and i % 2:
+            graphic = r'\epsfbox{%s}' % path
+        else:
+            graphic = r'\includegraphics[width=0.%d\textwidth]{%s}' % (rng.randint(3, 9), path)
+        block = [r'\begin{figure}[t]', r'\centering', graphic,
+                 r'\caption{%s}' % paragraph(rng, rng.randint(8, 30)),
+                 r'\label{fig:%d}' % i, r'\end{figure}']
+        # wrap in nested environments to exercise deep trees
+        for level in range(depth - 1):
+            block = [r'\begin{center}'] + block + [r'\end{center}']
+        figure_blocks.append('\n'.join(block))
+
+    section_texts = []
+    for s in range(sections):
+        body = [r'\section{%s}' % ' '.join(rng.choice(WORDS) for _ in range(3)).title()]
+        for p in range(paragraphs):
+            body.append(paragraph(rng, words))
+            body.append('% a comment line ' + rng.choice(WORDS))
+        # spread figures over the sections
+        body += figure_blocks[s::sections]
+        section_texts.append('\n\n'.join(body))
+
+    preamble = '\n'.join([r'\documentclass{article}', r'\usepackage{graphicx}', r'\usepackage{epsfig}',
+                          r'\begin{document}', r'\title{Synthetic}', r'\maketitle'])
+    if multi_file:
+        for s, text in enumerate(section_texts):
+            files[f'sections/sec{s}.tex'] = text.encode('utf-8')
+        inputs = '\n'.join(r'\input{sections/sec%d}' % s for s in range(sections))
+        files['main.tex'] = (preamble + '\n' + inputs + '\n\\end{document}\n').encode('utf-8')
+    else:
+        files['main.tex'] = (preamble + '\n' + '\n\n'.join(section_texts) + '\n\\end{document}\n').encode('utf-8')
+    return files
+
+
+def tar_gz_bytes(files):
+    buffer = io.BytesIO()
+    # fixed mtime keeps the archives reproducible
+    with tarfile.open(fileobj=buffer, mode='w:gz', compresslevel=6) as tar:
+        for path in sorted(files):
+            info = tarfile.TarInfo(path)
+            info.size = len(files[path])
+            info.mtime = 0
+            tar.addfile(info, io.BytesIO(files[path]))
+    return buffer.getvalue()
+
+
+def parse_formats(value):
+    """'png:0.6,pdf:0.3,eps:0.1' -> [('png', 0.6), ...]"""
+    formats = []
+    for part in value.split(','):
+        kind, _, weight = part.partition(':')
+        formats.append((kind.strip(), float(weight or 1)))
+    return formats
+
+
+def generate_corpus(output_dir, num_papers=50, seed=0, layout='gz', yymm='2301', sections=6, paragraphs=4,
+                    words=80, figures=4, formats=(('png', 1.0),), depth=1, multi_file_ratio=0.3,
+                    size_jitter=0.5, image_size=(160, 120)):
+    """Write num_papers archives to output_dir and return their paths.
+
+    layout 'gz' writes <id>.gz (gz_raw_processor), 'v2' writes
+    arXiv-<id>.tar.gz (v2processor), and 'tar' additionally bundles the .gz
+    files into one corpus.tar (tarfile_processor).
+    """
+    rng = random.Random(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for n in range(num_papers):
+        paper_id = f'{yymm}.{n:05d}'
+        scale = 1 + rng.uniform(-size_jitter, size_jitter) * 2 if size_jitter else 1
+        files = make_paper(rng, sections=max(1, int(sections * scale)), paragraphs=paragraphs, words=words,
+                           figures=max(0, int(figures * scale)), formats=formats, depth=depth,
+                           multi_file=rng.random() < multi_file_ratio, image_size=image_size)
+        name = f'arXiv-{paper_id}.tar.gz' if layout == 'v2' else f'{paper_id}.gz'
+        path = os.path.join(output_dir, name)
+        with open(path, 'wb') as f:
+            f.write(tar_gz_bytes(files))
+        paths.append(path)
+
+    if layout == 'tar':
+        tar_path = os.path.join(output_dir, 'corpus.tar')
+        with tarfile.open(tar_path, 'w') as tar:
+            for path in paths:
+                tar.add(path, arcname=os.path.basename(path))
+        return [tar_path]
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic arXiv-style source corpus.')
+    parser.add_argument('output_dir')
+    parser.add_argument('--papers', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--layout', choices=['gz', 'v2', 'tar'], default='gz')
+    parser.add_argument('--sections', type=int, default=6, help='Sections per paper (scales paper size).')
+    parser.add_argument('--paragraphs', type=int, default=4, help='Paragraphs per section.')
+    parser.add_argument('--figures', type=int, default=4, help='Figures per paper.')
+    parser.add_argument('--formats', type=parse_formats, default=[('png', 1.0)], help='Figure mix, e.g. png:0.6,pdf:0.3,eps:0.1')
+    parser.add_argument('--depth', type=int, default=1, help='Directory and environment nesting depth of figures.')
+    parser.add_argument('--multi_file_ratio', type=float, default=0.3, help='Share of papers split over \\input files.')
+    args = parser.parse_args()
+
+    paths = generate_corpus(args.output_dir, num_papers=args.papers, seed=args.seed, layout=args.layout,
+                            sections=args.sections, paragraphs=args.paragraphs, figures=args.figures,
+                            formats=args.formats, depth=args.depth, multi_file_ratio=args.multi_file_ratio)
+    print(f"Wrote {len(paths)} archive(s) to {args.output_dir}")
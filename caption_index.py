@@ -0,0 +1,356 @@
+import os
+import re
+import json
+import mmap
+import time
+import fcntl
+import argparse
+from collections import defaultdict
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+# An index directory holds index.json plus one directory per segment. Every
+# update indexes only the output files that are new or changed since the
+# last one and adds them as a new segment; compact() folds all segments
+# into one. Inside a segment:
+#   terms.bin    sorted terms, utf-8, concatenated
+#   terms.idx    TERM_ENTRY per term: where its text and postings are
+#   postings.bin doc ids of each term, delta + varint encoded
+#   docs.bin     one JSON line per figure: ref, caption, source
+#   docs.idx     offset of each doc line, plus the end offset
+MANIFEST = 'index.json'
+# Held while index.json is read, a segment is added and index.json replaced
+LOCK = 'index.lock'
+# Indexer.update() runs at most this often while a processor is writing
+UPDATE_INTERVAL = 60.0
+TERM_ENTRY = np.dtype([('term_offset', '<u8'), ('term_length', '<u4'), ('postings_offset', '<u8'),
+                       ('postings_length', '<u4'), ('df', '<u4')])
+
+TEX_COMMAND = re.compile(r'\\[a-zA-Z]+')
+TOKEN = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """Lowercased word tokens of a caption, TeX command names dropped."""
+    return TOKEN.findall(TEX_COMMAND.sub(' ', text or '').lower())
+
+
+def encode_postings(doc_ids):
+    """Delta + LEB128 varint encoding of an increasing list of doc ids."""
+    out = bytearray()
+    previous = 0
+    for doc_id in doc_ids:
+        delta = doc_id - previous
+        previous = doc_id
+        while delta >= 0x80:
+            out.append((delta & 0x7f) | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return bytes(out)
+
+
+def decode_postings(buffer):
+    """Inverse of encode_postings, vectorized: returns a sorted uint64 array."""
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    if not len(data):
+        return np.zeros(0, dtype=np.uint64)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    owner = np.repeat(np.arange(len(starts)), ends - starts + 1)
+    shifts = (7 * (np.arange(len(data)) - starts[owner])).astype(np.uint64)
+    deltas = np.add.reduceat((data & 0x7f).astype(np.uint64) << shifts, starts)
+    return np.cumsum(deltas, dtype=np.uint64)
+
+
+def figures_in(path):
+    """(ref, caption) pairs of one output file of gz_raw_processor or tarfile_processor."""
+    if path.endswith('.parquet'):
+        frame = pd.read_parquet(path, columns=['image_filename', 'caption'])
+        return [(ref, caption) for ref, caption in zip(frame['image_filename'], frame['caption']) if caption]
+    with open(path, 'r') as f:
+        data = json.load(f)
+    if not isinstance(data, dict) or 'captions' not in data:
+        return []
+    # every figure adds one caption and one image name, in the same order
+    refs = [image for image in data['images'] if image]
+    return [(ref, caption) for ref, caption in zip(refs, data['captions']) if caption]
+
+
+def output_files(output_dir):
+    for root, dirs, files in os.walk(output_dir):
+        dirs[:] = [d for d in dirs if not d.startswith(('_', '.')) and d != 'figures']
+        for name in files:
+            if name.endswith(('.json', '.parquet')) and name != 'merged.json':
+                yield os.path.join(root, name)
+
+
+def load_manifest(index_dir):
+    path = os.path.join(index_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {'segments': [], 'sources': {}}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+@contextmanager
+def locked(index_dir):
+    """Exclusive lock of an index, so concurrent updates do not drop each other's segments."""
+    os.makedirs(index_dir, exist_ok=True)
+    with open(os.path.join(index_dir, LOCK), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def new_segment_name(index_dir):
+    name = f"seg-{int(time.time() * 1000):015d}"
+    while os.path.exists(os.path.join(index_dir, name)):
+        name = f"seg-{int(name[len('seg-'):]) + 1:015d}"
+    return name
+
+
+def save_manifest(index_dir, manifest):
+    path = os.path.join(index_dir, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(path + '.tmp', path)
+
+
+def write_segment(segment_dir, docs):
+    """Write one segment for docs, a list of (ref, caption, source) tuples."""
+    os.makedirs(segment_dir, exist_ok=True)
+    postings = defaultdict(list)
+    with open(os.path.join(segment_dir, 'docs.bin'), 'wb') as f:
+        offsets = []
+        for doc_id, (ref, caption, source) in enumerate(docs):
+            offsets.append(f.tell())
+            f.write(json.dumps({'ref': ref, 'caption': caption, 'source': source}).encode('utf-8') + b'\n')
+            for term in set(tokenize(caption)):
+                postings[term].append(doc_id)
+        offsets.append(f.tell())
+    np.array(offsets, dtype='<u8').tofile(os.path.join(segment_dir, 'docs.idx'))
+
+    entries = np.zeros(len(postings), dtype=TERM_ENTRY)
+    with open(os.path.join(segment_dir, 'terms.bin'), 'wb') as terms, \
+            open(os.path.join(segment_dir, 'postings.bin'), 'wb') as postings_file:
+        # sorted by utf-8 bytes, the order lookups binary search in
+        for i, (encoded, term) in enumerate(sorted((term.encode('utf-8'), term) for term in postings)):
+            data = encode_postings(postings[term])
+            entries[i] = (terms.tell(), len(encoded), postings_file.tell(), len(data), len(postings[term]))
+            terms.write(encoded)
+            postings_file.write(data)
+    entries.tofile(os.path.join(segment_dir, 'terms.idx'))
+
+
+def update(index_dir, output_dir):
+    """Index the output files that are new or changed since the last update. Returns the new docs' count."""
+    with locked(index_dir):
+        return _update(index_dir, output_dir)
+
+
+def _update(index_dir, output_dir):
+    manifest = load_manifest(index_dir)
+    sources = manifest['sources']
+    segments = {segment['name']: segment for segment in manifest['segments']}
+
+    docs, added = [], {}
+    for path in sorted(output_files(output_dir)):
+        source = os.path.relpath(path, output_dir)
+        stat = os.stat(path)
+        known = sources.get(source)
+        if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+            continue
+        if known:
+            # its old figures stay in their segment but no longer match
+            segments[known['segment']]['deleted'].append([known['start'], known['end']])
+        try:
+            figures = figures_in(path)
+        except Exception:
+            continue
+        start = len(docs)
+        docs.extend((ref, caption, source) for ref, caption in figures)
+        added[source] = {'start': start, 'end': len(docs), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    if added:
+        name = new_segment_name(index_dir)
+        write_segment(os.path.join(index_dir, name), docs)
+        manifest['segments'].append({'name': name, 'docs': len(docs), 'deleted': []})
+        for source, entry in added.items():
+            sources[source] = dict(entry, segment=name)
+        save_manifest(index_dir, manifest)
+    return len(docs)
+
+
+class Segment:
+    """Read side of one segment; the files are memory-mapped, nothing is loaded up front."""
+
+    def __init__(self, segment_dir, deleted=()):
+        self.terms = self._map(os.path.join(segment_dir, 'terms.bin'))
+        self.postings = self._map(os.path.join(segment_dir, 'postings.bin'))
+        self.docs = self._map(os.path.join(segment_dir, 'docs.bin'))
+        self.entries = np.memmap(os.path.join(segment_dir, 'terms.idx'), dtype=TERM_ENTRY, mode='r') \
+            if os.path.getsize(os.path.join(segment_dir, 'terms.idx')) else np.zeros(0, dtype=TERM_ENTRY)
+        self.doc_offsets = np.memmap(os.path.join(segment_dir, 'docs.idx'), dtype='<u8', mode='r')
+        self.deleted = [tuple(span) for span in deleted]
+
+    @staticmethod
+    def _map(path):
+        with open(path, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _term(self, i):
+        entry = self.entries[i]
+        return self.terms[int(entry['term_offset']):int(entry['term_offset']) + int(entry['term_length'])]
+
+    def lookup(self, term):
+        """Doc ids of term as a sorted array."""
+        key = term.encode('utf-8')
+        low, high = 0, len(self.entries)
+        while low < high:
+            middle = (low + high) // 2
+            if self._term(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == len(self.entries) or self._term(low) != key:
+            return np.zeros(0, dtype=np.uint64)
+        entry = self.entries[low]
+        offset = int(entry['postings_offset'])
+        return decode_postings(self.postings[offset:offset + int(entry['postings_length'])])
+
+    def match(self, terms):
+        """Doc ids containing every term, rarest term first."""
+        lists = sorted((self.lookup(term) for term in terms), key=len)
+        if not lists:
+            return np.zeros(0, dtype=np.uint64)
+        result = lists[0]
+        for doc_ids in lists[1:]:
+            if not len(result):
+                break
+            result = np.intersect1d(result, doc_ids, assume_unique=True)
+        for start, end in self.deleted:
+            result = result[(result < start) | (result >= end)]
+        return result
+
+    def doc(self, doc_id):
+        start, end = int(self.doc_offsets[doc_id]), int(self.doc_offsets[doc_id + 1])
+        return json.loads(self.docs[start:end])
+
+
+class CaptionIndex:
+    """Query API over all segments of an index directory."""
+
+    def __init__(self, index_dir):
+        manifest = load_manifest(index_dir)
+        self.segments = [Segment(os.path.join(index_dir, segment['name']), segment['deleted'])
+                         for segment in manifest['segments']]
+
+    def search(self, query, limit=20):
+        """Figures whose caption contains every word of query, newest segment first."""
+        terms = tokenize(query)
+        results = []
+        if not terms:
+            return results
+        for segment in reversed(self.segments):
+            for doc_id in segment.match(terms)[:limit - len(results)]:
+                results.append(segment.doc(int(doc_id)))
+            if len(results) >= limit:
+                break
+        return results
+
+    def count(self, query):
+        terms = tokenize(query)
+        return sum(len(segment.match(terms)) for segment in self.segments) if terms else 0
+
+
+class Indexer:
+    """Indexes a processor's outputs while it runs, see update()."""
+
+    def __init__(self, index_dir, output_dir):
+        self.index_dir = index_dir
+        self.output_dir = output_dir
+        self.last_update = None
+        self.docs = 0
+
+    def update(self, force=False):
+        """Index what was written since the last update; calls within UPDATE_INTERVAL seconds of it do nothing.
+
+        Every update walks the output directory and adds a segment, so the
+        final call passes force=True and compact() merges the segments.
+        """
+        now = time.monotonic()
+        if not force and self.last_update is not None and now - self.last_update < UPDATE_INTERVAL:
+            return 0
+        self.last_update = now
+        added = update(self.index_dir, self.output_dir)
+        self.docs += added
+        return added
+
+
+def compact(index_dir):
+    """Rewrite all live docs into a single segment."""
+    with locked(index_dir):
+        return _compact(index_dir)
+
+
+def _compact(index_dir):
+    manifest = load_manifest(index_dir)
+    index = CaptionIndex(index_dir)
+    docs, sources = [], {}
+    for segment, entry in zip(index.segments, manifest['segments']):
+        for doc_id in range(entry['docs']):
+            if any(start <= doc_id < end for start, end in segment.deleted):
+                continue
+            doc = segment.doc(doc_id)
+            docs.append((doc['ref'], doc['caption'], doc['source']))
+    name = new_segment_name(index_dir)
+    write_segment(os.path.join(index_dir, name), docs)
+    # sources are contiguous within the new segment, in the order they were read
+    for doc_id, (ref, caption, source) in enumerate(docs):
+        span = sources.setdefault(source, dict(manifest['sources'][source], segment=name, start=doc_id))
+        span['end'] = doc_id + 1
+    for source, entry in manifest['sources'].items():
+        if source not in sources:
+            sources[source] = dict(entry, segment=name, start=0, end=0)
+    old = [entry['name'] for entry in manifest['segments']]
+    save_manifest(index_dir, {'segments': [{'name': name, 'docs': len(docs), 'deleted': []}], 'sources': sources})
+    for segment_name in old:
+        segment_dir = os.path.join(index_dir, segment_name)
+        for file_name in os.listdir(segment_dir):
+            os.remove(os.path.join(segment_dir, file_name))
+        os.rmdir(segment_dir)
+    return len(docs)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build and query an inverted index of figure captions.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    update_parser = subparsers.add_parser('update', help='Index output files that are new or changed.')
+    update_parser.add_argument('--output_dir', type=str, required=True, help='dataset/ or output/ of a processor.')
+    update_parser.add_argument('--index_dir', type=str, default='caption_index')
+    compact_parser = subparsers.add_parser('compact', help='Merge all segments into one.')
+    compact_parser.add_argument('--index_dir', type=str, default='caption_index')
+    query_parser = subparsers.add_parser('query', help='Figures whose caption contains all the words.')
+    query_parser.add_argument('words', nargs='+')
+    query_parser.add_argument('--index_dir', type=str, default='caption_index')
+    query_parser.add_argument('--limit', type=int, default=20)
+    query_parser.add_argument('--json', action='store_true', help='Print one JSON object per figure.')
+    args = parser.parse_args()
+
+    if args.command == 'update':
+        print(f"Indexed {update(args.index_dir, args.output_dir)} new figures")
+    elif args.command == 'compact':
+        print(f"Compacted to {compact(args.index_dir)} figures")
+    else:
+        start = time.perf_counter()
+        index = CaptionIndex(args.index_dir)
+        query = ' '.join(args.words)
+        results = index.search(query, limit=args.limit)
+        for doc in results:
+            print(json.dumps(doc) if args.json else f"{doc['ref']}\t{doc['caption'][:120]}")
+        print(f"{index.count(query)} matches in {(time.perf_counter() - start) * 1000:.1f} ms")
@@ -0,0 +1,6 @@
+# The extraction engine shared by every processor: sources are read, parsed,
+# their figure references resolved, figures rendered, and the result written
+# by one or more output plugins (see outputs.py).
+from .pipeline import Engine, Paper, PIPELINE_VERSIONS, STAGE_COMPONENTS
+from .outputs import (Output, InterleavedOutput, CaptionParquetOutput, InterleavedListOutput, TextFigureJsonOutput,
+                      ImagesOnlyJsonOutput, FigureIROutput, output_paper_id)
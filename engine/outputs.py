@@ -0,0 +1,326 @@
+import os
+import re
+import json
+import logging
+import threading
+import pandas as pd
+import metrics
+import figure_ir
+import partitions
+from . import records, render
+
+
+def output_paper_id(name):
+    # remove .tar.gz and replace . with _
+    return os.path.splitext(name)[0].replace('.', '_')
+
+
+def arxiv_paper_id(name):
+    """2301_00001 for arXiv-2301.00001.tar.gz, 'unknown' when the name has no arXiv id."""
+    match = re.search(r'(?:arXiv-)?(\d+\.\d+)', name)
+    return match.group(1).replace('.', '_') if match else 'unknown'
+
+
+def figure_files(paper, items, only=None):
+    """{index in items: file} of the figure items the source has a file for and the figure filter keeps.
+
+    With only, just the items at those indexes are looked at.
+    """
+    found = {}
+    for i, item in enumerate(items):
+        if item[0] == 'figure' and (only is None or i in only):
+            path = paper.resolve(item[3])
+            if path:
+                found[i] = path
+    reasons = paper.filter_figures(list(found.values()))
+    return {i: path for (i, path), reason in zip(found.items(), reasons) if reason is None}
+
+
+def first_images(items):
+    """Indexes of the first image item of each figure of one .tex file.
+
+    A figure with several images gives one item per image; outputs that
+    write one record per figure, as gz_raw and v2processor always did,
+    keep only its first image.
+    """
+    seen, first = set(), set()
+    for i, item in enumerate(items):
+        # the items of one figure share its offset in the file
+        if item[0] == 'figure' and item[5] not in seen:
+            seen.add(item[5])
+            first.add(i)
+    return first
+
+
+def paper_items(paper):
+    """The items of all .tex files of a paper, in order."""
+    return [item for tex_file, items, image_paths in paper.parsed for item in items]
+
+
+class Output:
+    """One output shape. write() takes what it needs from the paper's stages.
+
+    A partitioned output writes each paper under its yymm (or
+    category/yymm) directory and adds what it wrote to the catalog there.
+    """
+
+    def __init__(self, output_dir, partitioned=False, shard=None):
+        self.output_dir = output_dir
+        self.partitioned = partitioned
+        self.catalog = partitions.Catalog(output_dir, shard) if partitioned else None
+        # where the paper being written goes, and what it wrote; per thread,
+        # as process_parallel.py writes papers from several threads at once
+        self._current = threading.local()
+
+    def directory_for(self, name):
+        """The directory the outputs of the archive name go to."""
+        return partitions.partition_dir(self.output_dir, name) if self.partitioned else self.output_dir
+
+    @property
+    def directory(self):
+        return getattr(self._current, 'directory', self.output_dir)
+
+    @property
+    def written(self):
+        return self._current.__dict__.setdefault('written', set())
+
+    @property
+    def records(self):
+        return getattr(self._current, 'records', 0)
+
+    def emit(self, paper):
+        """Write one paper and, when partitioned, catalogue it."""
+        current = self._current
+        current.directory = self.directory_for(paper.name)
+        current.written = set()
+        current.records = 0
+        self.write(paper)
+        if self.catalog and current.written:
+            paths = [path for path in current.written if os.path.exists(path)]
+            self.catalog.add(partitions.paper_id(paper.name), partitions.partition(paper.name),
+                             current.records, sum(os.path.getsize(path) for path in paths), len(paths))
+
+    def write(self, paper):
+        raise NotImplementedError
+
+    def path(self, name):
+        path = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.written.add(path)
+        return path
+
+    def count_records(self, count):
+        self._current.records = self.records + count
+        metrics.count('records_written', count)
+
+    def _png(self, path, paper_id, index):
+        """The figure saved as <paper_id>_<index>.png under figures/, or None if it cannot be read."""
+        output_path = self.path(os.path.join('figures', f'{paper_id}_{index}.png'))
+        try:
+            render.save_png(path, output_path)
+        except Exception as e:
+            logging.debug(f"Error converting figure {path}: {e}")
+            metrics.count('errors_image')
+            return None
+        metrics.count('figures_written')
+        return output_path
+
+    def _copy(self, path, output_name):
+        """The figure copied to figures/output_name, or None if that failed."""
+        output_path = self.path(os.path.join('figures', output_name))
+        try:
+            render.copy_figure(path, output_path)
+        except Exception as e:
+            logging.debug(f"Error copying figure {path}: {e}")
+            metrics.count('errors_image')
+            return None
+        metrics.count('figures_written')
+        return output_path
+
+
+class InterleavedOutput(Output):
+    """<paper_id>.json with interleaved texts, images and captions, and <paper_id>.tiff with the figures."""
+
+    def write(self, paper):
+        paper_id = output_paper_id(paper.name)
+        output_path = self.path(f"{paper_id}.json")
+        for res, (tiff, rejected) in zip(paper.records, paper.rendered):
+            if tiff is None:
+                continue
+            res = records.drop_figures(res, set(rejected))
+            res = dict(res, images=[f"{paper_id}_{image}" if image else None for image in res['images']])
+            self.append(paper_id, output_path, res, tiff)
+
+    @metrics.timed('write')
+    def append(self, paper_id, output_path, res, tiff):
+        records = len(res['texts'])
+        if os.path.exists(output_path):
+            # open .json file and append to it
+            with open(output_path, 'r') as f:
+                existing_data = json.load(f)
+                res['texts'] = existing_data['texts'] + res['texts']
+                res['images'] = existing_data['images'] + res['images']
+                res['captions'] = existing_data['captions'] + res['captions']
+
+        #if tiff exists, append to it
+        tiff_output_path = self.path(f"{paper_id}.tiff")
+        if os.path.exists(tiff_output_path):
+            with open(tiff_output_path, 'rb') as f:
+                existing_tiff = f.read()
+                tiff = existing_tiff + tiff
+
+        with open(output_path, 'w') as f:
+            json.dump(res, f)
+        with open(tiff_output_path, 'wb') as f:
+            f.write(tiff)
+        self.count_records(records)
+        metrics.count('figures_written', len(res['captions']))
+        metrics.count('bytes_written', len(tiff))
+
+
+class CaptionParquetOutput(Output):
+    """<paper_id>.parquet of (image_filename, caption) rows, one per figure, with the figure files copied to figures/."""
+
+    def write(self, paper):
+        paper_id = output_paper_id(paper.name)
+        items, first = [], set()
+        for tex_file, tex_items, image_paths in paper.parsed:
+            first.update(len(items) + i for i in first_images(tex_items))
+            items.extend(tex_items)
+        dataset = []
+        for i, path in figure_files(paper, items, first).items():
+            # figures without a caption are no use as training pairs
+            caption = items[i][1]
+            if not caption:
+                continue
+            output_path = self._copy(path, f'{paper_id}_{os.path.basename(path)}')
+            if output_path:
+                dataset.append({'image_filename': output_path, 'caption': caption})
+        self.save(dataset, paper_id)
+
+    @metrics.timed('write')
+    def save(self, dataset, paper_id):
+        if not dataset:
+            return
+        pd.DataFrame(dataset).to_parquet(self.path(f'{paper_id}.parquet'))
+        self.count_records(len(dataset))
+
+
+class InterleavedListOutput(Output):
+    """<paper_id>_<tex name>.json per .tex file: a list of texts and ['FIGURE:', image name] pairs, one per figure."""
+
+    def write(self, paper):
+        paper_id = arxiv_paper_id(paper.name)
+        for tex_file, items, image_paths in paper.parsed:
+            figures = figure_files(paper, items, first_images(items))
+            interleaved_list = []
+            for i, (kind, raw, image, image_path, label, position) in enumerate(items):
+                if kind == 'section':
+                    interleaved_list.append(raw)
+                elif kind == 'figure':
+                    if i in figures:
+                        prefixed_image_filename = f"{paper_id}_{os.path.basename(image_path)}"
+                        if self._copy(figures[i], prefixed_image_filename):
+                            interleaved_list.append(('FIGURE:', prefixed_image_filename))
+                else:
+                    text_content = records.clean_text_content(raw)
+                    if text_content:
+                        interleaved_list.append(text_content)
+
+            if not interleaved_list:
+                continue
+
+            for i in range(len(interleaved_list) - 1):
+                if i >= len(interleaved_list) - 1:
+                    break
+                if isinstance(interleaved_list[i], str) and isinstance(interleaved_list[i + 1], str) and interleaved_list[i] == interleaved_list[i + 1]:
+                    interleaved_list.pop(i + 1)
+
+            i = 0
+            while i < len(interleaved_list) - 1:
+                if isinstance(interleaved_list[i], str) and isinstance(interleaved_list[i + 1], str) and not interleaved_list[i].endswith(' ') and not interleaved_list[i + 1].startswith(' '):
+                    interleaved_list[i] = interleaved_list[i] + ' ' + interleaved_list[i + 1]
+                    interleaved_list.pop(i + 1)
+                else:
+                    i += 1
+
+            self.save(tex_file, paper_id, interleaved_list)
+
+    @metrics.timed('write')
+    def save(self, tex_file, paper_id, interleaved_list):
+        output_filename = f"{paper_id}_{os.path.splitext(os.path.basename(tex_file))[0]}.json"
+        with open(self.path(output_filename), 'w') as f:
+            json.dump(interleaved_list, f, indent=2)
+        self.count_records(len(interleaved_list))
+
+
+class TextFigureJsonOutput(Output):
+    """<paper_id>_full.json alternating {'text'} and {'image', 'label', 'caption'} entries.
+
+    The figures alone also go to <paper_id>_image_caption.json, and their
+    files are saved as PNG.
+    """
+
+    def write(self, paper):
+        paper_id = output_paper_id(paper.name)
+        items = paper_items(paper)
+        figures = figure_files(paper, items)
+        full, image_captions, texts = [], [], []
+        index = 0
+        for i, (kind, raw, image, image_path, label, position) in enumerate(items):
+            if kind != 'figure':
+                text = raw if kind == 'section' else records.clean_text_content(raw)
+                if text:
+                    texts.append(text)
+                continue
+            full.append({'text': ' '.join(texts)})
+            texts = []
+            image = self._png(figures[i], paper_id, index) if i in figures else None
+            index += 1
+            if image:
+                image_data = {'image': image, 'label': label or '', 'caption': raw or ''}
+                full.append(image_data)
+                image_captions.append(image_data)
+        full.append({'text': ' '.join(texts)})
+        self.save(full, paper_id, 'full')
+        self.save(image_captions, paper_id, 'image_caption')
+
+    @metrics.timed('write')
+    def save(self, dataset, paper_id, suffix):
+        if dataset:
+            with open(self.path(f'{paper_id}_{suffix}.json'), 'w', encoding='utf-8') as f:
+                json.dump(dataset, f, ensure_ascii=False, indent=4)
+            self.count_records(len(dataset))
+
+
+class ImagesOnlyJsonOutput(Output):
+    """<paper_id>_imagesonly.json of {'image_filename', 'caption', 'label'} per captioned figure, saved as PNG."""
+
+    def write(self, paper):
+        paper_id = output_paper_id(paper.name)
+        items = paper_items(paper)
+        figures = figure_files(paper, items)
+        dataset = []
+        for index, i in enumerate(i for i, item in enumerate(items) if item[0] == 'figure'):
+            kind, caption, image, image_path, label, position = items[i]
+            if not caption or i not in figures:
+                continue
+            image = self._png(figures[i], paper_id, index)
+            if not image:
+                continue
+            dataset.append({
+                'image_filename': image,
+                'caption': caption,
+                'label': label,
+            })
+        if dataset:
+            with open(self.path(f'{paper_id}_imagesonly.json'), 'w', encoding='utf-8') as f:
+                json.dump(dataset, f, ensure_ascii=False, indent=4)
+            self.count_records(len(dataset))
+
+
+class FigureIROutput(Output):
+    """ir/<paper_id>.parquet with the paper's parsed items, see figure_ir.py."""
+
+    def write(self, paper):
+        figure_ir.write_ir(self.output_dir, output_paper_id(paper.name), paper.parsed, paper.rendered)
@@ -0,0 +1,134 @@
+import os
+import logging
+from TexSoup import TexSoup, TexNode
+import metrics
+import tex_macros
+from . import read
+
+
+def parse_source(extract_dir, macros=None):
+    """parse_tex_file() of every .tex file of an unpacked source.
+
+    Returns the (relative path, items, image paths) of each file that parsed
+    and the number of files that did not.
+    """
+    parsed, errors = [], 0
+    for tex_path in read.tex_files(extract_dir):
+        try:
+            parsed.append((os.path.relpath(tex_path, extract_dir),) + parse_tex_file(tex_path, macros))
+        except Exception as e:
+            logging.debug(f"Error processing {tex_path}: {e}")
+            metrics.count('errors_process')
+            errors += 1
+    return parsed, errors
+
+
+def parse_tex_file(tex_path, macros=None):
+    """Walk one .tex file into raw items and the figure files they use.
+
+    Items are (kind, raw TeX, output image name, image path, label, offset)
+    tuples with kind 'section', 'text' or 'figure'; a figure with several
+    images gives one item per image.
+
+    Nothing here depends on the cleaner or on the archive's name, so the
+    result can be cached by content hash and reused when either changes.
+    Author macros that produce figures are expanded first, from macros or
+    else from the file's own definitions.
+    """
+    items = []
+    image_paths = []
+    seen_images = set()
+    with open(tex_path, 'r', encoding='utf-8') as f:
+        tex_content = tex_macros.expand(f.read(), macros)
+
+        if tex_content.find(r'\begin{document}') != -1:
+            tex_content = tex_content[tex_content.find(r'\begin{document}'):]
+
+        with metrics.stage('parse'):
+            soup = TexSoup(tex_content, tolerance=1)
+
+        def traverse_and_interleave(node):
+            if isinstance(node, TexNode):
+                if node.name == 'section':
+                    section_title = node.string
+                    if section_title:
+                        items.append(('section', section_title, None, None, None, node.position))
+                elif node.name in ['figure', 'includegraphics', 'epsfig', 'epsfbox']:
+                    image_filenames = []
+                    caption = None
+                    label = None
+                    if node.name == 'figure':
+                        includegraphics_nodes = node.find_all('includegraphics')
+                        epsfig_nodes = node.find_all('epsfig')
+                        epsfbox_nodes = node.find_all('epsfbox')
+                        caption_node = node.find('caption')
+                        if caption_node:
+                            caption = caption_node.text
+                            if isinstance(caption, list):
+                                caption = ' '.join(caption)
+                        label_node = node.find('label')
+                        if label_node:
+                            label = label_node.string
+
+                        for includegraphics_node in includegraphics_nodes:
+                            image_filename = extract_image_filename(includegraphics_node)
+                            if image_filename:
+                                image_filenames.append(image_filename)
+
+                        for epsfig_node in epsfig_nodes:
+                            image_filename = extract_image_filename(epsfig_node)
+                            if image_filename:
+                                image_filenames.append(image_filename)
+
+                        for epsfbox_node in epsfbox_nodes:
+                            image_filename = extract_image_filename(epsfbox_node)
+                            if image_filename:
+                                image_filenames.append(image_filename)
+                    else:
+                        image_filename = extract_image_filename(node)
+                        if image_filename:
+                            image_filenames.append(image_filename)
+
+                    # drop repeats, keeping document order
+                    image_filenames = list(dict.fromkeys(image_filenames))
+
+                    for image_filename in image_filenames:
+                        #make extension .jpeg, the paper id is prefixed when writing
+                        output_image_filename = os.path.splitext(os.path.basename(image_filename))[0] + '.jpeg'
+
+                        if output_image_filename in seen_images:
+                            continue
+                        seen_images.add(output_image_filename)
+
+                        image_paths.append(image_filename)
+                        items.append(('figure', caption, output_image_filename, image_filename, label, node.position))
+
+            elif isinstance(node, str):
+                text_content = node.strip()
+                if text_content:
+                    items.append(('text', text_content, None, None, None, None))
+
+            for child in getattr(node, 'contents', []):
+                traverse_and_interleave(child)
+
+        traverse_and_interleave(soup)
+
+    return items, image_paths
+
+
+def extract_image_filename(node):
+    if node.name == 'epsfbox':
+        image_options = node.args
+        if isinstance(image_options, list) and len(image_options) > 0:
+            image_filename = str(image_options[0]).strip()
+            if image_filename.startswith('{') and image_filename.endswith('}'):
+                image_filename = image_filename[1:-1]
+            return image_filename
+    else:
+        image_options = node.args
+        if isinstance(image_options, list) and len(image_options) > 0:
+            image_filename = str(image_options[-1]).strip()
+            if image_filename.startswith('{') and image_filename.endswith('}'):
+                image_filename = image_filename[1:-1]
+            return image_filename
+    return None
@@ -0,0 +1,179 @@
+import os
+import json
+import logging
+import tempfile
+from contextlib import ExitStack
+from functools import cached_property
+import metrics
+import source_format
+import result_cache
+import memory_budget
+import figure_filter
+import tex_macros
+from . import read, parse, records, resolve, render, postscript
+
+# Bump a component's version whenever its output changes; only the cached
+# stages that depend on it are recomputed on the next run
+PIPELINE_VERSIONS = {'extractor': 4, 'cleaner': 1, 'encoder': 3, 'filter': 'off'}
+STAGE_COMPONENTS = {
+    'extract': ('extractor',),
+    'records': ('extractor', 'cleaner'),
+    'images': ('extractor', 'encoder', 'filter'),
+}
+
+
+class Paper:
+    """One source archive on its way through read -> parse -> resolve -> render -> write.
+
+    Every stage runs on first use and at most once, so outputs only pay for
+    the stages they need. With a result cache the parse, records and
+    rendered stages are looked up first, and the source is only unpacked
+    when one of them has to be computed.
+    """
+
+    def __init__(self, engine, path, name, kind, key=None):
+        self.engine = engine
+        self.path = path
+        self.name = name
+        self.kind = kind
+        # the archive's content hash when results are cached
+        self.key = key
+        # whether the source was unpacked, and whether that worked
+        self.unpacked = False
+        self.extracted = False
+        self._stack = ExitStack()
+        self._extract_dir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._stack.close()
+
+    @property
+    def extract_dir(self):
+        """The unpacked source, which lives until the paper is closed."""
+        if self._extract_dir is None:
+            self._stack.enter_context(memory_budget.reserve(source_format.unpacked_size(self.path, self.kind), 'extract'))
+            self._extract_dir = self._stack.enter_context(tempfile.TemporaryDirectory())
+            self.unpacked = True
+            self.extracted = read.extract(self.path, self._extract_dir, self.kind)
+            if not self.extracted:
+                self.engine.failed.add(self.path)
+                self.key = None
+            metrics.count('archives')
+            metrics.count('bytes_read', os.path.getsize(self.path))
+        return self._extract_dir
+
+    def _cached(self, stage):
+        if not self.key or not self.engine.cache:
+            return None
+        return self.engine.cache.get(self.key, stage, self.engine.fingerprint(stage))
+
+    def _store(self, stage, value):
+        if self.key and self.engine.cache:
+            self.engine.cache.put(self.key, stage, self.engine.fingerprint(stage), value)
+
+    @cached_property
+    def parsed(self):
+        """(tex file, items, image paths) of every .tex file, see parse.parse_tex_file()."""
+        parsed = self._cached('extract')
+        if parsed is None:
+            # figure macros are usually defined once in the main file's preamble
+            macros = tex_macros.archive_macros(self.extract_dir)
+            parsed, errors = parse.parse_source(self.extract_dir, macros)
+            if not errors:
+                self._store('extract', parsed)
+        return parsed
+
+    @cached_property
+    def records(self):
+        """The cleaned texts/images/captions record of every .tex file."""
+        cleaned = self._cached('records')
+        if cleaned is None:
+            cleaned = [records.build_record(items) for tex_file, items, image_paths in self.parsed]
+            self._store('records', cleaned)
+        return cleaned
+
+    @cached_property
+    def rendered(self):
+        """(TIFF of its figures or None, names of the figures the filter rejected) of every .tex file."""
+        rendered = self._cached('images')
+        if rendered is None:
+            rendered, errors = [], 0
+            for tex_file, items, image_paths in self.parsed:
+                try:
+                    paths = [self.resolve(image_path) for image_path in image_paths]
+                    if None in paths:
+                        raise FileNotFoundError(f"{image_paths[paths.index(None)]} is not in the source")
+                    tiff, rejected = render.render_images(paths, self.engine.figure_thresholds)
+                    names = [item[2] for item in items if item[0] == 'figure']
+                    rendered.append((tiff, [names[i] for i in rejected]))
+                except Exception as e:
+                    logging.debug(f"Error rendering figures of {self.name} in {tex_file}: {e}")
+                    metrics.count('errors_process')
+                    rendered.append((None, []))
+                    errors += 1
+            if not errors:
+                self._store('images', rendered)
+        return rendered
+
+    @cached_property
+    def files(self):
+        return resolve.file_index(self.extract_dir)
+
+    def resolve(self, reference):
+        """The file a figure reference points to, or None."""
+        return resolve.resolve(self.extract_dir, reference, self.files)
+
+    def filter_figures(self, paths):
+        """The reason the figure filter rejects each figure file for, None for those kept."""
+        if not self.engine.figure_thresholds or not paths:
+            return [None] * len(paths)
+        # PIL would start a Ghostscript per EPS and cannot open PDFs at all, so
+        # both are rendered here; those that fail to render are kept
+        images = list(paths)
+        ps = [i for i, path in enumerate(paths) if postscript.is_postscript(path)]
+        for i, image in zip(ps, postscript.rasterize([paths[i] for i in ps], render.raster_dpi)):
+            images[i] = image
+        for i, path in enumerate(paths):
+            if path.lower().endswith('.pdf'):
+                images[i] = render.pdf_preview(path) or path
+        return figure_filter.filter_images(images, self.engine.figure_thresholds)
+
+
+class Engine:
+    """Runs source archives through the shared stages into a list of output plugins."""
+
+    def __init__(self, outputs, cache=None, figure_thresholds=None):
+        self.outputs = outputs
+        self.cache = cache
+        self.figure_thresholds = figure_thresholds
+        self.versions = dict(PIPELINE_VERSIONS)
+        if figure_thresholds:
+            # cached renders are only reused under the same thresholds
+            self.versions['filter'] = json.dumps(figure_thresholds, sort_keys=True)
+        # sources that could not be unpacked
+        self.failed = set()
+
+    def fingerprint(self, stage):
+        return result_cache.fingerprint(self.versions, STAGE_COMPONENTS[stage])
+
+    def process(self, path, name=None):
+        """Write every output of one source archive; False if it has nothing to extract from."""
+        name = name or os.path.basename(path)
+        # PDF-only submissions are skipped without being opened as archives
+        kind = source_format.sniff(path)
+        metrics.count(f'sources_{kind.replace(".", "_")}')
+        if kind == source_format.PDF:
+            logging.debug(f"Skipping PDF-only submission {path}")
+            return False
+
+        key = result_cache.file_digest(path) if self.cache else None
+        with metrics.profile(name), Paper(self, path, name, kind, key) as paper:
+            for output in self.outputs:
+                output.emit(paper)
+        if key and not paper.unpacked:
+            metrics.count('cache_hits')
+        metrics.maybe_flush()
+        return True
@@ -0,0 +1,261 @@
+import os
+import re
+import glob
+import time
+import uuid
+import shutil
+import select
+import struct
+import atexit
+import logging
+import threading
+import tempfile
+import subprocess
+from PIL import Image
+import metrics
+
+# Figures Ghostscript renders instead of PIL (which starts a new gs per file)
+POSTSCRIPT_EXTENSIONS = ('.eps', '.ps', '.epsi', '.epsf')
+GHOSTSCRIPT = os.environ.get('GHOSTSCRIPT', 'gs')
+# Seconds one figure may take before the converter is killed and restarted
+FIGURE_TIMEOUT = 30
+# The converter is restarted after this many figures so leaks do not pile up
+WORKER_FIGURES = 500
+# Units of the CPU times in /proc/<pid>/stat
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+# Page size of PostScript without a bounding box (US letter, in points)
+DEFAULT_PAGE = (0, 0, 612, 792)
+
+BOUNDING_BOX = re.compile(rb'^%%(HiRes)?BoundingBox:[ \t]*(\(atend\)|[-+\d.eE]+[ \t]+[-+\d.eE]+[ \t]+[-+\d.eE]+[ \t]+[-+\d.eE]+)',
+                          re.MULTILINE)
+# DOS EPS files start with this header in front of the PostScript and a TIFF/WMF preview
+DOS_EPS = struct.Struct('<4sII')
+DOS_EPS_MAGIC = b'\xc5\xd0\xd3\xc6'
+HEADER_BYTES = 64 * 1024
+
+# One figure: render its first page to a file of its own and report whether it
+# raised an error. The figure runs inside save/restore with showpage bound to
+# stop, as a document includes an EPS, so whatever it leaves behind is undone.
+JOB = """<< /OutputFile ({output}) /HWResolution [{dpi} {dpi}] /PageSize [{width} {height}] >> setpagedevice
+/figure-state save def
+{llx} neg {lly} neg translate
+/showpage {{ stop }} bind def
+{{ ({source}) run }} stopped
+{{ $error /newerror get {{ $error /newerror false put 1 }} {{ 0 }} ifelse }} {{ 0 }} ifelse
+count 1 sub {{ exch pop }} repeat
+cleardictstack figure-state restore showpage
+0 eq {{ (\\n{marker} ok\\n) }} {{ (\\n{marker} error\\n) }} ifelse print flush
+"""
+
+
+def is_postscript(path):
+    return path.lower().endswith(POSTSCRIPT_EXTENSIONS)
+
+
+def _ps_section(path):
+    """(offset, length) of the PostScript in a DOS EPS file, None for plain PostScript."""
+    with open(path, 'rb') as f:
+        header = f.read(DOS_EPS.size)
+    if len(header) == DOS_EPS.size and header[:4] == DOS_EPS_MAGIC:
+        return DOS_EPS.unpack(header)[1:]
+    return None
+
+
+def bounding_box(path):
+    """(llx, lly, urx, ury) in points from the DSC comments, or None without a usable one."""
+    section = _ps_section(path)
+    start, length = section or (0, os.path.getsize(path))
+    with open(path, 'rb') as f:
+        f.seek(start)
+        head = f.read(min(length, HEADER_BYTES))
+        boxes = {bool(hires): box for hires, box in BOUNDING_BOX.findall(head)}
+        if b'(atend)' in boxes.values():
+            # the box is given in the trailer
+            f.seek(start + max(length - HEADER_BYTES, 0))
+            boxes = {bool(hires): box for hires, box in BOUNDING_BOX.findall(f.read(min(length, HEADER_BYTES)))}
+    for hires in (True, False):
+        try:
+            llx, lly, urx, ury = (float(value) for value in boxes[hires].split())
+        except (KeyError, ValueError):
+            continue
+        if urx > llx and ury > lly:
+            return llx, lly, urx, ury
+    return None
+
+
+def page_box(path):
+    """The area of a figure that is rendered: its bounding box, or a letter page."""
+    try:
+        return bounding_box(path) or DEFAULT_PAGE
+    except OSError:
+        return DEFAULT_PAGE
+
+
+def _ps_string(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+class Converter:
+    """A long-lived Ghostscript that renders one figure per job sent to its stdin.
+
+    Figures are copied into the converter's own directory, the only place
+    it may read or write under -dSAFER. A job that takes longer than its
+    timeout kills the converter; the next job starts a new one.
+    """
+
+    def __init__(self):
+        self.dir = tempfile.mkdtemp(prefix='gs-')
+        self.marker = f"figure-done-{uuid.uuid4().hex}"
+        self.jobs = 0
+        self.owner = os.getpid()
+        try:
+            self.process = subprocess.Popen(
+                [GHOSTSCRIPT, '-q', '-dSAFER', '-dNOPAUSE', '-dNOPROMPT', '-sDEVICE=png16m',
+                 '-dTextAlphaBits=4', '-dGraphicsAlphaBits=4', f'--permit-file-all={self.dir}/*',
+                 f'-sOutputFile={self.dir}/start-%d.png', '-'],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        except OSError:
+            shutil.rmtree(self.dir, ignore_errors=True)
+            raise
+        metrics.count('postscript_converters')
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def render(self, path, box, dpi, timeout=FIGURE_TIMEOUT):
+        """The first page of a PostScript figure as an RGB image; raises on errors and timeouts."""
+        self.jobs += 1
+        source = os.path.join(self.dir, f'{self.jobs}.ps')
+        section = _ps_section(path)
+        with open(path, 'rb') as src, open(source, 'wb') as dst:
+            if section:
+                src.seek(section[0])
+                dst.write(src.read(section[1]))
+            else:
+                shutil.copyfileobj(src, dst)
+        llx, lly, urx, ury = box
+        job = JOB.format(output=_ps_string(os.path.join(self.dir, f'{self.jobs}-%d.png')), dpi=dpi,
+                         width=urx - llx, height=ury - lly, llx=llx, lly=lly,
+                         source=_ps_string(source), marker=self.marker)
+        try:
+            self.process.stdin.write(job.encode('utf-8'))
+            self.process.stdin.flush()
+            status = self._wait(timeout)
+            pages = sorted(glob.glob(os.path.join(self.dir, f'{self.jobs}-*.png')))
+            if status != 'ok' or not pages:
+                raise ValueError(f"Ghostscript could not render {path}")
+            with Image.open(pages[0]) as page:
+                return page.convert('RGB')
+        finally:
+            for leftover in [source] + glob.glob(os.path.join(self.dir, f'{self.jobs}-*.png')):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+    def _wait(self, timeout):
+        """'ok' or 'error' once the current job is done; kills the converter after timeout seconds."""
+        output = b''
+        fd = self.process.stdout.fileno()
+        end = f"{self.marker} ".encode('ascii')
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                metrics.count('postscript_timeouts')
+                self.process.kill()
+                self.close()
+                raise TimeoutError(f"Ghostscript took longer than {timeout}s")
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                self.close()
+                raise ValueError("Ghostscript exited")
+            output += chunk
+            at = output.find(end)
+            if at >= 0 and output.find(b'\n', at) >= 0:
+                return output[at + len(end):output.find(b'\n', at)].decode('ascii')
+            # the figure may print; only the tail can still hold the marker
+            output = output[-len(end) - 16:]
+
+    def close(self):
+        if self.alive():
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+# The converter of each thread, started on first use and again after a fork:
+# jobs and their end markers share one stdin and stdout, so a converter
+# must never be used by two threads at once
+_local = threading.local()
+# every converter started, for closing them at exit
+_converters = []
+_converters_lock = threading.Lock()
+
+
+def _get_converter():
+    converter = getattr(_local, 'converter', None)
+    if converter is None or converter.owner != os.getpid() or not converter.alive() \
+            or converter.jobs >= WORKER_FIGURES:
+        if converter is not None and converter.owner == os.getpid():
+            converter.close()
+        converter = _local.converter = Converter()
+        with _converters_lock:
+            _converters[:] = [c for c in _converters if c.owner == os.getpid() and c.alive()] + [converter]
+    return converter
+
+
+def _process_cpu(pid):
+    """User and system CPU seconds of a process so far, 0 where /proc is not available."""
+    try:
+        with open(f'/proc/{pid}/stat', 'r') as f:
+            # fields after the parenthesised command name, utime and stime are the 12th and 13th
+            fields = f.read().rsplit(')', 1)[1].split()
+    except (OSError, IndexError):
+        return 0.0
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def cpu_seconds():
+    """CPU seconds of this process's converters that have not been reaped yet.
+
+    os.times() only counts children once they are waited for, and a
+    converter lives for many figures; once one is reaped its time moves
+    from here to os.times(), so the sum of both never jumps.
+    """
+    with _converters_lock:
+        converters = [c for c in _converters if c.owner == os.getpid() and c.process.returncode is None]
+    return sum(_process_cpu(converter.process.pid) for converter in converters)
+
+
+@atexit.register
+def close():
+    """Stop this process's converters, of all threads."""
+    with _converters_lock:
+        for converter in _converters:
+            if converter.owner == os.getpid():
+                converter.close()
+        _converters.clear()
+    _local.converter = None
+
+
+def rasterize(paths, dpi_for, timeout=FIGURE_TIMEOUT):
+    """Render the first page of each PostScript figure; an RGB image per path, None for those that failed.
+
+    dpi_for(width, height) gives the resolution of a figure from its size in
+    points, so the DPI and pixel caps are the ones PDFs are rendered with.
+    All figures go through the same converter process.
+    """
+    images = []
+    for path in paths:
+        box = page_box(path)
+        try:
+            images.append(_get_converter().render(path, box, dpi_for(box[2] - box[0], box[3] - box[1]), timeout))
+            metrics.count('figures_postscript')
+        except Exception as e:
+            logging.debug(f"Error rendering {path}: {e}")
+            metrics.count('errors_postscript')
+            images.append(None)
+    return images
@@ -0,0 +1,23 @@
+import os
+import logging
+import metrics
+import source_format
+
+
+@metrics.timed('extract')
+def extract(source_path, extract_dir, kind=None):
+    """Unpack one source into extract_dir; False if it cannot be read."""
+    try:
+        source_format.extract_source(source_path, extract_dir, kind)
+        return True
+    except Exception as e:
+        logging.debug(f"Error extracting {source_path}: {e}")
+        metrics.count('errors_extract')
+        return False
+
+
+def tex_files(extract_dir):
+    """The .tex files of an unpacked source, in a stable order."""
+    return sorted(os.path.join(root, name)
+                  for root, dirs, files in os.walk(extract_dir)
+                  for name in files if name.endswith('.tex'))
@@ -0,0 +1,95 @@
+import re
+import metrics
+
+# clean_text_content applies these in order; figure_ir applies the same
+# rules to whole columns, so any change here reaches both
+CLEAN_RULES = [(re.compile(pattern, flags), repl) for pattern, repl, flags in [
+    (r'\\[a-zA-Z]+', '', 0),
+    (r'\\[^a-zA-Z]', '', 0),
+    (r'\{[^}]*\}', '', 0),
+    (r'\$.*?\$', '', 0),
+    (r'%.*', '', 0),
+    (r'width=[\d.]+', '', 0),
+    (r'[\d.]+pt', '', 0),
+    (r'[\d.]+in', '', 0),
+    (r'[\d.]+em', '', 0),
+    (r',\s*trim=[\d\s]+,\s*clip\s+figures/[\w.]+', '', 0),
+    (r',\s*trim=[\d\s]+\s+figures/[\w.]+', '', 0),
+    (r'[\w./]+\.(pdf|png|jpg|jpeg|gif|bmp|tiff|svg)', '', re.IGNORECASE),
+    (r'trim=[\d\s.]+_?', '', 0),
+    (r'\s+', ' ', 0),
+    # strip(), once whitespace runs are single spaces
+    (r'^ | $', '', 0),
+    (r'^\s*-\s+', '', 0),
+    (r'^\s*\\\[\s*\\\]\s*', '', 0),
+    (r'\s+', ' ', 0),
+    (r'^ | $', '', 0),
+    (r'\\caption{([^}]*)}', r'\1', 0),
+]]
+
+
+@metrics.timed('clean')
+def clean_text_content(text):
+    for pattern, repl in CLEAN_RULES:
+        text = pattern.sub(repl, text)
+    return text
+
+
+def build_record(items):
+    """Clean the raw items of one .tex file into the texts/images/captions lists."""
+    kinds = [item[0] for item in items]
+    texts = [clean_text_content(item[1]) if item[0] != 'section' and item[1] is not None else item[1]
+             for item in items]
+    return assemble_record(kinds, texts, [item[2] for item in items])
+
+
+def assemble_record(kinds, texts, images):
+    """Interleave already cleaned texts and captions with the image names of one .tex file."""
+    store_res = {'texts': [], 'images': [], 'captions': []}
+    for kind, text, image in zip(kinds, texts, images):
+        if kind == 'section':
+            store_res['texts'].append(text)
+            store_res['images'].append(None)
+        elif kind == 'figure':
+            store_res['texts'].append(None)
+            store_res['captions'].append(text)
+            store_res['images'].append(image)
+        elif text:
+            store_res['texts'].append(text)
+            store_res['images'].append(None)
+    return merge_adjacent(store_res)
+
+
+def merge_adjacent(store_res):
+    #combine any consecutive text elements, remove empty elements
+    for i in range(len(store_res['texts'])-1, 0, -1):
+        if store_res['texts'][i] is not None and store_res['texts'][i-1] is not None:
+            store_res['texts'][i-1] += ' ' + store_res['texts'][i]
+            store_res['texts'].pop(i)
+
+    for i in range(len(store_res['images'])-1, 0, -1):
+        if store_res['images'][i] is None and store_res['images'][i-1] is None:
+            store_res['images'].pop(i)
+
+    return store_res
+
+
+def drop_figures(res, rejected):
+    """Remove the figures named in rejected from an assembled record."""
+    if not rejected:
+        return res
+    # each figure left one None in texts, its name in images and its caption, in order
+    dropped = [image in rejected for image in res['images'] if image]
+    texts, figure = [], 0
+    for text in res['texts']:
+        if text is None:
+            if not dropped[figure]:
+                texts.append(None)
+            figure += 1
+        else:
+            texts.append(text)
+    return merge_adjacent({
+        'texts': texts,
+        'images': [image for image in res['images'] if image not in rejected],
+        'captions': [caption for caption, drop in zip(res['captions'], dropped) if not drop],
+    })
@@ -0,0 +1,148 @@
+import os
+import shutil
+from io import BytesIO
+from PIL import Image
+from pdf2image import convert_from_path, pdfinfo_from_path
+import metrics
+import memory_budget
+import figure_filter
+from . import postscript
+
+# Resolution PDF and PostScript figures are rasterized at (pdf2image's default)
+RASTER_DPI = 200
+# Pages so large they would exceed this many pixels at RASTER_DPI are rendered at a lower resolution
+MAX_PIXELS = 40_000_000
+# A JPEG-compressed TIFF is budgeted at this share of its decoded pixels
+ENCODE_RATIO = 0.25
+
+
+@metrics.timed('encode')
+def images_to_tiff_bytes(images, quality=90):
+    tiff_bytes = BytesIO()
+    images[0].save(tiff_bytes, format="TIFF", save_all=True, append_images=images[1:],
+                             quality=quality, compression="jpeg")
+    tiff_data = tiff_bytes.getvalue()
+    tiff_bytes.close()
+    return tiff_data
+
+
+def raster_dpi(width, height):
+    """Resolution a page of width x height points is rendered at: RASTER_DPI, lowered to stay within MAX_PIXELS."""
+    pixels = (width / 72 * RASTER_DPI) * (height / 72 * RASTER_DPI)
+    if pixels <= MAX_PIXELS:
+        return RASTER_DPI
+    return max(int(RASTER_DPI * (MAX_PIXELS / pixels) ** 0.5), 1)
+
+
+def pdf_page_size(image_path):
+    """(pages, width, height) of a PDF, the size in points of its first page."""
+    info = pdfinfo_from_path(image_path)
+    width, height = (float(value) for value in info['Page size'].split()[0:3:2])
+    return info['Pages'], width, height
+
+
+def pdf_preview(image_path):
+    """For the figure filter: a small render of a PDF's first page and its (width, height) in pixels
+    at the resolution it would be rasterized at. None if the PDF cannot be rendered.
+    """
+    try:
+        pages, width, height = pdf_page_size(image_path)
+        preview = convert_from_path(image_path, size=(figure_filter.THUMB_SIZE * 2, None), first_page=1, last_page=1)[0]
+    except Exception:
+        return None
+    dpi = raster_dpi(width, height)
+    return preview, (round(width / 72 * dpi), round(height / 72 * dpi))
+
+
+def rasterize_postscript(image_paths):
+    """The first page of every PostScript figure, rendered by one long-lived Ghostscript; raises if one fails."""
+    images = postscript.rasterize(image_paths, raster_dpi)
+    if None in images:
+        raise ValueError(f"Could not render {image_paths[images.index(None)]}")
+    return images
+
+
+def render_images(image_paths, thresholds=None):
+    """All figures of one .tex file as a multi-page TIFF, and the indices of the figures the filter rejected.
+
+    The TIFF is None when there are no figures or all of them were rejected.
+    """
+    if len(image_paths) == 0:
+        return None, []
+
+    pixel_bytes = sum(estimate_pixel_bytes(image_path) for image_path in image_paths)
+
+    # if pdf, convert then store as pillow, else store as pillow
+    pillows = []
+    # index into image_paths of every page, a PDF can have several
+    owners = []
+    with memory_budget.reserve(pixel_bytes, 'rasterize'):
+        with metrics.stage('rasterize'):
+            # EPS/PS figures of the file go to the converter together
+            ps_paths = [image_path for image_path in image_paths if postscript.is_postscript(image_path)]
+            ps_images = dict(zip(ps_paths, rasterize_postscript(ps_paths)))
+            for i, image_path in enumerate(image_paths):
+                if image_path.endswith('.pdf'):
+                    pdf_pillows = convert_from_path(image_path, fmt='jpeg', dpi=raster_dpi(*pdf_page_size(image_path)[1:]))
+                    pillows.extend(pdf_pillows)
+                    owners.extend([i] * len(pdf_pillows))
+                elif image_path in ps_images:
+                    pillows.append(ps_images[image_path])
+                    owners.append(i)
+                else:
+                    image = Image.open(image_path)
+                    pillows.append(image)
+                    owners.append(i)
+
+        # junk pages are dropped before the full resolution encode
+        rejected = []
+        if thresholds:
+            reasons = figure_filter.filter_images(pillows, thresholds)
+            kept = {owner for owner, reason in zip(owners, reasons) if reason is None}
+            rejected = [i for i in range(len(image_paths)) if i not in kept]
+            pillows = [pillow for pillow, reason in zip(pillows, reasons) if reason is None]
+            if not pillows:
+                return None, rejected
+
+        with memory_budget.reserve(pixel_bytes * ENCODE_RATIO, 'encode'):
+            return images_to_tiff_bytes(pillows), rejected
+
+
+def estimate_pixel_bytes(image_path):
+    """Decoded size of a figure, read from its header or the PDF's page count and size."""
+    try:
+        if image_path.endswith('.pdf'):
+            pages, width, height = pdf_page_size(image_path)
+            dpi = raster_dpi(width, height)
+            return int(pages * (width / 72 * dpi) * (height / 72 * dpi) * 3)
+        if postscript.is_postscript(image_path):
+            llx, lly, urx, ury = postscript.page_box(image_path)
+            dpi = raster_dpi(urx - llx, ury - lly)
+            return int((urx - llx) / 72 * dpi * (ury - lly) / 72 * dpi * 3)
+        with Image.open(image_path) as image:
+            return image.width * image.height * len(image.getbands())
+    except Exception:
+        return os.path.getsize(image_path) if os.path.exists(image_path) else 0
+
+
+def save_png(image_path, output_path):
+    """Write a figure (the first page of a PDF) as a PNG."""
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with memory_budget.reserve(estimate_pixel_bytes(image_path), 'rasterize'):
+        with metrics.stage('rasterize'):
+            if image_path.lower().endswith('.pdf'):
+                dpi = raster_dpi(*pdf_page_size(image_path)[1:])
+                image = convert_from_path(image_path, dpi=dpi, first_page=1, last_page=1)[0]
+            elif postscript.is_postscript(image_path):
+                image = rasterize_postscript([image_path])[0]
+            else:
+                image = Image.open(image_path)
+        with metrics.stage('encode'):
+            image.save(output_path, format='PNG')
+
+
+@metrics.timed('write')
+def copy_figure(image_path, output_path):
+    """Copy a figure file as it is."""
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    shutil.copy(image_path, output_path)
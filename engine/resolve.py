@@ -0,0 +1,45 @@
+import os
+import metrics
+
+# \includegraphics may leave the extension out; these are tried in order
+GRAPHICS_EXTENSIONS = ('.pdf', '.png', '.jpg', '.jpeg', '.eps', '.ps')
+
+
+def file_index(extract_dir):
+    """Relative paths of the files of an unpacked source by base name."""
+    index = {}
+    for root, dirs, files in os.walk(extract_dir):
+        for name in files:
+            index.setdefault(name, []).append(os.path.relpath(os.path.join(root, name), extract_dir))
+    return index
+
+
+def _inside(path, extract_dir):
+    return os.path.realpath(path).startswith(os.path.realpath(extract_dir) + os.sep)
+
+
+@metrics.timed('resolve')
+def resolve(extract_dir, reference, index=None):
+    """Path of the file a figure reference points to, or None if the source does not have it.
+
+    The reference is tried as written, then with each graphics extension,
+    then by base name anywhere in the source (index is file_index()).
+    Nothing outside extract_dir is ever returned.
+    """
+    reference = reference.strip().strip('"') if reference else ''
+    if not reference:
+        return None
+    candidates = [reference]
+    if os.path.splitext(reference)[1].lower() not in GRAPHICS_EXTENSIONS:
+        candidates += [reference + extension for extension in GRAPHICS_EXTENSIONS]
+    for candidate in candidates:
+        path = os.path.join(extract_dir, candidate)
+        if os.path.isfile(path) and _inside(path, extract_dir):
+            return path
+    # the reference names a directory the file is not in, e.g. a flattened upload
+    for candidate in candidates if index else []:
+        for match in sorted(index.get(os.path.basename(candidate), [])):
+            path = os.path.join(extract_dir, match)
+            if _inside(path, extract_dir):
+                return path
+    return None
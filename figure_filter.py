@@ -0,0 +1,121 @@
+import numpy as np
+from PIL import Image
+import metrics
+
+# Every figure is reduced to a THUMB_SIZE x THUMB_SIZE grayscale thumbnail
+# so a whole batch is one (N, THUMB_SIZE, THUMB_SIZE) array
+THUMB_SIZE = 64
+
+# Reasons are checked in this order and a figure gets the first that applies:
+#   tiny          shorter side below min_side pixels (icons, bullets)
+#   aspect        longer side more than max_aspect times the shorter (rules, spacers)
+#   blank         thumbnail entropy below min_entropy bits (a single flat colour)
+#   mostly_white  share of pixels darker than white_level below min_ink
+DEFAULT_THRESHOLDS = {
+    'min_side': 32,
+    'max_aspect': 12.0,
+    'min_entropy': 0.5,
+    'white_level': 245,
+    'min_ink': 0.002,
+}
+
+
+def parse_thresholds(value):
+    """'min_side=48,max_aspect=8' -> DEFAULT_THRESHOLDS with those two replaced."""
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    for part in filter(None, (value or '').split(',')):
+        name, _, number = part.partition('=')
+        name = name.strip()
+        if name not in thresholds:
+            raise ValueError(f"Unknown figure filter threshold {name!r}, expected one of {', '.join(thresholds)}")
+        thresholds[name] = type(thresholds[name])(float(number))
+    return thresholds
+
+
+def thumbnail(image, draft=False):
+    """Grayscale thumbnail of a PIL image, transparent areas counted as white.
+
+    With draft, JPEGs are decoded straight at a reduced scale; only for
+    images nobody decodes at full size afterwards.
+    """
+    if draft:
+        image.draft('L', (THUMB_SIZE * 2, THUMB_SIZE * 2))
+    if 'A' in image.getbands() or 'transparency' in image.info:
+        small = image.convert('RGBA').resize((THUMB_SIZE, THUMB_SIZE), Image.BILINEAR, reducing_gap=2.0)
+        background = Image.new('RGBA', small.size, 'white')
+        background.alpha_composite(small)
+        small = background
+    else:
+        small = image.resize((THUMB_SIZE, THUMB_SIZE), Image.BILINEAR, reducing_gap=2.0)
+    return np.asarray(small.convert('L'), dtype=np.uint8)
+
+
+def batch_stats(thumbs, sizes, white_level=DEFAULT_THRESHOLDS['white_level']):
+    """Per-figure statistics of a stack of thumbnails and the original (width, height) sizes."""
+    thumbs = np.asarray(thumbs, dtype=np.uint8).reshape(len(sizes), -1)
+    sizes = np.asarray(sizes, dtype=np.float64).reshape(len(sizes), 2)
+    short_side = sizes.min(axis=1)
+    long_side = sizes.max(axis=1)
+    # one 256-bin histogram per row in a single bincount
+    offsets = np.arange(len(thumbs))[:, None] * 256
+    histograms = np.bincount((thumbs + offsets).ravel(), minlength=256 * len(thumbs)).reshape(len(thumbs), 256)
+    p = histograms / thumbs.shape[1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        entropy = -np.where(p > 0, p * np.log2(p), 0).sum(axis=1)
+    return {
+        'short_side': short_side,
+        'aspect': long_side / np.maximum(short_side, 1),
+        'entropy': entropy,
+        'ink': (thumbs < white_level).mean(axis=1),
+    }
+
+
+def reject_reasons(stats, thresholds=DEFAULT_THRESHOLDS):
+    """The reason each figure is rejected for, or None if it is kept."""
+    checks = [
+        ('tiny', stats['short_side'] < thresholds['min_side']),
+        ('aspect', stats['aspect'] > thresholds['max_aspect']),
+        ('blank', stats['entropy'] < thresholds['min_entropy']),
+        ('mostly_white', stats['ink'] < thresholds['min_ink']),
+    ]
+    reasons = [None] * len(stats['aspect'])
+    for reason, rejected in reversed(checks):
+        for i in np.flatnonzero(rejected):
+            reasons[i] = reason
+    return reasons
+
+
+@metrics.timed('filter')
+def filter_images(images, thresholds=DEFAULT_THRESHOLDS):
+    """Check a batch of PIL images (or paths); returns a reason or None per image.
+
+    An entry may also be a (preview, (width, height)) pair: a reduced render
+    of a figure, such as a PDF page, and the size the figure really has.
+    Images that cannot be decoded are kept, the full pipeline reports them.
+    """
+    thumbs, sizes, checked = [], [], []
+    for i, image in enumerate(images):
+        try:
+            if isinstance(image, tuple):
+                preview, size = image
+                thumb = thumbnail(preview)
+            elif isinstance(image, str):
+                with Image.open(image) as opened:
+                    size, thumb = opened.size, thumbnail(opened, draft=True)
+            else:
+                size, thumb = image.size, thumbnail(image)
+        except Exception:
+            continue
+        sizes.append(size)
+        thumbs.append(thumb)
+        checked.append(i)
+    reasons = [None] * len(images)
+    if checked:
+        stats = batch_stats(np.stack(thumbs), sizes, thresholds['white_level'])
+        for i, reason in zip(checked, reject_reasons(stats, thresholds)):
+            reasons[i] = reason
+    metrics.count('figures_checked', len(checked))
+    for reason in reasons:
+        if reason:
+            metrics.count(f'figures_rejected_{reason}')
+    return reasons
@@ -0,0 +1,144 @@
+import os
+import re
+import glob
+import json
+import argparse
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import metrics
+import partitions
+
+# One row per parsed item of a paper, in document order. raw holds the TeX as
+# parsed (caption TeX for figures), image the output figure name without the
+# paper id prefix, image_path the reference as written in the source, and
+# rendered whether the figures of that .tex file made it into the TIFF, and
+# rejected whether the figure filter dropped this figure.
+COLUMNS = ['paper_id', 'tex_file', 'seq', 'kind', 'raw', 'image', 'image_path', 'label', 'position', 'rendered',
+           'rejected']
+
+# IR files read per batch by rebuild(); bounds memory on the full corpus
+FILES_PER_BATCH = 512
+
+
+def ir_path(ir_dir, paper_id):
+    return os.path.join(ir_dir, f"{paper_id}.parquet")
+
+
+def ir_frame(paper_id, parsed, rendered):
+    rows = []
+    for (tex_file, items, image_paths), (tiff, rejected) in zip(parsed, rendered):
+        for seq, (kind, raw, image, image_path, label, position) in enumerate(items):
+            rows.append((paper_id, tex_file, seq, kind, raw, image, image_path, label, position, tiff is not None,
+                         kind == 'figure' and image in rejected))
+    frame = pd.DataFrame(rows, columns=COLUMNS)
+    frame['seq'] = frame['seq'].astype('int32')
+    frame['position'] = frame['position'].astype('Int64')
+    frame['rendered'] = frame['rendered'].astype(bool)
+    frame['rejected'] = frame['rejected'].astype(bool)
+    return frame
+
+
+@metrics.timed('ir')
+def write_ir(ir_dir, paper_id, parsed, rendered):
+    """Write the parsed items of one paper, so cleaning can be redone without the sources."""
+    os.makedirs(ir_dir, exist_ok=True)
+    path = ir_path(ir_dir, paper_id)
+    ir_frame(paper_id, parsed, rendered).to_parquet(path + '.tmp', index=False, engine='pyarrow')
+    os.replace(path + '.tmp', path)
+
+
+def read_ir(paths):
+    return pd.concat([pd.read_parquet(path, engine='pyarrow') for path in paths], ignore_index=True)
+
+
+def _re2_pattern(pattern):
+    return ('(?i)' if pattern.flags & re.IGNORECASE else '') + pattern.pattern
+
+
+@metrics.timed('clean')
+def clean_column(values, rules):
+    """Apply the cleaning rules to a whole column at once, one regex pass per rule.
+
+    ASCII rows go through Arrow's regex kernels. RE2's \\s and \\w only match
+    ASCII, so rows with other characters keep Python's re semantics and are
+    cleaned row by row; both paths give the same result as clean_text_content.
+    """
+    result = values.astype(object).copy()
+    array = pa.array(result, type=pa.string(), from_pandas=True)
+    ascii_rows = pc.fill_null(pc.string_is_ascii(array), False).to_numpy(zero_copy_only=False)
+    cleaned = array.filter(pa.array(ascii_rows))
+    for pattern, repl in rules:
+        cleaned = pc.replace_substring_regex(cleaned, pattern=_re2_pattern(pattern), replacement=repl)
+    result[ascii_rows] = cleaned.to_pylist()
+    for i in np.flatnonzero(~ascii_rows & result.notna().to_numpy()):
+        text = result.iat[i]
+        for pattern, repl in rules:
+            text = pattern.sub(repl, text)
+        result.iat[i] = text
+    return result
+
+
+def _values(series):
+    return [None if pd.isna(value) else value for value in series]
+
+
+def rebuild(ir_dir, output_dir, paper_ids=None, partitioned=False):
+    """Rewrite the interleaved JSON of every paper in ir_dir with the current cleaner.
+
+    The TIFFs do not depend on the cleaner and are left alone. With
+    partitioned, the JSON goes to the paper's partition and its catalog entry
+    is updated. Returns the number of papers written.
+    """
+    from engine import records
+
+    paths = sorted(glob.glob(os.path.join(ir_dir, '*.parquet')))
+    if paper_ids is not None:
+        paths = [path for path in paths if os.path.basename(path)[:-len('.parquet')] in paper_ids]
+    os.makedirs(output_dir, exist_ok=True)
+    catalog = partitions.Catalog(output_dir) if partitioned else None
+    written = 0
+    for start in range(0, len(paths), FILES_PER_BATCH):
+        frame = read_ir(paths[start:start + FILES_PER_BATCH])
+        # section titles are kept as written, everything else goes through the cleaner
+        to_clean = (frame['kind'] != 'section') & frame['raw'].notna()
+        cleaned = frame['raw'].astype(object)
+        cleaned[to_clean] = clean_column(frame.loc[to_clean, 'raw'], records.CLEAN_RULES)
+        frame['clean'] = cleaned
+
+        for paper_id, paper in frame[frame['rendered']].groupby('paper_id', sort=False):
+            res = {'texts': [], 'images': [], 'captions': []}
+            for tex_file, tex in paper.groupby('tex_file', sort=False):
+                tex = tex.sort_values('seq')
+                record = records.assemble_record(_values(tex['kind']), _values(tex['clean']), _values(tex['image']))
+                if 'rejected' in tex:
+                    rejected = set(tex.loc[tex['rejected'], 'image'])
+                    record = records.drop_figures(record, rejected)
+                res['texts'] += record['texts']
+                res['images'] += [f"{paper_id}_{image}" if image else None for image in record['images']]
+                res['captions'] += record['captions']
+            directory = partitions.partition_dir(output_dir, paper_id) if partitioned else output_dir
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, f"{paper_id}.json"), 'w') as f:
+                json.dump(res, f)
+            metrics.count('records_written', len(res['texts']))
+            if catalog:
+                files = [path for path in (os.path.join(directory, f"{paper_id}{ext}") for ext in ('.json', '.tiff'))
+                         if os.path.exists(path)]
+                catalog.add(partitions.paper_id(paper_id), partitions.partition(paper_id), len(res['texts']),
+                            sum(os.path.getsize(path) for path in files), len(files))
+            written += 1
+    if catalog:
+        catalog.export()
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Re-run text cleaning from the figure IR, without the TeX sources.')
+    parser.add_argument('--ir_dir', type=str, default='ir', help='Directory of per-paper IR files.')
+    parser.add_argument('--output_dir', type=str, default='output', help='Where the interleaved JSON files go.')
+    parser.add_argument('--partitioned', action='store_true', help='The output directory is partitioned by yymm.')
+    args = parser.parse_args()
+
+    print(f"Rebuilt {rebuild(args.ir_dir, args.output_dir, partitioned=args.partitioned)} papers from {args.ir_dir}")
@@ -1,24 +1,39 @@
 import os
-import shutil
-import tarfile
 import tempfile
-import pandas as pd
 import logging
+import argparse
+from functools import partial
 from concurrent.futures import ProcessPoolExecutor
-from TexSoup import TexSoup
-from google.cloud import storage
-import gzip
-
-# Initialize a GCP storage client once and reuse it
-client = storage.Client()
+import scheduler
+import sharding
+import partitions
+import work_queue
+import storage_backend
+import uploader
+import metrics
+import autotune
+import memory_budget
+import caption_index
+import archive_cache
+import figure_filter
+import engine
+
+# Bucket holding the raw .gz sources, or a local directory standing in for it
+SOURCE_BUCKET = 'raw_gz_arxivs'
 
 # Define logger
-logging.basicConfig(level=logging.CRITICAL, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # Define the directories for storing datasets and extracted figures
 dataset_dir = 'dataset'
 figures_dir = os.path.join(dataset_dir, 'figures')
 
+# Every paper goes through the shared engine into captioned figure parquet
+# files; set up again from the options before workers start
+pipeline = engine.Engine([engine.CaptionParquetOutput(dataset_dir)])
+# Downloaded archives are kept here across batches and runs when set
+source_cache = None
+
 # Create directories if they do not exist
 if not os.path.exists(dataset_dir):
     os.makedirs(dataset_dir)
@@ -27,159 +42,153 @@ if not os.path.exists(figures_dir):
     os.makedirs(figures_dir)
     logging.debug(f"Created figures directory: {figures_dir}")
 
-# New Function to handle tar.gz extraction
-def extract_tar_gz(gz_local_path, extract_path):
-    with tarfile.open(gz_local_path, mode='r') as tar:
-        tar.extractall(path=extract_path)
-
 def download_gz_from_gcp(bucket_name, gz_files, destination_dir):
-    # Access the target GCP bucket
-    bucket = client.get_bucket(bucket_name)
+    # Access the target GCP bucket, the client is shared by the whole process
+    bucket = storage_backend.open_bucket(bucket_name)
 
     for gz_file in gz_files:
         # Construct the local destination path
         destination_path = os.path.join(destination_dir, gz_file)
 
+        if source_cache:
+            hit = source_cache.fetch(bucket, gz_file, destination_path)
+            logging.debug(f"{'Reused' if hit else 'Downloaded'} {gz_file} at {destination_path}")
+            continue
+
         # Download the .gz file from GCP to the local destination
         blob = bucket.blob(gz_file)
-        blob.download_to_filename(destination_path)
+        with metrics.stage('download'):
+            blob.download_to_filename(destination_path)
         logging.debug(f"Downloaded {gz_file} to {destination_path}")
 
 def process_and_process_gz_files(gz_files, down_dir):
     for gz_file in gz_files:
-        gz_local_path = os.path.join(down_dir, gz_file)
-        extract_figures_from_gz(gz_local_path)
+        extract_figures_from_gz(os.path.join(down_dir, gz_file))
 
 def extract_figures_from_gz(gz_local_path):
-    # Extract the paper ID from the file name
-    paper_id = os.path.splitext(os.path.basename(gz_local_path))[0]
-
-    # JSON file path for the extracted figures and potential dataset for the current paper
-    dataset_path = os.path.join(dataset_dir, f'{paper_id}.parquet')
-
     try:
-        tmp_dir = os.path.join("./tmp", paper_id)
-        os.makedirs(tmp_dir, exist_ok=False)
-        extract_tar_gz(gz_local_path, tmp_dir)
-
-        # Look for .tex files within the temporary directory
-        tex_files = [os.path.join(root, name)
-                        for root, dirs, files in os.walk(tmp_dir)
-                        for name in files if name.endswith(".tex")]
-        for tex_file_path in tex_files:
-            try:
-                with open(tex_file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    process_tex(content, paper_id, tmp_dir)
-            except Exception as e:
-                logging.debug(f"Error reading {tex_file_path}: {e}")
-
-        # Delete the temporary directory after processing
-        shutil.rmtree(tmp_dir)
-        logging.debug(f"Removed temporary directory {tmp_dir}")
+        pipeline.process(gz_local_path)
     except Exception as e:
-        logging.debug(f"Error extracting {gz_local_path}: {e}")
-        
-
-def save_dataset(dataset, paper_id):
-    if not dataset or len(dataset) == 0:
-        return
-
-    paper_id = paper_id.replace('.', '_')
-
-    dataset_path = os.path.join(dataset_dir, f'{paper_id}.parquet')
-    # Create a new file if it does not exist
-    if not os.path.exists(dataset_path):
-        logging.debug(f"Creating dataset for {paper_id}")
-        df = pd.DataFrame(dataset)
-        df.to_parquet(dataset_path)
-    else:
-        # Extend the existing dataset if the pd file already exists
-        cur = pd.read_parquet(dataset_path)
-        df = pd.concat([cur,pd.DataFrame(dataset)], ignore_index=True)
-        logging.debug(f"Updating dataset for {paper_id}")
-        df.to_parquet(dataset_path)
-
-def get_image_link(tmp_dir, image_filename, paper_id):
-    # Construct the path to the image file
-    if not image_filename:
-        return None
-
-    image_filename = os.path.basename(image_filename)
-
-    image_path = os.path.join(tmp_dir, image_filename)
-    if not os.path.exists(image_path):
-        return None
-
-    # Replace periods in paper ID with underscores for consistency in the filename
-    paper_id = paper_id.replace('.', '_')
-    image_filename = image_filename.replace('figures/', '')
-    new_image_path = os.path.join(dataset_dir, 'figures', f'{paper_id}_{image_filename}')
+        logging.debug(f"Error processing {gz_local_path}: {e}")
+        metrics.count('errors_process')
 
-    try:
-        shutil.copy(image_path, new_image_path)
-        return new_image_path
-    except Exception as e:
-        logging.debug(f"Error processing image {image_filename}: {e}")
-        return None
-
-def process_tex(content, paper_id, tmp_dir):
-    soup = TexSoup(content, tolerance=1)
-    figures = soup.find_all("figure")
-    dataset = []
-
-    # Process each 'figure' element found in the TeX content
-    for figure in figures:
-        image_filename = figure.find('includegraphics')
-        if image_filename:
-            image_filename = image_filename.text
-        else:
-            continue
-
-        # Extract the appropriate filename from the 'includegraphics' tag
-        if len(image_filename) > 1:
-            image_filename = image_filename[-1]
-        else:
-            image_filename = image_filename[0]
-
-        # Extract the 'caption' tag's text from the figure
-        caption = figure.find('caption')
-        if caption:
-            caption = caption.text
-            caption = "".join(caption)
-        else:
-            continue
-
-        if len(caption) == 0:
-            continue
-
-
-        # Get the path to the destination image
-        dest_image_path = get_image_link(tmp_dir, image_filename, paper_id)
-
-        if dest_image_path:
-            dataset.append({'image_filename': dest_image_path, 'caption': caption})
-
-    # Save the processed dataset
-    save_dataset(dataset, paper_id)
-def process_gz_file_batch(gz_files):
+def process_gz_file_batch(gz_files, source=SOURCE_BUCKET):
     with tempfile.TemporaryDirectory() as down_dir:
-        download_gz_from_gcp('raw_gz_arxivs', gz_files, down_dir)
+        download_gz_from_gcp(source, gz_files, down_dir)
         process_and_process_gz_files(gz_files, down_dir)
 
-def process_all_gz_files(batch_size=5):
-    # Get a list of .gz files in the GCP bucket
-    bucket = client.get_bucket('raw_gz_arxivs')
-    blobs = list(bucket.list_blobs(max_results=500))
-    print(f'{len(blobs)} blobs')
-    gz_files = [blob.name for blob in blobs]
-
-    # Split the list of gz_files into batches
-    batches = [gz_files[i:i + batch_size] for i in range(0, len(gz_files), batch_size)]
-
-    # Use ThreadPoolExecutor for parallel batch downloads and processing
-    with ProcessPoolExecutor() as executor:  # Limit the number of threads
-        executor.map(process_gz_file_batch, batches)
+def process_all_gz_files(batch_size=5, shard=None, queue=None, source=SOURCE_BUCKET, prefixes=None,
+                         refresh_listing=False, upload_bucket=None, index_dir=None, wanted=None,
+                         num_workers=None, worker_range=None, upload_threads=None, upload_range=None):
+    # Stream the listing page by page, keeping only this machine's shard (and the wanted months).
+    # A completed listing is cached locally and reused by later runs.
+    bucket = storage_backend.open_bucket(source)
+    # the cache keeps totals of all runs, this run's share is the difference
+    cache_before = source_cache.totals() if source_cache else None
+    listing = storage_backend.iter_listing(bucket, prefixes=prefixes, refresh=refresh_listing)
+    gz_files = []
+
+    def pages():
+        for page in storage_backend.iter_pages(blob for blob in listing
+                                              if sharding.in_shard(blob.name, shard) and partitions.in_partitions(blob.name, wanted)):
+            gz_files.extend(blob.name for blob in page)
+            yield [(blob.name, blob.size) for blob in page]
+
+    batch = partial(process_gz_file_batch, source=source)
+
+    # With ranges, worker and upload concurrency follow what the run turns out to be bound by
+    workers = autotune.Controller('workers', *worker_range, initial=num_workers) if worker_range else None
+    uploads = autotune.Controller('upload_threads', *upload_range, kind='io') if upload_range else None
+
+    # Finished outputs are shipped in the background while later batches run
+    upload = uploader.Uploader(upload_bucket, dataset_dir, num_threads=upload_threads, controller=uploads) if upload_bucket else None
+    # and their captions are indexed as they are written
+    indexer = caption_index.Indexer(index_dir, dataset_dir) if index_dir else None
+
+    def on_chunk_done(chunk):
+        if upload:
+            upload.sync()
+        if indexer:
+            indexer.update()
+
+    # Largest archives of each page are dispatched first, small ones are grouped
+    # into batches of at most batch_size so each worker downloads them together
+    num_workers = num_workers or os.cpu_count()
+    with metrics.Reporter() as reporter, \
+            ProcessPoolExecutor(max_workers=workers.maximum if workers else num_workers) as executor:
+        if queue:
+            # Workers on any machine sharing the queue lease blobs one at a time
+            for page in pages():
+                work_queue.seed_queue(queue, [name for name, _ in page], [size for _, size in page])
+            # the queue workers drain until it is empty, their number is fixed
+            work_queue.run_queue_workers(executor, queue, batch, workers.target if workers else num_workers, per_chunk=True)
+            print(f"Queue {queue}: {work_queue.queue_stats(queue)}")
+        else:
+            _, report = scheduler.run_streamed(executor, batch, pages(), num_workers,
+                                               per_chunk=True, max_items=batch_size, on_chunk_done=on_chunk_done,
+                                               controller=workers)
+            print(scheduler.format_report(report))
+            if workers:
+                print(autotune.format_settings(workers.settings(), '--workers'))
+    print(f'{len(gz_files)} blobs')
+    if reporter.summary:
+        print(metrics.format_summary(reporter.summary))
+    if memory_budget.enabled():
+        print(memory_budget.format_usage())
+    if source_cache:
+        cache_after = source_cache.totals()
+        print(archive_cache.format_stats({name: cache_after[name] - cache_before[name] for name in cache_after}))
+    sharding.write_shard_manifest(dataset_dir, shard, gz_files)
+    catalog = pipeline.outputs[0].catalog
+    if catalog:
+        print(f"Catalog of {len(catalog.partitions())} partitions written to {catalog.export()}")
+    if indexer:
+        indexer.update(force=True)
+        print(f"Indexed {indexer.docs} new captions in {index_dir}")
+    if upload:
+        upload.sync(force=True)
+        print(uploader.format_stats(upload.close()))
+        if uploads:
+            print(autotune.format_settings(uploads.settings(), '--upload_threads'))
 
 if __name__ == '__main__':
-    process_all_gz_files()
+    parser = argparse.ArgumentParser(description='Extract figures and captions from the raw arXiv sources bucket.')
+    parser.add_argument('--source', type=str, default=SOURCE_BUCKET, help='Source bucket name, or a local directory.')
+    parser.add_argument('--list_prefixes', type=str, help='Comma separated prefixes covering the bucket, listed in parallel.')
+    parser.add_argument('--refresh_listing', action='store_true', help='Ignore the cached listing from an earlier run.')
+    parser.add_argument('--shard', type=sharding.parse_shard, help='Only process shard i of N, e.g. --shard 0/4.')
+    parser.add_argument('--queue', type=str, help='Pull blobs from this work queue database instead of a fixed list.')
+    parser.add_argument('--upload_bucket', type=str, help='Upload outputs to this bucket while processing runs.')
+    parser.add_argument('--workers', type=int, help='Worker processes (default: one per core).')
+    parser.add_argument('--autotune', type=autotune.parse_range,
+                        help='Adjust the number of workers between MIN:MAX to how CPU or I/O bound the run is.')
+    parser.add_argument('--upload_threads', type=int, help='Upload threads (default: one per core).')
+    parser.add_argument('--autotune_upload', type=autotune.parse_range,
+                        help='Adjust the number of upload threads between MIN:MAX to the upload backlog.')
+    parser.add_argument('--metrics_dir', type=str, help='Write per-stage timings, counters and RSS here.')
+    parser.add_argument('--profile', type=int, default=0, help='Keep cProfile dumps of the N slowest papers (needs --metrics_dir).')
+    parser.add_argument('--memory_budget_gb', type=float, help='Wait before unpacking while this much is reserved.')
+    parser.add_argument('--archive_cache', type=str, help='Keep downloaded archives in this directory for later batches and runs.')
+    parser.add_argument('--archive_cache_gb', type=float, default=archive_cache.MAX_BYTES / 1024 ** 3,
+                        help='Evict least recently used archives beyond this size.')
+    parser.add_argument('--partitioned', action='store_true', help='Write outputs under yymm (or category/yymm) directories, with a catalog.')
+    parser.add_argument('--partitions', type=partitions.parse_partitions, help='Only process these months, e.g. 2301,2303-2306.')
+    parser.add_argument('--index_dir', type=str, help='Add the captions written by this run to this caption index.')
+    parser.add_argument('--filter_figures', type=figure_filter.parse_thresholds, nargs='?', const='',
+                        help='Skip blank, tiny, thin and mostly white figures; '
+                             'optionally override thresholds, e.g. min_side=48,max_aspect=8.')
+    parser.add_argument('--log_level', type=str, default='WARNING', help='Logging level, e.g. DEBUG to see per-file errors.')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(args.log_level)
+    if args.metrics_dir:
+        metrics.configure(args.metrics_dir, profile_top=args.profile)
+    if args.memory_budget_gb:
+        memory_budget.configure(args.memory_budget_gb * 1024 ** 3)
+    pipeline = engine.Engine([engine.CaptionParquetOutput(dataset_dir, args.partitioned, args.shard)], figure_thresholds=args.filter_figures)
+    if args.archive_cache:
+        source_cache = archive_cache.ArchiveCache(args.archive_cache, int(args.archive_cache_gb * 1024 ** 3))
+    prefixes = args.list_prefixes.split(',') if args.list_prefixes else None
+    process_all_gz_files(shard=args.shard, queue=args.queue, source=args.source, prefixes=prefixes,
+                         refresh_listing=args.refresh_listing, upload_bucket=args.upload_bucket,
+                         index_dir=args.index_dir, wanted=args.partitions, num_workers=args.workers,
+                         worker_range=args.autotune, upload_threads=args.upload_threads, upload_range=args.autotune_upload)
@@ -0,0 +1,201 @@
+import os
+import mmap
+import time
+import fcntl
+import atexit
+import struct
+import tempfile
+from contextlib import contextmanager
+import metrics
+
+# Set by configure() in the parent and inherited by worker processes
+BUDGET_ENV = 'FIGURES_MEMORY_BUDGET'
+
+# Layout of the shared budget file: limit and peak, then one (pid, bytes)
+# slot per process holding a reservation
+HEADER = struct.Struct('<qq')
+SLOT = struct.Struct('<qq')
+MAX_SLOTS = 1024
+
+# Waiting for budget backs off up to MAX_POLL seconds between checks
+MIN_POLL = 0.02
+MAX_POLL = 0.25
+# A reservation made while already holding one only waits this long for
+# other processes, then goes over budget; two workers each waiting for the
+# other to finish would otherwise never proceed
+NESTED_WAIT = 30.0
+
+_path = None
+_file = None
+_mmap = None
+_owner = None
+_held = 0
+
+
+def configure(limit_bytes, path=None):
+    """Share a budget of limit_bytes between this process and every worker it starts."""
+    path = path or os.path.join(tempfile.gettempdir(), f"figures-memory-{os.getpid()}.budget")
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(int(limit_bytes), 0) + bytes(SLOT.size * MAX_SLOTS))
+    os.environ[BUDGET_ENV] = path
+    atexit.register(_remove, path, os.getpid())
+    return path
+
+
+def _remove(path, owner):
+    if os.getpid() != owner:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def enabled():
+    return bool(os.environ.get(BUDGET_ENV))
+
+
+def _state():
+    """The mapped budget file, reopened after a fork so every process has its own handle."""
+    global _path, _file, _mmap, _owner
+    path = os.environ.get(BUDGET_ENV)
+    if _owner != os.getpid() or _path != path:
+        _file = open(path, 'r+b')
+        _mmap = mmap.mmap(_file.fileno(), 0)
+        _path, _owner = path, os.getpid()
+    return _file, _mmap
+
+
+@contextmanager
+def _locked():
+    f, mm = _state()
+    fcntl.flock(f, fcntl.LOCK_EX)
+    try:
+        yield mm
+    finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _slots(mm):
+    for i, (pid, held) in enumerate(SLOT.iter_unpack(mm[HEADER.size:])):
+        yield HEADER.size + i * SLOT.size, pid, held
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def _usage(mm, reclaim=False):
+    """Bytes reserved by all processes; with reclaim, slots of dead processes are freed first."""
+    used = 0
+    for offset, pid, held in _slots(mm):
+        if not pid:
+            continue
+        if reclaim and pid != os.getpid() and not _alive(pid):
+            # a worker that died mid-paper never released its reservation
+            SLOT.pack_into(mm, offset, 0, 0)
+            continue
+        used += held
+    return used
+
+
+def _add(mm, nbytes):
+    me = os.getpid()
+    free = None
+    for offset, pid, held in _slots(mm):
+        if pid == me:
+            held += nbytes
+            SLOT.pack_into(mm, offset, me if held > 0 else 0, max(held, 0))
+            return
+        if not pid and free is None:
+            free = offset
+    if free is None:
+        raise RuntimeError(f"More than {MAX_SLOTS} processes share the memory budget")
+    SLOT.pack_into(mm, free, me, nbytes)
+
+
+def _held_here(mm):
+    me = os.getpid()
+    return sum(held for _, pid, held in _slots(mm) if pid == me)
+
+
+def _try_reserve(nbytes, force):
+    with _locked() as mm:
+        limit, peak = HEADER.unpack_from(mm, 0)
+        used = _usage(mm)
+        if not force and used and used + nbytes > limit:
+            used = _usage(mm, reclaim=True)
+        # an oversized reservation is let through once no other process holds
+        # budget; waiting would only wait on this process's own reservations
+        if force or used == _held_here(mm) or used + nbytes <= limit:
+            _add(mm, nbytes)
+            used += nbytes
+            peak = max(peak, used)
+            HEADER.pack_into(mm, 0, limit, peak)
+            _update_gauges(used, peak, limit)
+            return True
+        return False
+
+
+def _release(nbytes):
+    with _locked() as mm:
+        _add(mm, -nbytes)
+        limit, peak = HEADER.unpack_from(mm, 0)
+        _update_gauges(_usage(mm), peak, limit)
+
+
+def _update_gauges(used, peak, limit):
+    metrics.gauge('memory_reserved_bytes', used)
+    metrics.gauge('memory_reserved_peak_bytes', peak)
+    metrics.gauge('memory_budget_bytes', limit)
+
+
+@contextmanager
+def reserve(nbytes, stage):
+    """Hold nbytes of the shared budget for the duration of the block, waiting until they fit.
+
+    Does nothing unless configure() was called in this process or a parent.
+    """
+    global _held
+    nbytes = int(nbytes)
+    if not enabled() or nbytes <= 0:
+        yield
+        return
+    nested = _held > 0
+    start = time.perf_counter()
+    poll = MIN_POLL
+    with metrics.stage('memory_wait'):
+        while not _try_reserve(nbytes, force=nested and time.perf_counter() - start > NESTED_WAIT):
+            if poll == MIN_POLL:
+                metrics.count(f'memory_waits_{stage}')
+            time.sleep(poll)
+            poll = min(poll * 2, MAX_POLL)
+    _held += nbytes
+    try:
+        yield
+    finally:
+        _held -= nbytes
+        _release(nbytes)
+
+
+def usage():
+    """(reserved, peak, limit) in bytes, or None when no budget is configured."""
+    if not enabled():
+        return None
+    with _locked() as mm:
+        limit, peak = HEADER.unpack_from(mm, 0)
+        return _usage(mm), peak, limit
+
+
+def format_usage():
+    values = usage()
+    if values is None:
+        return ''
+    reserved, peak, limit = values
+    return f"memory budget: peak {peak / 1e6:.0f} MB reserved of {limit / 1e6:.0f} MB"
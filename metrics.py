@@ -0,0 +1,256 @@
+import os
+import re
+import json
+import time
+import glob
+import heapq
+import cProfile
+import resource
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+# Set by configure() in the parent and inherited by worker processes
+METRICS_DIR_ENV = 'FIGURES_METRICS_DIR'
+PROFILE_TOP_ENV = 'FIGURES_PROFILE_TOP'
+
+# Workers write a snapshot at most this often
+FLUSH_INTERVAL = 10.0
+
+_timers = {}
+_counters = {}
+_gauges = {}
+_last_flush = 0.0
+_slowest = []
+
+
+def configure(metrics_dir, profile_top=0):
+    """Turn metrics on for this process and every worker it starts."""
+    os.makedirs(metrics_dir, exist_ok=True)
+    # snapshots left by an earlier run would be counted again
+    for path in glob.glob(os.path.join(metrics_dir, 'worker-*.json')):
+        os.remove(path)
+    os.environ[METRICS_DIR_ENV] = metrics_dir
+    if profile_top:
+        os.makedirs(os.path.join(metrics_dir, 'profiles'), exist_ok=True)
+        os.environ[PROFILE_TOP_ENV] = str(profile_top)
+
+
+def metrics_dir():
+    return os.environ.get(METRICS_DIR_ENV)
+
+
+@contextmanager
+def stage(name):
+    """Time a block of work under a stage name."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        entry = _timers.setdefault(name, [0, 0.0])
+        entry[0] += 1
+        entry[1] += time.perf_counter() - start
+
+
+def timed(name):
+    """Decorator form of stage()."""
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def stage_seconds():
+    """Seconds spent in each stage by this process so far."""
+    return {name: seconds for name, (calls, seconds) in _timers.items()}
+
+
+def count(name, value=1):
+    _counters[name] = _counters.get(name, 0) + value
+
+
+def gauge(name, value):
+    _gauges[name] = value
+
+
+def rss_bytes():
+    """Current resident set size of this process."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def snapshot():
+    return {
+        'time': time.time(),
+        'pid': os.getpid(),
+        'stages': {name: {'calls': calls, 'seconds': seconds} for name, (calls, seconds) in _timers.items()},
+        'counters': dict(_counters),
+        'gauges': dict(_gauges),
+        'rss_bytes': rss_bytes(),
+        'peak_rss_bytes': peak_rss_bytes(),
+    }
+
+
+def flush(force=True):
+    """Write this process's cumulative counters to its worker file."""
+    global _last_flush
+    directory = metrics_dir()
+    if not directory:
+        return
+    now = time.time()
+    if not force and now - _last_flush < FLUSH_INTERVAL:
+        return
+    _last_flush = now
+    path = os.path.join(directory, f"worker-{os.getpid()}.json")
+    with open(path + '.tmp', 'w') as f:
+        json.dump(snapshot(), f)
+    os.replace(path + '.tmp', path)
+
+
+def maybe_flush():
+    flush(force=False)
+
+
+def aggregate(directory=None):
+    """Combine the latest snapshot of every worker into one summary."""
+    directory = directory or metrics_dir()
+    summary = {'time': time.time(), 'stages': {}, 'counters': {}, 'gauges': {}, 'workers': {}}
+    for path in glob.glob(os.path.join(directory, 'worker-*.json')):
+        try:
+            with open(path, 'r') as f:
+                snap = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, values in snap['stages'].items():
+            total = summary['stages'].setdefault(name, {'calls': 0, 'seconds': 0.0})
+            total['calls'] += values['calls']
+            total['seconds'] += values['seconds']
+        for name, value in snap['counters'].items():
+            summary['counters'][name] = summary['counters'].get(name, 0) + value
+        for name, value in snap['gauges'].items():
+            # gauges are per process levels, report the highest
+            summary['gauges'][name] = max(summary['gauges'].get(name, value), value)
+        summary['workers'][str(snap['pid'])] = {'rss_bytes': snap['rss_bytes'], 'peak_rss_bytes': snap['peak_rss_bytes']}
+    return summary
+
+
+def _metric_name(name):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def prometheus_text(summary):
+    lines = ['# TYPE figures_stage_seconds_total counter']
+    for name, values in sorted(summary['stages'].items()):
+        lines.append(f'figures_stage_seconds_total{{stage="{name}"}} {values["seconds"]:.6f}')
+    lines.append('# TYPE figures_stage_calls_total counter')
+    for name, values in sorted(summary['stages'].items()):
+        lines.append(f'figures_stage_calls_total{{stage="{name}"}} {values["calls"]}')
+    for name, value in sorted(summary['counters'].items()):
+        lines.append(f'# TYPE figures_{_metric_name(name)}_total counter')
+        lines.append(f'figures_{_metric_name(name)}_total {value}')
+    for name, value in sorted(summary['gauges'].items()):
+        lines.append(f'# TYPE figures_{_metric_name(name)} gauge')
+        lines.append(f'figures_{_metric_name(name)} {value}')
+    lines.append('# TYPE figures_worker_rss_bytes gauge')
+    for pid, values in sorted(summary['workers'].items()):
+        lines.append(f'figures_worker_rss_bytes{{pid="{pid}"}} {values["rss_bytes"]}')
+    lines.append('# TYPE figures_worker_peak_rss_bytes gauge')
+    for pid, values in sorted(summary['workers'].items()):
+        lines.append(f'figures_worker_peak_rss_bytes{{pid="{pid}"}} {values["peak_rss_bytes"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_report(directory=None):
+    """Append the aggregate to metrics.jsonl and rewrite metrics.prom."""
+    directory = directory or metrics_dir()
+    if not directory:
+        return None
+    summary = aggregate(directory)
+    with open(os.path.join(directory, 'metrics.jsonl'), 'a') as f:
+        f.write(json.dumps(summary) + '\n')
+    tmp_path = os.path.join(directory, 'metrics.prom.tmp')
+    with open(tmp_path, 'w') as f:
+        f.write(prometheus_text(summary))
+    os.replace(tmp_path, os.path.join(directory, 'metrics.prom'))
+    return summary
+
+
+class Reporter:
+    """Background thread in the parent that writes the aggregate every interval seconds."""
+
+    def __init__(self, interval=30.0):
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.summary = None
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            write_report()
+
+    def __enter__(self):
+        if metrics_dir():
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        flush()
+        self.summary = write_report()
+        prune_profiles()
+
+
+def format_summary(summary):
+    if not summary:
+        return ''
+    stages = ', '.join(f"{name} {values['seconds']:.1f}s" for name, values in sorted(summary['stages'].items()))
+    peak = max((values['peak_rss_bytes'] for values in summary['workers'].values()), default=0)
+    return f"stage time: {stages}; peak worker RSS {peak / 1e6:.0f} MB"
+
+
+@contextmanager
+def profile(label):
+    """cProfile a paper when --profile is on, keeping the dumps of the slowest ones."""
+    top = int(os.environ.get(PROFILE_TOP_ENV, 0) or 0)
+    if not top or not metrics_dir():
+        yield
+        return
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        elapsed = time.perf_counter() - start
+        # only dump if this paper is among the slowest this process has seen
+        if len(_slowest) < top or elapsed > _slowest[0]:
+            if len(_slowest) >= top:
+                heapq.heappop(_slowest)
+            heapq.heappush(_slowest, elapsed)
+            safe_label = re.sub(r'[^\w.-]', '_', label)
+            profiler.dump_stats(os.path.join(metrics_dir(), 'profiles', f"{elapsed:012.3f}s-{safe_label}.pstats"))
+
+
+def prune_profiles(directory=None):
+    """Keep only the N slowest profile dumps across all workers."""
+    directory = directory or metrics_dir()
+    top = int(os.environ.get(PROFILE_TOP_ENV, 0) or 0)
+    if not directory or not top:
+        return
+    dumps = sorted(glob.glob(os.path.join(directory, 'profiles', '*.pstats')), reverse=True)
+    for path in dumps[top:]:
+        os.remove(path)
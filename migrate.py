@@ -0,0 +1,154 @@
+import os
+import json
+import sqlite3
+import difflib
+import logging
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import storage_backend
+
+# Registered transforms, name -> function(record) returning the new record
+MIGRATIONS = {}
+
+# Where resumable progress is kept, one database per migration and dataset
+CHECKPOINT_DIR = '.migrations'
+# Records read ahead of the writers; bounds memory on huge buckets
+MAX_IN_FLIGHT = 256
+# Checkpoint commits are batched
+CHECKPOINT_EVERY = 500
+
+
+def register_migration(name):
+    """Decorator adding a transform to MIGRATIONS under name."""
+    def register(func):
+        MIGRATIONS[name] = func
+        return func
+    return register
+
+
+@register_migration('pdf_to_png')
+def replace_pdf_with_png(data):
+    # Figures were rasterized to .png after the captions were written
+    for item in data:
+        if 'image_filename' in item and item['image_filename'].endswith('.pdf'):
+            item['image_filename'] = item['image_filename'].replace('.pdf', '.png')
+    return data
+
+
+def checkpoint_path(location, name, checkpoint_dir=CHECKPOINT_DIR):
+    key = location.replace('://', '_').replace('/', '_').strip('_')
+    return os.path.join(checkpoint_dir, f"{name}-{key}.db")
+
+
+def open_checkpoint(path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE IF NOT EXISTS done (name TEXT PRIMARY KEY, changed INTEGER)')
+    return conn
+
+
+def diff_records(name, before, after):
+    before_lines = json.dumps(before, indent=2, sort_keys=True).splitlines(keepends=True)
+    after_lines = json.dumps(after, indent=2, sort_keys=True).splitlines(keepends=True)
+    return ''.join(difflib.unified_diff(before_lines, after_lines, fromfile=f"a/{name}", tofile=f"b/{name}"))
+
+
+def migrate(location, name, prefix=None, suffix='.json', dry_run=False, num_threads=None,
+            checkpoint=None, max_diffs=20):
+    """Apply the registered transform name to every record under location.
+
+    location is a bucket name or a local directory. Records are downloaded by a
+    thread pool while the listing is still streaming, and only records the
+    transform actually changed are written back. With dry_run nothing is
+    written and the first max_diffs changes are printed as unified diffs.
+    Progress is checkpointed (except for dry runs) so an interrupted migration
+    picks up where it stopped.
+    """
+    transform = MIGRATIONS[name]
+    stats = Counter()
+    lock = threading.Lock()
+    local = threading.local()
+    in_flight = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+
+    def bucket():
+        # one client per thread, as in the uploader
+        if not hasattr(local, 'bucket'):
+            client = None if storage_backend.is_local(location) else storage_backend.new_client()
+            local.bucket = storage_backend.open_bucket(location, client=client)
+        return local.bucket
+
+    conn = None
+    done = set()
+    if not dry_run:
+        conn = open_checkpoint(checkpoint or checkpoint_path(location, name))
+        done = {row[0] for row in conn.execute('SELECT name FROM done')}
+    finished = []
+
+    def process(object_name):
+        try:
+            blob = bucket().blob(object_name)
+            raw = blob.download_as_bytes()
+            original = json.loads(raw)
+            updated = transform(json.loads(raw))
+            changed = updated != original
+            if changed and dry_run:
+                with lock:
+                    if stats['changed'] < max_diffs:
+                        print(diff_records(object_name, original, updated))
+            elif changed:
+                blob.upload_from_string(json.dumps(updated), content_type='application/json')
+            with lock:
+                stats['changed' if changed else 'unchanged'] += 1
+                finished.append((object_name, int(changed)))
+        except Exception as e:
+            logging.error(f"Failed to migrate {object_name}: {e}")
+            with lock:
+                stats['failed'] += 1
+        finally:
+            in_flight.release()
+
+    def flush():
+        with lock:
+            batch = finished[:]
+            del finished[:]
+        if conn is not None and batch:
+            conn.executemany('INSERT OR REPLACE INTO done (name, changed) VALUES (?, ?)', batch)
+            conn.commit()
+
+    with ThreadPoolExecutor(max_workers=num_threads or os.cpu_count()) as executor:
+        for info in storage_backend.iter_blobs(storage_backend.open_bucket(location), prefix):
+            if not info.name.endswith(suffix):
+                continue
+            if info.name in done:
+                stats['resumed'] += 1
+                continue
+            in_flight.acquire()
+            executor.submit(process, info.name)
+            stats['listed'] += 1
+            if len(finished) >= CHECKPOINT_EVERY:
+                flush()
+    flush()
+    if conn is not None:
+        conn.close()
+    return dict(stats)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Apply a registered transform to every record of the dataset.')
+    parser.add_argument('migration', choices=sorted(MIGRATIONS), help='Name of the registered transform.')
+    parser.add_argument('--location', type=str, required=True, help='Bucket name or local dataset directory.')
+    parser.add_argument('--prefix', type=str, help='Only migrate objects under this prefix.')
+    parser.add_argument('--suffix', type=str, default='.json', help='Only migrate objects with this suffix.')
+    parser.add_argument('--dry-run', action='store_true', help='Print diffs instead of writing.')
+    parser.add_argument('--max-diffs', type=int, default=20, help='Diffs to print in a dry run.')
+    parser.add_argument('--threads', type=int, help='Download/upload threads (default: CPU count).')
+    parser.add_argument('--checkpoint', type=str, help='Checkpoint database (default: under .migrations/).')
+    args = parser.parse_args()
+
+    stats = migrate(args.location, args.migration, prefix=args.prefix, suffix=args.suffix, dry_run=args.dry_run,
+                    num_threads=args.threads, checkpoint=args.checkpoint, max_diffs=args.max_diffs)
+    print(f"{args.migration}: {stats.get('changed', 0)} changed, {stats.get('unchanged', 0)} unchanged, "
+          f"{stats.get('failed', 0)} failed, {stats.get('resumed', 0)} already done")
@@ -1,43 +1,35 @@
-from google.cloud import storage
 import os
-import concurrent.futures
+import sys
+import argparse
 
-def list_files(directory):
-    """Recursively list all files in a directory."""
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            yield os.path.join(root, file)
+# shared modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import uploader
+import autotune
 
-def upload_file_to_gcs(local_file, bucket_name, local_path):
-    """Upload a single file to a GCS bucket."""
-    # Create a storage client
-    storage_client = storage.Client()
-    # Get the bucket object
-    bucket = storage_client.bucket(bucket_name)
-    # Remove the local directory structure to get the remote path
-    remote_path = os.path.relpath(local_file, local_path)
-    # Create a blob and upload the file
-    blob = bucket.blob(os.path.join(remote_path))
-    blob.upload_from_filename(local_file)
-    print(f"Uploaded {local_file} to {bucket_name}/{remote_path}")
-
-def upload_to_gcs(local_path, bucket_name):
-    """Upload files to a GCS bucket in parallel."""
-    # Create a ThreadPoolExecutor for parallel uploads
-    with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
-        # Create a future to GCS upload for each file
-        futures = [executor.submit(upload_file_to_gcs, local_file, bucket_name, local_path)
-                   for local_file in list_files(local_path)]
-        # Wait for all futures to complete
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                # Retrieve the result (for exception handling)
-                future.result()
-            except Exception as e:
-                print(f"An exception occurred: {e}")
+def upload_to_gcs(local_path, bucket_name, pack=False, threads=None, thread_range=None):
+    """Upload new and changed files to a GCS bucket in parallel."""
+    # One client per upload thread, unchanged objects are skipped
+    controller = autotune.Controller('upload_threads', *thread_range, kind='io') if thread_range else None
+    upload = uploader.Uploader(bucket_name, local_path, num_threads=threads, pack=pack, controller=controller)
+    upload.sync()
+    stats = upload.close()
+    print(uploader.format_stats(stats))
+    if controller:
+        print(autotune.format_settings(controller.settings(), '--threads'))
 
 # Configure these variables
 LOCAL_DIRECTORY = "dataset"
 GCP_BUCKET_NAME = "s3dataset"
 
-upload_to_gcs(LOCAL_DIRECTORY, GCP_BUCKET_NAME)
\ No newline at end of file
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Upload the dataset directory to a bucket.')
+    parser.add_argument('--local_dir', type=str, default=LOCAL_DIRECTORY, help='Directory to upload.')
+    parser.add_argument('--bucket', type=str, default=GCP_BUCKET_NAME, help='Destination bucket, or a local directory.')
+    parser.add_argument('--pack', action='store_true', help='Upload small files packed into tar shards.')
+    parser.add_argument('--threads', type=int, help='Upload threads (default: one per core).')
+    parser.add_argument('--autotune', type=autotune.parse_range,
+                        help='Adjust the number of upload threads between MIN:MAX to the upload backlog.')
+    args = parser.parse_args()
+
+    upload_to_gcs(args.local_dir, args.bucket, pack=args.pack, threads=args.threads, thread_range=args.autotune)
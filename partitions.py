@@ -0,0 +1,208 @@
+import os
+import re
+import json
+import sqlite3
+import threading
+import argparse
+import sharding
+import storage_backend
+
+# The catalog of a partitioned output directory lives here, relative to it
+CATALOG_DIR = '_catalog'
+# Papers whose name has no arXiv id
+UNKNOWN = 'unknown'
+
+# 2301.01234, also as 2301_01234 or inside arXiv-2301_01234_tar
+NEW_STYLE = re.compile(r'(?<!\d)(\d{2}(?:0[1-9]|1[0-2]))[._]\d{4,5}(?!\d)')
+# hep-th9901001, math.AG/0101001, math_AG0101001
+OLD_STYLE = re.compile(r'(?<![A-Za-z])([a-z]+(?:-[a-z]+)?)(?:[._][A-Za-z]{2})?[/_]?(\d{2}(?:0[1-9]|1[0-2]))\d{3}(?!\d)')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS papers (
+    paper_id TEXT PRIMARY KEY,
+    partition TEXT NOT NULL,
+    records INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    files INTEGER NOT NULL,
+    shard TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS papers_partition ON papers (partition);
+"""
+
+
+def partition(name):
+    """The partition of a paper, from its archive name or paper id: yymm, or category/yymm for old-style ids."""
+    base = os.path.basename(name)
+    match = NEW_STYLE.search(base)
+    if match:
+        return match.group(1)
+    match = OLD_STYLE.search(base)
+    if match:
+        return f"{match.group(1)}/{match.group(2)}"
+    return UNKNOWN
+
+
+def paper_id(name):
+    """The catalog's id of a paper, the same for its archive name and its output names: 2301_01234, hep-th9901001."""
+    match = NEW_STYLE.search(os.path.basename(name))
+    if match:
+        return match.group(0).replace('.', '_')
+    return sharding.paper_id_from_name(name)
+
+
+def partition_dir(output_dir, name):
+    return os.path.join(output_dir, partition(name))
+
+
+def month(partition_name):
+    """yyyymm of a partition, for ordering and ranges; None for the unknown partition."""
+    yymm = partition_name.rsplit('/', 1)[-1]
+    if not yymm.isdigit():
+        return None
+    # arXiv started in 1991, old-style ids ran until 2007
+    century = '19' if int(yymm[:2]) >= 91 else '20'
+    return century + yymm
+
+
+def parse_partitions(value):
+    """argparse type for a comma separated list of partitions or yymm ranges, e.g. 2301,2303-2306,hep-th/9901."""
+    wanted = []
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if re.fullmatch(r'\d{4}', part):
+            # a month on its own also covers the old-style categories of that month
+            part = f"{part}-{part}"
+        start, _, end = part.partition('-') if re.fullmatch(r'\d{4}-\d{4}', part) else (part, '', '')
+        if end and (month(start) is None or month(end) is None):
+            raise argparse.ArgumentTypeError(f"expected yymm-yymm, got {part!r}")
+        wanted.append((start, end or None))
+    if not wanted:
+        raise argparse.ArgumentTypeError("no partitions given")
+    return wanted
+
+
+def matches(partition_name, wanted):
+    """Whether a partition is one of those parse_partitions() returned (all of them if wanted is None)."""
+    if wanted is None:
+        return True
+    for start, end in wanted:
+        if end is None:
+            if partition_name == start:
+                return True
+        elif month(partition_name) is not None and month(start) <= month(partition_name) <= month(end):
+            return True
+    return False
+
+
+def in_partitions(name, wanted):
+    """Whether a paper, by archive name or paper id, belongs to the wanted partitions."""
+    return wanted is None or matches(partition(name), wanted)
+
+
+class Catalog:
+    """Records, bytes and files written per paper into a partitioned output directory.
+
+    Every worker adds the papers it writes; a paper written again replaces
+    its earlier entry. The index is SQLite so the workers of a run, and the
+    shards writing into the same directory, can share it. Each entry is
+    tagged with the shard that wrote it, and export() summarises only this
+    shard's entries per partition, so the summaries of all shards add up.
+    """
+
+    def __init__(self, output_dir, shard=None):
+        self.output_dir = output_dir
+        self.shard = sharding.shard_name(shard) if shard else ''
+        self._local = threading.local()
+
+    @property
+    def conn(self):
+        """The index, reconnected after a fork and per thread so each has its own connection."""
+        local = self._local
+        if getattr(local, 'owner', None) != os.getpid():
+            os.makedirs(os.path.join(self.output_dir, CATALOG_DIR), exist_ok=True)
+            local.conn = sqlite3.connect(os.path.join(self.output_dir, CATALOG_DIR, 'catalog.db'), timeout=60,
+                                         isolation_level=None)
+            local.conn.execute('PRAGMA journal_mode=WAL')
+            local.conn.execute('PRAGMA synchronous=NORMAL')
+            local.conn.executescript(SCHEMA)
+            if 'shard' not in [row[1] for row in local.conn.execute('PRAGMA table_info(papers)')]:
+                # catalogs written before entries were tagged with their shard
+                try:
+                    local.conn.execute("ALTER TABLE papers ADD COLUMN shard TEXT NOT NULL DEFAULT ''")
+                except sqlite3.OperationalError:
+                    pass  # another worker added it first
+            local.owner = os.getpid()
+        return local.conn
+
+    def add(self, paper_id, partition_name, records, size, files):
+        self.conn.execute('INSERT OR REPLACE INTO papers (paper_id, partition, records, bytes, files, shard) '
+                          'VALUES (?, ?, ?, ?, ?, ?)', (paper_id, partition_name, records, size, files, self.shard))
+
+    def partitions(self):
+        """{partition: {'papers', 'records', 'bytes', 'files', 'min_paper_id', 'max_paper_id'}} of this shard's papers."""
+        rows = self.conn.execute('SELECT partition, COUNT(*), SUM(records), SUM(bytes), SUM(files), '
+                                 'MIN(paper_id), MAX(paper_id) FROM papers WHERE shard = ? '
+                                 'GROUP BY partition ORDER BY partition', (self.shard,))
+        return {row[0]: dict(zip(('papers', 'records', 'bytes', 'files', 'min_paper_id', 'max_paper_id'), row[1:]))
+                for row in rows}
+
+    def export(self):
+        """Write this shard's per-partition summary next to the index, one file per shard; returns its path."""
+        name = self.shard or 'catalog'
+        path = os.path.join(self.output_dir, CATALOG_DIR, f"{name}.json")
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'partitions': self.partitions()}, f, indent=1, sort_keys=True)
+        os.replace(path + '.tmp', path)
+        return path
+
+    def close(self):
+        local = self._local
+        if getattr(local, 'owner', None) == os.getpid():
+            local.conn.close()
+        local.conn = local.owner = None
+
+
+def load_catalog(location, prefix=''):
+    """The catalog summaries under location (an output directory or bucket), merged across shards."""
+    bucket = storage_backend.open_bucket(location)
+    merged = {}
+    for blob in bucket.list_blobs(prefix=f"{prefix}{CATALOG_DIR}/"):
+        if not blob.name.endswith('.json'):
+            continue
+        for name, entry in json.loads(blob.download_as_bytes())['partitions'].items():
+            if name not in merged:
+                merged[name] = dict(entry)
+                continue
+            total = merged[name]
+            for field in ('papers', 'records', 'bytes', 'files'):
+                total[field] += entry[field]
+            total['min_paper_id'] = min(total['min_paper_id'], entry['min_paper_id'])
+            total['max_paper_id'] = max(total['max_paper_id'], entry['max_paper_id'])
+    return merged
+
+
+def select(catalog, wanted=None):
+    """Names of the catalogued partitions a reader needs, see parse_partitions()."""
+    return sorted(name for name in catalog if matches(name, wanted))
+
+
+def format_catalog(catalog):
+    lines = [f"{name}: {entry['papers']} papers, {entry['records']} records, {entry['bytes'] / 1e6:.1f} MB, "
+             f"{entry['min_paper_id']} .. {entry['max_paper_id']}" for name, entry in sorted(catalog.items())]
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Show the partitions of a partitioned output directory or bucket.')
+    parser.add_argument('--location', type=str, required=True, help='Output directory or bucket.')
+    parser.add_argument('--prefix', type=str, default='', help='Prefix the outputs were uploaded under.')
+    parser.add_argument('--partitions', type=parse_partitions, help='Only these partitions, e.g. 2301,2303-2306.')
+    args = parser.parse_args()
+
+    catalog = load_catalog(args.location, args.prefix)
+    catalog = {name: catalog[name] for name in select(catalog, args.partitions)}
+    print(format_catalog(catalog))
+    print(f"{len(catalog)} partitions, {sum(entry['papers'] for entry in catalog.values())} papers, "
+          f"{sum(entry['bytes'] for entry in catalog.values()) / 1e9:.2f} GB")
@@ -0,0 +1,142 @@
+import os
+import time
+import pickle
+import sqlite3
+import hashlib
+import argparse
+
+# Default location and size of the cache
+CACHE_DIR = '.result_cache'
+MAX_BYTES = 20 * 1024 ** 3
+# last_used is only rewritten when it is older than this, so hits stay read-only
+TOUCH_INTERVAL = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (key, stage)
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+"""
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """sha256 of a file's bytes, the cache key of an archive."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint(versions, components):
+    """Fingerprint of the pipeline components a stage depends on, e.g. ('extractor', 'cleaner')."""
+    return ','.join(f"{name}={versions[name]}" for name in sorted(components))
+
+
+class ResultCache:
+    """Stage results keyed by archive content hash, with LRU eviction by total size.
+
+    Each (key, stage) pair holds one pickled value together with the
+    fingerprint it was computed under; a lookup with a different fingerprint
+    is a miss, so bumping one component version only invalidates the stages
+    that depend on it. The index is SQLite so several processes on a machine
+    can share one cache.
+    """
+
+    def __init__(self, root=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(root, 'index.db'), timeout=60, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        self.stats = {'hits': 0, 'misses': 0, 'stale': 0, 'stored': 0, 'evicted': 0}
+
+    def object_path(self, key, stage):
+        return os.path.join(self.root, 'objects', key[:2], f"{key}.{stage}")
+
+    def get(self, key, stage, fp):
+        """The cached value, or None if absent or computed under another fingerprint."""
+        row = self.conn.execute('SELECT fingerprint, last_used FROM entries WHERE key = ? AND stage = ?',
+                                (key, stage)).fetchone()
+        if row is None or row[0] != fp:
+            self.stats['stale' if row else 'misses'] += 1
+            return None
+        try:
+            with open(self.object_path(key, stage), 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            # evicted by another process between the lookup and the read
+            self.stats['misses'] += 1
+            return None
+        now = time.time()
+        if now - row[1] > TOUCH_INTERVAL:
+            self.conn.execute('UPDATE entries SET last_used = ? WHERE key = ? AND stage = ?', (now, key, stage))
+        self.stats['hits'] += 1
+        return value
+
+    def put(self, key, stage, fp, value):
+        path = self.object_path(key, stage)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+        self.conn.execute('INSERT OR REPLACE INTO entries (key, stage, fingerprint, size, last_used) '
+                          'VALUES (?, ?, ?, ?, ?)', (key, stage, fp, len(data), time.time()))
+        self.stats['stored'] += 1
+        self.evict()
+
+    def total_bytes(self):
+        return self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def evict(self, max_bytes=None):
+        """Drop least recently used entries until the cache fits in max_bytes."""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        excess = self.total_bytes() - max_bytes
+        if excess <= 0:
+            return 0
+        removed = 0
+        for key, stage, size in self.conn.execute(
+                'SELECT key, stage, size FROM entries ORDER BY last_used').fetchall():
+            if excess <= 0:
+                break
+            self.conn.execute('DELETE FROM entries WHERE key = ? AND stage = ?', (key, stage))
+            try:
+                os.remove(self.object_path(key, stage))
+            except FileNotFoundError:
+                pass
+            excess -= size
+            removed += 1
+        self.stats['evicted'] += removed
+        return removed
+
+    def close(self):
+        self.conn.close()
+
+
+def format_stats(stats):
+    return (f"Result cache: {stats['hits']} hits, {stats['misses']} misses, {stats['stale']} stale, "
+            f"{stats['stored']} stored, {stats['evicted']} evicted")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect or trim the result cache.')
+    parser.add_argument('command', choices=['status', 'evict'])
+    parser.add_argument('--cache_dir', type=str, default=CACHE_DIR)
+    parser.add_argument('--max_gb', type=float, help='Size to trim the cache to (evict).')
+    args = parser.parse_args()
+
+    cache = ResultCache(args.cache_dir)
+    if args.command == 'evict':
+        cache.evict(int(args.max_gb * 1024 ** 3) if args.max_gb is not None else None)
+    for stage, entries, size in cache.conn.execute('SELECT stage, COUNT(*), SUM(size) FROM entries GROUP BY stage'):
+        print(f"{stage}: {entries} entries, {size / 1e6:.1f} MB")
+    print(f"total: {cache.total_bytes() / 1e6:.1f} MB of {cache.max_bytes / 1e6:.0f} MB")
+    cache.close()
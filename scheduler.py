@@ -0,0 +1,244 @@
+import os
+import time
+import heapq
+import logging
+from collections import deque
+from functools import partial
+import metrics
+from engine import postscript
+
+# Papers smaller than this are grouped together so a worker does not pay
+# one dispatch round trip per tiny archive
+SMALL_CHUNK_BYTES = 8 * 1024 * 1024
+MAX_CHUNK_ITEMS = 32
+
+# Fixed cost charged to every archive on top of its size (process start-up,
+# tar headers, TexSoup set-up), expressed in bytes so it can be added to sizes
+PER_ITEM_OVERHEAD_BYTES = 64 * 1024
+
+# Chunks planned per worker at least, so every worker gets a share of small corpora
+CHUNKS_PER_WORKER = 4
+
+
+def file_sizes(paths):
+    """Return the on-disk size of each path, 0 for anything we cannot stat."""
+    sizes = []
+    for path in paths:
+        try:
+            sizes.append(os.path.getsize(path))
+        except OSError:
+            sizes.append(0)
+    return sizes
+
+
+def item_cost(size):
+    return (size or 0) + PER_ITEM_OVERHEAD_BYTES
+
+
+def plan_chunks(items, sizes, chunk_bytes=SMALL_CHUNK_BYTES, max_items=MAX_CHUNK_ITEMS, num_workers=None):
+    """Group items into chunks ordered largest-first.
+
+    Every archive at least chunk_bytes in size gets a chunk of its own. Smaller
+    archives are packed together, up to chunk_bytes and max_items per chunk.
+    With num_workers, both limits shrink so there are about CHUNKS_PER_WORKER
+    chunks per worker, and a small corpus is not left to a single worker.
+    Returns a list of (cost, [items]) tuples sorted by decreasing cost.
+    """
+    if num_workers and items:
+        wanted = CHUNKS_PER_WORKER * num_workers
+        total = sum(item_cost(size) for size in sizes)
+        chunk_bytes = max(1, min(chunk_bytes, total // wanted))
+        max_items = max(1, min(max_items, -(-len(items) // wanted)))
+    ordered = sorted(zip(items, sizes), key=lambda pair: item_cost(pair[1]), reverse=True)
+
+    chunks = []
+    current, current_cost = [], 0
+    for item, size in ordered:
+        cost = item_cost(size)
+        if cost >= chunk_bytes:
+            chunks.append((cost, [item]))
+            continue
+        if current and (current_cost + cost > chunk_bytes or len(current) >= max_items):
+            chunks.append((current_cost, current))
+            current, current_cost = [], 0
+        current.append(item)
+        current_cost += cost
+    if current:
+        chunks.append((current_cost, current))
+
+    chunks.sort(key=lambda chunk: chunk[0], reverse=True)
+    return chunks
+
+
+def predict_makespan(costs, num_workers):
+    """Simulate greedy dispatch of costs (in the given order) onto idle workers.
+
+    Returns the load of the busiest worker, in the same unit as costs.
+    """
+    if not costs:
+        return 0
+    loads = [0] * max(1, num_workers)
+    heapq.heapify(loads)
+    for cost in costs:
+        heapq.heappush(loads, heapq.heappop(loads) + cost)
+    return max(loads)
+
+
+def _cpu_seconds():
+    # rasterizers and other subprocesses count towards the chunk that ran them,
+    # the long-lived Ghostscript too, which os.times() only counts once reaped
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system + postscript.cpu_seconds()
+
+
+def run_chunk(func, per_chunk, chunk):
+    """Worker side: process one chunk and report how long it took, and its CPU and stage seconds."""
+    start = time.perf_counter()
+    cpu_start = _cpu_seconds()
+    stages_start = metrics.stage_seconds()
+    results = []
+    if per_chunk:
+        results.append(func(chunk))
+    else:
+        for item in chunk:
+            results.append(func(item))
+    metrics.flush()
+    stages = {name: seconds - stages_start.get(name, 0.0) for name, seconds in metrics.stage_seconds().items()}
+    usage = {'cpu': _cpu_seconds() - cpu_start, 'stages': stages}
+    return os.getpid(), time.perf_counter() - start, chunk, results, usage
+
+
+def run_scheduled(pool, func, items, sizes, num_workers, per_chunk=False,
+                  chunk_bytes=SMALL_CHUNK_BYTES, max_items=MAX_CHUNK_ITEMS,
+                  on_chunk_done=None, controller=None):
+    """Run func over items on pool, largest archives first.
+
+    pool may be a multiprocessing.Pool or a concurrent.futures executor. Chunks
+    are handed out one at a time, so an idle worker always picks up the next
+    largest piece of remaining work instead of waiting on a fixed partition.
+    With per_chunk=True func receives the whole chunk (a list of items),
+    otherwise it is called once per item.
+
+    With an autotune.Controller, the pool is started with its maximum
+    number of workers and only the controller's target number of chunks is
+    in flight at a time.
+
+    Returns (results, report) where report holds predicted and actual makespan.
+    """
+    return run_streamed(pool, func, [list(zip(items, sizes))], num_workers, per_chunk=per_chunk,
+                        chunk_bytes=chunk_bytes, max_items=max_items, on_chunk_done=on_chunk_done,
+                        controller=controller)
+
+
+def run_streamed(pool, func, pages, num_workers, per_chunk=False,
+                 chunk_bytes=SMALL_CHUNK_BYTES, max_items=MAX_CHUNK_ITEMS,
+                 on_chunk_done=None, controller=None):
+    """Like run_scheduled, but starts working while the input listing is still arriving.
+
+    pages yields lists of (item, size) pairs, e.g. one per bucket listing page.
+    Each page is planned largest-first and submitted as soon as it arrives.
+    """
+    worker = partial(run_chunk, func, per_chunk)
+    results = []
+    busy = {}
+    costs, naive_costs = [], []
+    num_items = 0
+    pending = []
+    # planned chunks the controller has not let in yet
+    waiting = deque()
+    start = time.perf_counter()
+
+    def admit():
+        # without a controller everything planned is submitted, the pool queues it
+        limit = controller.update(len(waiting), len(pending)) if controller else float('inf')
+        while waiting and len(pending) < limit:
+            chunk = waiting.popleft()
+            pending.append((_submit(pool, worker, chunk), chunk))
+
+    def collect():
+        still_pending = []
+        for handle, chunk in pending:
+            if not _ready(handle):
+                still_pending.append((handle, chunk))
+                continue
+            try:
+                pid, elapsed, chunk, chunk_results, usage = _result(handle)
+            except Exception as e:
+                logging.error(f"Chunk of {len(chunk)} items failed: {e}")
+                continue
+            busy[pid] = busy.get(pid, 0.0) + elapsed
+            if controller:
+                controller.observe(elapsed, usage['cpu'], usage['stages'])
+            results.extend(chunk_results)
+            if on_chunk_done:
+                on_chunk_done(chunk)
+        pending[:] = still_pending
+
+    for page in pages:
+        items = [item for item, _ in page]
+        sizes = [size for _, size in page]
+        num_items += len(items)
+
+        # Submission order is dispatch order: idle workers take the next largest chunk
+        for cost, chunk in plan_chunks(items, sizes, chunk_bytes=chunk_bytes, max_items=max_items,
+                                       num_workers=controller.maximum if controller else num_workers):
+            costs.append(cost)
+            waiting.append(chunk)
+
+        # What the old fixed-order dispatch would have done, for comparison
+        step = max_items if per_chunk else 1
+        for i in range(0, len(page), step):
+            naive_costs.append(sum(item_cost(size) for size in sizes[i:i + step]))
+
+        collect()
+        admit()
+
+    while pending or waiting:
+        collect()
+        admit()
+        if pending:
+            time.sleep(0.05)
+
+    wall = time.perf_counter() - start
+    total_bytes = sum(costs)
+    seconds_per_byte = sum(busy.values()) / total_bytes if total_bytes else 0.0
+    if controller:
+        num_workers = controller.settings()['most_used']
+    predicted = predict_makespan(costs, num_workers)
+    naive = predict_makespan(naive_costs, num_workers)
+
+    report = {
+        'items': num_items,
+        'chunks': len(costs),
+        'workers': num_workers,
+        'total_bytes': total_bytes,
+        'predicted_makespan_bytes': predicted,
+        'naive_makespan_bytes': naive,
+        'predicted_makespan_s': predicted * seconds_per_byte,
+        'naive_makespan_s': naive * seconds_per_byte,
+        'actual_makespan_s': wall,
+        'busiest_worker_s': max(busy.values()) if busy else 0.0,
+    }
+    return results, report
+
+
+def format_report(report):
+    return (f"Scheduled {report['items']} archives in {report['chunks']} chunks on {report['workers']} workers: "
+            f"predicted makespan {report['predicted_makespan_s']:.1f}s "
+            f"(fixed order {report['naive_makespan_s']:.1f}s), "
+            f"actual {report['actual_makespan_s']:.1f}s, "
+            f"busiest worker {report['busiest_worker_s']:.1f}s")
+
+
+def _submit(pool, func, arg):
+    if hasattr(pool, 'apply_async'):
+        return pool.apply_async(func, (arg,))
+    return pool.submit(func, arg)
+
+
+def _ready(handle):
+    return handle.ready() if hasattr(handle, 'ready') else handle.done()
+
+
+def _result(handle):
+    return handle.get() if hasattr(handle, 'get') else handle.result()
@@ -0,0 +1,153 @@
+import os
+import re
+import json
+import hashlib
+import argparse
+import storage_backend
+
+# Manifests written by each shard live here, relative to the output directory
+SHARDS_DIR = '_shards'
+
+ARCHIVE_EXTENSIONS = ('.tar.gz', '.tgz', '.gz', '.tar', '.pdf')
+
+
+def paper_id_from_name(name):
+    """Derive the paper id (e.g. 2301_01234) from an archive file or blob name."""
+    base = os.path.basename(name)
+    for ext in ARCHIVE_EXTENSIONS:
+        if base.endswith(ext):
+            base = base[:-len(ext)]
+            break
+    match = re.search(r'(\d{4}\.\d{4,5})', base)
+    if match:
+        return match.group(1).replace('.', '_')
+    # old-style ids such as hep-th9901001 are used as-is
+    return base.replace('.', '_')
+
+
+def parse_shard(value):
+    """argparse type for --shard i/N, returns (i, N)."""
+    match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d+)\s*', value or '')
+    if not match:
+        raise argparse.ArgumentTypeError(f"expected --shard i/N, got {value!r}")
+    index, count = int(match.group(1)), int(match.group(2))
+    if count < 1 or index >= count:
+        raise argparse.ArgumentTypeError(f"shard index must be in [0, {count}), got {index}")
+    return index, count
+
+
+def shard_of(paper_id, num_shards):
+    # md5 rather than hash() so the assignment is the same on every machine and run
+    digest = hashlib.md5(paper_id.encode('utf-8')).hexdigest()
+    return int(digest[:16], 16) % num_shards
+
+
+def in_shard(name, shard):
+    if shard is None:
+        return True
+    index, count = shard
+    return shard_of(paper_id_from_name(name), count) == index
+
+
+def select_shard(names, shard):
+    """Keep the names whose paper id hashes to this shard (all of them if shard is None)."""
+    if shard is None:
+        return list(names)
+    return [name for name in names if in_shard(name, shard)]
+
+
+def shard_name(shard):
+    index, count = shard
+    return f"shard-{index:05d}-of-{count:05d}"
+
+
+def write_shard_manifest(output_dir, shard, names):
+    """Record which paper ids this shard was responsible for."""
+    if shard is None:
+        return None
+    index, count = shard
+    manifest_dir = os.path.join(output_dir, SHARDS_DIR)
+    os.makedirs(manifest_dir, exist_ok=True)
+    manifest_path = os.path.join(manifest_dir, f"{shard_name(shard)}.json")
+    manifest = {
+        'shard': index,
+        'num_shards': count,
+        'paper_ids': sorted({paper_id_from_name(name) for name in names}),
+    }
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+    return manifest_path
+
+
+def merge_shards(output_dir, num_shards, names=None):
+    """Check that the N shard manifests cover the input exactly once.
+
+    names, when given, is the full input listing the shards were cut from.
+    Returns a summary dict; 'ok' is False if any shard is missing, a paper was
+    processed by two shards, a paper landed on the wrong shard, or part of the
+    listing was not covered.
+    """
+    manifest_dir = os.path.join(output_dir, SHARDS_DIR)
+    seen = {}
+    missing_shards = []
+    duplicates = set()
+    misplaced = set()
+
+    for index in range(num_shards):
+        manifest_path = os.path.join(manifest_dir, f"{shard_name((index, num_shards))}.json")
+        if not os.path.exists(manifest_path):
+            missing_shards.append(index)
+            continue
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        for paper_id in manifest['paper_ids']:
+            if paper_id in seen:
+                duplicates.add(paper_id)
+            seen[paper_id] = index
+            if shard_of(paper_id, num_shards) != index:
+                misplaced.add(paper_id)
+
+    uncovered = set()
+    if names is not None:
+        uncovered = {paper_id_from_name(name) for name in names} - set(seen)
+
+    summary = {
+        'num_shards': num_shards,
+        'papers': len(seen),
+        'missing_shards': missing_shards,
+        'duplicates': sorted(duplicates),
+        'misplaced': sorted(misplaced),
+        'uncovered': sorted(uncovered),
+    }
+    summary['ok'] = not (missing_shards or duplicates or misplaced or uncovered)
+
+    os.makedirs(manifest_dir, exist_ok=True)
+    with open(os.path.join(manifest_dir, 'merged.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that --shard i/N runs covered the input exactly once.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    merge_parser = subparsers.add_parser('merge', help='Merge shard manifests and check coverage.')
+    merge_parser.add_argument('--output_dir', type=str, required=True, help='Directory holding the _shards manifests.')
+    merge_parser.add_argument('--num_shards', type=int, required=True, help='Number of shards the run was split into.')
+    merge_parser.add_argument('--papers_dir', type=str, help='Local input directory to check coverage against.')
+    merge_parser.add_argument('--bucket', type=str, help='GCS bucket to check coverage against.')
+    args = parser.parse_args()
+
+    names = None
+    if args.papers_dir:
+        names = [name for root, dirs, files in os.walk(args.papers_dir) for name in files]
+    elif args.bucket:
+        names = [blob.name for blob in storage_backend.iter_blobs(storage_backend.open_bucket(args.bucket))]
+
+    summary = merge_shards(args.output_dir, args.num_shards, names)
+    print(f"{summary['papers']} papers across {args.num_shards} shards, "
+          f"missing shards: {summary['missing_shards']}, duplicates: {len(summary['duplicates'])}, "
+          f"misplaced: {len(summary['misplaced'])}, uncovered: {len(summary['uncovered'])}")
+    if not summary['ok']:
+        raise SystemExit(1)
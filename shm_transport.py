@@ -0,0 +1,112 @@
+import os
+import glob
+import struct
+import multiprocessing
+from collections import namedtuple
+from contextlib import contextmanager
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import _posixshmem
+
+# Payloads below this many bytes are cheaper to pickle than to map; creating
+# a segment costs about as much as pickling 1 MB (benchmarks/bench_transport.py)
+INLINE_BYTES = 1024 * 1024
+
+# Each segment starts with its reference count
+REFCOUNT = struct.Struct('<q')
+
+# What goes through the queue: a segment name and payload size, or the
+# payload itself when it is small
+Handle = namedtuple('Handle', ['name', 'size', 'data'])
+
+
+def _open(name, create=False, size=0):
+    """Create or attach a segment without leaving it registered with this process's resource tracker."""
+    shm = SharedMemory(name=name, create=create, size=size)
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class Transport:
+    """Moves large byte payloads between processes through shared memory.
+
+    Create it in the parent before starting workers so they inherit its lock.
+    put() copies a payload into a new segment once and returns a small
+    Handle to send instead of the bytes; each of the readers it was put for
+    calls view() (zero-copy) or get() (a bytes copy) exactly once, and the
+    last one unlinks the segment.
+
+    A segment belongs to its reference count, not to the process that made
+    it, so it is kept out of multiprocessing's resource trackers: those
+    would unlink it again at exit, or warn about it, in every process that
+    created or opened it. cleanup() removes what workers that died left.
+    """
+
+    def __init__(self, inline_bytes=INLINE_BYTES, prefix=None):
+        self.inline_bytes = inline_bytes
+        self.prefix = prefix or f"figures-{os.getpid()}"
+        self.lock = multiprocessing.Lock()
+        self._counter = 0
+
+    def put(self, data, readers=1):
+        size = len(data)
+        if size < self.inline_bytes:
+            return Handle(None, size, bytes(data))
+        self._counter += 1
+        name = f"{self.prefix}-{os.getpid()}-{self._counter}"
+        shm = _open(name, create=True, size=REFCOUNT.size + size)
+        try:
+            REFCOUNT.pack_into(shm.buf, 0, readers)
+            shm.buf[REFCOUNT.size:REFCOUNT.size + size] = data
+        finally:
+            shm.close()
+        return Handle(name, size, None)
+
+    @contextmanager
+    def view(self, handle):
+        """A read-only memoryview of the payload, valid inside the block; releases one reference on exit."""
+        if handle.name is None:
+            yield memoryview(handle.data)
+            return
+        shm = _open(handle.name)
+        view = shm.buf[REFCOUNT.size:REFCOUNT.size + handle.size].toreadonly()
+        try:
+            yield view
+        finally:
+            view.release()
+            self._release(shm)
+
+    def get(self, handle):
+        with self.view(handle) as view:
+            return bytes(view)
+
+    def release(self, handle):
+        """Drop a reference without reading the payload."""
+        if handle.name is not None:
+            self._release(_open(handle.name))
+
+    def _release(self, shm):
+        with self.lock:
+            remaining = REFCOUNT.unpack_from(shm.buf, 0)[0] - 1
+            REFCOUNT.pack_into(shm.buf, 0, remaining)
+        shm.close()
+        if remaining <= 0:
+            # the last reader, the only one to unlink it
+            _posixshmem.shm_unlink(shm._name)
+
+    def cleanup(self):
+        """Unlink segments left behind by workers that died holding them. Returns how many."""
+        leftovers = glob.glob(f"/dev/shm/{self.prefix}-*")
+        for path in leftovers:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return len(leftovers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
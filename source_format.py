@@ -0,0 +1,112 @@
+import os
+import gzip
+import struct
+import zlib
+import shutil
+import tarfile
+
+# What an arXiv source file can turn out to be
+TAR = 'tar'
+TAR_GZ = 'tar.gz'
+GZIP = 'gzip'
+PDF = 'pdf'
+UNKNOWN = 'unknown'
+
+# ustar magic sits at offset 257 of the first tar header
+TAR_MAGIC_OFFSET = 257
+HEADER_BYTES = 512
+
+COPY_BUFFER = 1024 * 1024
+
+
+def _gunzip_head(head):
+    """Decompress just enough of a gzip stream to look at its first header block."""
+    try:
+        return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(head, HEADER_BYTES)
+    except zlib.error:
+        return b''
+
+
+def _is_tar_header(block):
+    """Whether a 512-byte block is a tar header, by its checksum: old v7 tars have no ustar magic."""
+    if block[TAR_MAGIC_OFFSET:TAR_MAGIC_OFFSET + 5] == b'ustar':
+        return True
+    if len(block) < HEADER_BYTES:
+        return False
+    try:
+        tarfile.TarInfo.frombuf(block[:HEADER_BYTES], tarfile.ENCODING, 'surrogateescape')
+    except tarfile.HeaderError:
+        return False
+    return True
+
+
+def sniff(path):
+    """Identify a source file from its magic bytes, reading at most 64 KB of it."""
+    if path.lower().endswith('.pdf'):
+        return PDF
+    with open(path, 'rb') as f:
+        head = f.read(64 * 1024)
+    if head[:2] == b'\x1f\x8b':
+        inner = _gunzip_head(head)
+        if _is_tar_header(inner):
+            return TAR_GZ
+        if inner.startswith(b'%PDF'):
+            return PDF
+        return GZIP
+    if _is_tar_header(head[:HEADER_BYTES]):
+        return TAR
+    if head.startswith(b'%PDF'):
+        return PDF
+    return UNKNOWN
+
+
+def unpacked_size(path, kind=None):
+    """Estimate of the bytes a source unpacks to, without decompressing it.
+
+    Gzip streams record their uncompressed size modulo 4 GB in the last four
+    bytes; for multi-member files that is only the last member's size.
+    """
+    kind = kind or sniff(path)
+    size = os.path.getsize(path)
+    if kind == PDF:
+        return 0
+    if kind not in (GZIP, TAR_GZ) or size < 18:
+        return size
+    with open(path, 'rb') as f:
+        f.seek(-4, os.SEEK_END)
+        unpacked = struct.unpack('<I', f.read(4))[0]
+    # deflate never grows data by more than a fraction of a percent, so a
+    # smaller recorded size means it wrapped past 4 GB
+    while unpacked * 1.01 + 1024 < size:
+        unpacked += 1 << 32
+    return unpacked
+
+
+def source_stem(path):
+    name = os.path.basename(path)
+    for ext in ('.tar.gz', '.tgz', '.gz', '.tar'):
+        if name.endswith(ext):
+            return name[:-len(ext)]
+    return os.path.splitext(name)[0]
+
+
+def extract_source(path, extract_path, kind=None):
+    """Unpack a source file into extract_path with the cheapest reader for its format.
+
+    Plain gzip sources are single .tex files and are streamed to
+    <stem>.tex; PDF-only submissions are not opened at all. Returns the
+    detected kind. Raises if the file cannot be read as its detected format.
+    """
+    kind = kind or sniff(path)
+    if kind == PDF:
+        return kind
+    os.makedirs(extract_path, exist_ok=True)
+    if kind == GZIP:
+        with gzip.open(path, 'rb') as src, open(os.path.join(extract_path, source_stem(path) + '.tex'), 'wb') as dst:
+            shutil.copyfileobj(src, dst, COPY_BUFFER)
+        return kind
+    # old tars without the ustar magic still go through tarfile's own detection
+    mode = {TAR: 'r:', TAR_GZ: 'r:gz'}.get(kind, 'r')
+    with tarfile.open(path, mode=mode) as tar:
+        tar.extractall(path=extract_path)
+    return kind
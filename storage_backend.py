@@ -0,0 +1,254 @@
+import os
+import re
+import json
+import queue
+import base64
+import hashlib
+import shutil
+import threading
+from collections import namedtuple
+from itertools import islice
+
+# Objects requested per listing call
+PAGE_SIZE = 1000
+# Parallel listing threads when a listing is split by prefix
+LISTING_THREADS = 8
+# Where listings are cached between runs
+LISTING_CACHE_DIR = '.listing_cache'
+
+# What we keep about each object in a listing
+BlobInfo = namedtuple('BlobInfo', ['name', 'size', 'generation'])
+
+_client = None
+
+
+def new_client():
+    from google.cloud import storage
+    return storage.Client()
+
+
+def get_client():
+    """Shared GCS client, created on first use so local runs never need credentials."""
+    global _client
+    if _client is None:
+        _client = new_client()
+    return _client
+
+
+def is_local(location):
+    return location.startswith('file://') or os.path.isdir(location)
+
+
+def check_location(location):
+    """Raise ValueError for a location that is neither a local directory nor a possible bucket name.
+
+    A local path that does not exist yet would otherwise be taken for a bucket
+    name and only fail, on missing credentials, when it is first used.
+    """
+    if is_local(location):
+        return location
+    name = location[len('gs://'):] if location.startswith('gs://') else location
+    if not re.fullmatch(r'[a-z0-9][a-z0-9._-]{1,220}[a-z0-9]', name):
+        raise ValueError(f"{location!r} is not an existing directory or a bucket name; "
+                         f"create the directory or pass file://{os.path.abspath(location)}")
+    return location
+
+
+def open_bucket(location, client=None):
+    """Open a GCS bucket by name, or a local stand-in for file:// URLs and existing directories."""
+    if location.startswith('file://'):
+        return LocalBucket(location[len('file://'):])
+    if os.path.isdir(location):
+        return LocalBucket(location)
+    if location.startswith('gs://'):
+        location = location[len('gs://'):]
+    return (client or get_client()).bucket(location)
+
+
+class LocalBucket:
+    """Directory that behaves like the parts of a GCS bucket the scripts use."""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.name = os.path.basename(self.root.rstrip(os.sep))
+        os.makedirs(self.root, exist_ok=True)
+
+    def blob(self, name):
+        return LocalBlob(self, name)
+
+    def get_blob(self, name):
+        blob = LocalBlob(self, name)
+        return blob if blob.exists() else None
+
+    def list_blobs(self, prefix=None, max_results=None, page_size=None):
+        # Sorted walk so pages come back in the same order as GCS would return them
+        def walk():
+            for root, dirs, files in os.walk(self.root):
+                dirs.sort()
+                for file in sorted(files):
+                    name = os.path.relpath(os.path.join(root, file), self.root).replace(os.sep, '/')
+                    if prefix and not name.startswith(prefix):
+                        continue
+                    yield LocalBlob(self, name)
+        return islice(walk(), max_results)
+
+
+class LocalBlob:
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.path = os.path.join(bucket.root, *name.split('/'))
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def reload(self):
+        if not self.exists():
+            raise FileNotFoundError(self.path)
+
+    @property
+    def size(self):
+        return os.path.getsize(self.path) if self.exists() else None
+
+    @property
+    def generation(self):
+        return os.stat(self.path).st_mtime_ns if self.exists() else None
+
+    @property
+    def md5_hash(self):
+        # base64 of the raw digest, the same encoding GCS uses
+        if not self.exists():
+            return None
+        digest = hashlib.md5()
+        with open(self.path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return base64.b64encode(digest.digest()).decode('ascii')
+
+    @property
+    def crc32c(self):
+        return None
+
+    def download_to_filename(self, filename):
+        shutil.copyfile(self.path, filename)
+
+    def download_as_bytes(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    download_as_string = download_as_bytes
+
+    def upload_from_filename(self, filename):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(filename, tmp_path)
+        os.replace(tmp_path, self.path)
+
+    def upload_from_string(self, data, content_type=None):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    def delete(self):
+        os.remove(self.path)
+
+
+def iter_blobs(bucket, prefix=None, page_size=PAGE_SIZE):
+    """Yield BlobInfo for every object under prefix, fetching pages lazily."""
+    for blob in bucket.list_blobs(prefix=prefix, page_size=page_size):
+        yield BlobInfo(blob.name, blob.size or 0, blob.generation)
+
+
+def iter_blobs_partitioned(bucket, prefixes, page_size=PAGE_SIZE, num_threads=LISTING_THREADS):
+    """List several prefixes concurrently, yielding objects as soon as any page arrives."""
+    results = queue.Queue(maxsize=page_size * num_threads)
+    pending = list(prefixes)
+    lock = threading.Lock()
+    errors = []
+    done = object()
+
+    def lister():
+        try:
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    prefix = pending.pop(0)
+                for info in iter_blobs(bucket, prefix, page_size):
+                    results.put(info)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            results.put(done)
+
+    threads = [threading.Thread(target=lister, daemon=True) for _ in range(min(num_threads, len(pending)) or 1)]
+    for thread in threads:
+        thread.start()
+
+    finished = 0
+    while finished < len(threads):
+        item = results.get()
+        if item is done:
+            finished += 1
+            continue
+        yield item
+    if errors:
+        raise errors[0]
+
+
+def listing_cache_path(bucket, prefix=None, prefixes=None, cache_dir=LISTING_CACHE_DIR):
+    """Cache file of one listing, keyed on the full location, prefix and split prefixes."""
+    location = f"file://{bucket.root}" if isinstance(bucket, LocalBucket) else f"gs://{bucket.name}"
+    digest = hashlib.sha256(json.dumps([location, prefix or '', sorted(prefixes or [])]).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, f"{bucket.name}-{digest[:16]}.jsonl")
+
+
+def iter_listing(bucket, prefix=None, prefixes=None, cache_dir=LISTING_CACHE_DIR, refresh=False,
+                 page_size=PAGE_SIZE):
+    """Stream a bucket listing, reusing the local cache from an earlier run when there is one.
+
+    prefixes splits the listing into independent ranges that are listed in
+    parallel (e.g. one per leading digit of the paper id). The listing is
+    written to the cache as it streams and only becomes visible to later runs
+    once it completed.
+    """
+    cache_path = listing_cache_path(bucket, prefix, prefixes, cache_dir)
+    if not refresh and os.path.exists(cache_path):
+        with open(cache_path, 'r') as f:
+            for line in f:
+                yield BlobInfo(*json.loads(line))
+        return
+
+    if prefixes:
+        source = iter_blobs_partitioned(bucket, [(prefix or '') + p for p in prefixes], page_size)
+    else:
+        source = iter_blobs(bucket, prefix, page_size)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            for info in source:
+                f.write(json.dumps(list(info)) + '\n')
+                yield info
+        os.replace(tmp_path, cache_path)
+    finally:
+        # a listing that was abandoned part way is not worth keeping
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def iter_pages(iterable, page_size=PAGE_SIZE):
+    """Group an iterable into lists of at most page_size items."""
+    iterator = iter(iterable)
+    while True:
+        page = list(islice(iterator, page_size))
+        if not page:
+            return
+        yield page
+
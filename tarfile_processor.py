@@ -1,15 +1,17 @@
 # %%
 import os
 import tarfile
-import tempfile
-from TexSoup import TexSoup, TexNode
-import json
-import shutil
 import re
-from collections import defaultdict
-from io import BytesIO
-from PIL import Image
-from pdf2image import convert_from_path
+import sharding
+import partitions
+import work_queue
+import uploader
+import metrics
+import result_cache
+import memory_budget
+import caption_index
+import figure_filter
+import engine
 
 
 # %%
@@ -17,7 +19,8 @@ PAPERS = 'papers'
 OUTPUT = 'output'
 
 # %%
-failed_tars = set()
+# The engine every archive goes through; main() sets it up from the options
+pipeline = engine.Engine([engine.InterleavedOutput(OUTPUT)])
 
 # %%
 def process_tar_gz_file(tar_gz_path):
@@ -34,237 +37,26 @@ def process_tar_gz_file(tar_gz_path):
         paper_id = match.group(1).replace('.', '_')
 
     # is there a file that starts with the paper id in output?
-    if any([file.startswith(f"{paper_id}_") for file in os.listdir(OUTPUT)]):
+    output_dir = pipeline.outputs[0].directory_for(tar_gz_file)
+    if os.path.isdir(output_dir) and any([file.startswith(f"{paper_id}_") for file in os.listdir(output_dir)]):
         print(f"Skipping {tar_gz_file}, {paper_id} already processed")
         return
 
-    with tempfile.TemporaryDirectory() as temp_dir:
-        extract_tar_gz(tar_gz_path, temp_dir)
-        process_extracted_files(temp_dir, tar_gz_file)
-
-def extract_tar_gz(tar_gz_path, extract_path):
-    try:
-        with tarfile.open(tar_gz_path) as tar:
-            tar.extractall(path=extract_path)
-    except Exception as e:
-        #print(f"Error extracting {tar_gz_path}: {e}")
-        failed_tars.add(tar_gz_path)
-
-def process_extracted_files(extract_path, tar_gz_file):
-    for root, dirs, files in os.walk(extract_path):
-        for file in files:
-            if file.endswith(".tex"):
-                tex_path = os.path.join(root, file)
-                try:
-                    process_tex_file(tex_path, tar_gz_file, extract_path)
-                except Exception as e:
-                    #print(f"Error processing {tar_gz_file} for {tex_path}: {e}")
-                    pass
-
-def process_tex_file(tex_path, tar_gz_file, extract_path):
-    store_res = defaultdict(list)
-    store_res['texts'] = []
-    store_res['images'] = []
-    store_res['captions'] = []
-    image_paths = []
-    with open(tex_path, 'r', encoding='utf-8') as f:
-        tex_content = f.read()
-
-        if tex_content.find(r'\begin{document}') != -1:
-            tex_content = tex_content[tex_content.find(r'\begin{document}'):]
-
-        soup = TexSoup(tex_content, tolerance=1)
-
-        # remove .tar.gz and replace . with _
-        paper_id = os.path.splitext(tar_gz_file)[0].replace('.', '_')
-
-        def traverse_and_interleave(node):
-            if isinstance(node, TexNode):
-                if node.name == 'section':
-                    section_title = node.string
-                    if section_title:
-                        store_res['texts'].append(section_title)
-                        store_res['images'].append(None)
-                elif node.name in ['figure', 'includegraphics', 'epsfig', 'epsfbox']:
-                    image_filenames = []
-                    caption = None
-                    if node.name == 'figure':
-                        includegraphics_nodes = node.find_all('includegraphics')
-                        epsfig_nodes = node.find_all('epsfig')
-                        epsfbox_nodes = node.find_all('epsfbox')
-                        caption_node = node.find('caption')
-                        if caption_node:
-                            caption = caption_node.text
-                            if isinstance(caption, list):
-                                caption = ' '.join(caption)
-                            caption = clean_text_content(caption)
-
-                        for includegraphics_node in includegraphics_nodes:
-                            image_filename = extract_image_filename(includegraphics_node)
-                            if image_filename:
-                                image_filenames.append(image_filename)
-
-                        for epsfig_node in epsfig_nodes:
-                            image_filename = extract_image_filename(epsfig_node)
-                            if image_filename:
-                                image_filenames.append(image_filename)
-
-                        for epsfbox_node in epsfbox_nodes:
-                            image_filename = extract_image_filename(epsfbox_node)
-                            if image_filename:
-                                image_filenames.append(image_filename)
-                    else:
-                        image_filename = extract_image_filename(node)
-                        if image_filename:
-                            image_filenames.append(image_filename)
-
-                    image_filenames = list(set(image_filenames))
-
-                    for image_filename in image_filenames:
-                        prefixed_image_filename = f"{paper_id}_{os.path.basename(image_filename)}"
-                        #make extension .jpeg
-                        prefixed_image_filename = os.path.splitext(prefixed_image_filename)[0] + '.jpeg'
-
-                        if prefixed_image_filename in store_res['images']:
-                            continue
-
-                        real_image_path = os.path.join(extract_path, image_filename)
-
-                        image_paths.append(real_image_path)
-
-                        store_res['texts'].append(None)
-                        store_res['captions'].append(caption)
-                        store_res['images'].append(prefixed_image_filename)
-
-            elif isinstance(node, str):
-                text_content = node.strip()
-                if text_content:
-                    text_content = clean_text_content(text_content)
-                    if text_content:
-                        store_res['texts'].append(text_content)
-                        store_res['images'].append(None)
-
-            for child in getattr(node, 'contents', []):
-                traverse_and_interleave(child)
-
-        traverse_and_interleave(soup)
-
-        #combine any consecutive text elements, remove empty elements
-        for i in range(len(store_res['texts'])-1, 0, -1):
-            if store_res['texts'][i] is not None and store_res['texts'][i-1] is not None:
-                store_res['texts'][i-1] += ' ' + store_res['texts'][i]
-                store_res['texts'].pop(i)
-
-        for i in range(len(store_res['images'])-1, 0, -1):
-            if store_res['images'][i] is None and store_res['images'][i-1] is None:
-                store_res['images'].pop(i)
-
-        save_interleaved_list(paper_id, store_res, image_paths)
-
-def extract_image_filename(node):
-    if node.name == 'epsfbox':
-        image_options = node.args
-        if isinstance(image_options, list) and len(image_options) > 0:
-            image_filename = str(image_options[0]).strip()
-            if image_filename.startswith('{') and image_filename.endswith('}'):
-                image_filename = image_filename[1:-1]
-            return image_filename
-    else:
-        image_options = node.args
-        if isinstance(image_options, list) and len(image_options) > 0:
-            image_filename = str(image_options[-1]).strip()
-            if image_filename.startswith('{') and image_filename.endswith('}'):
-                image_filename = image_filename[1:-1]
-            return image_filename
-    return None
-
-def copy_image_file(extract_path, image_filename, prefixed_image_filename):
-    image_path = os.path.join(extract_path, image_filename)
-    output_image_path = os.path.join(OUTPUT, 'figures', prefixed_image_filename)
-
-    os.makedirs(os.path.dirname(output_image_path), exist_ok=True)
-
-    if os.path.exists(image_path):
-        shutil.copy(image_path, output_image_path)
-        return True
-    else:
-        print(f"Image file not found: {image_path}")
-        return False
-
-def images_to_tiff_bytes(images, quality=90):
-    tiff_bytes = BytesIO()
-    images[0].save(tiff_bytes, format="TIFF", save_all=True, append_images=images[1:],
-                             quality=quality, compression="jpeg")
-    tiff_data = tiff_bytes.getvalue()
-    tiff_bytes.close()
-    return tiff_data
-
-def save_interleaved_list(paper_id, res, image_paths):
-    if len(image_paths) == 0:
-        return
-
-    output_filename = f"{paper_id}.json"
-    output_path = os.path.join(OUTPUT, output_filename)
-
-    # if pdf, convert then store as pillow, else store as pillow
-    pillows = []
-    for image_path in image_paths:
-        if image_path.endswith('.pdf'):
-            pdf_pillows = convert_from_path(image_path, fmt='jpeg')
-            pillows.extend(pdf_pillows)
-        else:
-            image = Image.open(image_path)
-            pillows.append(image)
-
-    tiff = images_to_tiff_bytes(pillows)
-
-    if os.path.exists(output_path):
-        # open .json file and append to it
-        with open(output_path, 'r') as f:
-            existing_data = json.load(f)
-            res['texts'] = existing_data['texts'] + res['texts']
-            res['images'] = existing_data['images'] + res['images']
-            res['captions'] = existing_data['captions'] + res['captions']
-
-    #if tiff exists, append to it
-    tiff_output_path = os.path.join(OUTPUT, f"{paper_id}.tiff")
-    if os.path.exists(tiff_output_path):
-        with open(tiff_output_path, 'rb') as f:
-            existing_tiff = f.read()
-            tiff = existing_tiff + tiff
-
-    with open(output_path, 'w') as f:
-        json.dump(res, f)
-    with open(tiff_output_path, 'wb') as f:
-        f.write(tiff)
-
-def clean_text_content(text):
-    text = re.sub(r'\\[a-zA-Z]+', '', text)
-    text = re.sub(r'\\[^a-zA-Z]', '', text)
-    text = re.sub(r'\{[^}]*\}', '', text)
-    text = re.sub(r'\$.*?\$', '', text)
-    text = re.sub(r'%.*', '', text)
-    text = re.sub(r'width=[\d.]+', '', text)
-    text = re.sub(r'[\d.]+pt', '', text)
-    text = re.sub(r'[\d.]+in', '', text)
-    text = re.sub(r'[\d.]+em', '', text)
-    text = re.sub(r',\s*trim=[\d\s]+,\s*clip\s+figures/[\w.]+', '', text)
-    text = re.sub(r',\s*trim=[\d\s]+\s+figures/[\w.]+', '', text)
-    text = re.sub(r'[\w./]+\.(pdf|png|jpg|jpeg|gif|bmp|tiff|svg)', '', text, flags=re.IGNORECASE)
-    text = re.sub(r'trim=[\d\s.]+_?', '', text)
-    text = re.sub(r'\s+', ' ', text).strip()
-    text = re.sub(r'^\s*-\s+', '', text)
-    text = re.sub(r'^\s*\\\[\s*\\\]\s*', '', text)
-    text = re.sub(r'\s+', ' ', text).strip()
-    text = re.sub(r'\\caption{([^}]*)}', r'\1', text)
-    return text
+    pipeline.process(tar_gz_path)
 
 # %%
 from tqdm import tqdm
 
-def process_files(tar_gz_files):
-    for tar_gz_file in tqdm(tar_gz_files, total=len(tar_gz_files),desc='Processing', unit='file', ncols=80, bar_format='{desc}: {percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]', colour='green'):
+# ship finished outputs every this many archives when uploading during the run
+UPLOAD_EVERY = 50
+
+def process_files(tar_gz_files, upload=None, indexer=None):
+    for i, tar_gz_file in enumerate(tqdm(tar_gz_files, total=len(tar_gz_files),desc='Processing', unit='file', ncols=80, bar_format='{desc}: {percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]', colour='green')):
         process_tar_gz_file(tar_gz_file)
+        if upload and (i + 1) % UPLOAD_EVERY == 0:
+            upload.sync()
+        if indexer:
+            indexer.update()
 
 # tar_gz_files = [f for f in os.listdir(PAPERS) if f.endswith('.tar.gz')]
 # process_files(tar_gz_files)
@@ -273,13 +65,41 @@ def process_files(tar_gz_files):
 # extracts tar to PAPERS directory
 # outputs json and tiff files to OUTPUT directory
 
-def main(tar_path):
+def main(tar_path, shard=None, queue=None, upload_bucket=None, cache_dir=None, cache_max_bytes=result_cache.MAX_BYTES,
+         ir=None, index_dir=None, thresholds=None, partitioned=False, wanted=None):
+  global pipeline
+  outputs = [engine.InterleavedOutput(OUTPUT, partitioned, shard)]
+  if ir:
+    outputs.append(engine.FigureIROutput(ir))
+  cache = result_cache.ResultCache(cache_dir, cache_max_bytes) if cache_dir else None
+  pipeline = engine.Engine(outputs, cache=cache, figure_thresholds=thresholds)
+  # captions are indexed as outputs are written, and once more at the end
+  indexer = caption_index.Indexer(index_dir, OUTPUT) if index_dir else None
+  with metrics.Reporter() as reporter:
+    run(tar_path, shard, queue, upload_bucket, wanted, indexer)
+  if indexer:
+    indexer.update(force=True)
+    print(f"Indexed {indexer.docs} new captions in {index_dir}")
+  if reporter.summary:
+    print(metrics.format_summary(reporter.summary))
+  if memory_budget.enabled():
+    print(memory_budget.format_usage())
+  if cache:
+    print(result_cache.format_stats(cache.stats))
+    cache.close()
+
+def run(tar_path, shard=None, queue=None, upload_bucket=None, wanted=None, indexer=None):
+  # a wrong upload destination fails here, before anything is extracted
+  upload = uploader.Uploader(upload_bucket, OUTPUT) if upload_bucket else None
   # extract tar file
   os.makedirs(OUTPUT, exist_ok=True)
   with tarfile.open(tar_path, mode='r') as tar:
     if not os.path.exists(PAPERS):
       os.makedirs(PAPERS)
-    tar.extractall(path=PAPERS)
+    # only unpack the papers that belong to this machine's shard and the wanted months
+    members = [m for m in tar.getmembers()
+               if not m.isfile() or (sharding.in_shard(m.name, shard) and partitions.in_partitions(m.name, wanted))]
+    tar.extractall(path=PAPERS, members=members)
 
   # process files
   # recursive listdir to get all files
@@ -289,22 +109,51 @@ def main(tar_path):
       files.append(os.path.join(root, filename))
 
   #tar_gz_files = [f for f in files if f.endswith('.tar.gz') or f.endswith('.gz')]
-  tar_gz_files = files
-  process_files(tar_gz_files)
+  tar_gz_files = [f for f in sharding.select_shard(files, shard) if partitions.in_partitions(f, wanted)]
+  if queue:
+    work_queue.seed_queue(queue, tar_gz_files, [os.path.getsize(f) for f in tar_gz_files])
+    work_queue.drain_queue(queue, process_tar_gz_file)
+    print(f"Queue {queue}: {work_queue.queue_stats(queue)}")
+  else:
+    process_files(tar_gz_files, upload, indexer)
+  sharding.write_shard_manifest(OUTPUT, shard, tar_gz_files)
+  catalog = pipeline.outputs[0].catalog
+  if catalog:
+    print(f"Catalog of {len(catalog.partitions())} partitions written to {catalog.export()}")
+  if upload:
+    upload.sync(force=True)
+    print(uploader.format_stats(upload.close()))
 
 
 
 # %%
 if __name__ == '__main__':
-  import sys
-  tarfile_path = sys.argv[1]
-
-  #help and usage
-  if tarfile_path == '-h' or tarfile_path == '--help':
-    print("Usage: python3 extract.py <path to tarfile>")
-    sys.exit(0)
-
-  main(tarfile_path)
-  print(f"Failed tars: {failed_tars}")
-
-
+  import argparse
+  parser = argparse.ArgumentParser(description='Extract text and figures from a tar of arXiv source archives.')
+  parser.add_argument('tarfile_path', help='Path to the tar file of .tar.gz/.gz sources.')
+  parser.add_argument('--shard', type=sharding.parse_shard, help='Only process shard i of N, e.g. --shard 0/4.')
+  parser.add_argument('--queue', type=str, help='Pull archives from this work queue database instead of a fixed list.')
+  parser.add_argument('--upload_bucket', type=str, help='Upload outputs to this bucket while processing runs.')
+  parser.add_argument('--metrics_dir', type=str, help='Write per-stage timings, counters and RSS here.')
+  parser.add_argument('--profile', type=int, default=0, help='Keep cProfile dumps of the N slowest papers (needs --metrics_dir).')
+  parser.add_argument('--result_cache', type=str, help='Reuse results of archives already processed, keyed by content hash.')
+  parser.add_argument('--result_cache_gb', type=float, default=result_cache.MAX_BYTES / 1024 ** 3, help='Evict least recently used results beyond this size.')
+  parser.add_argument('--memory_budget_gb', type=float, help='Wait before unpacking or rendering while this much is reserved.')
+  parser.add_argument('--index_dir', type=str, help='Add the captions written by this run to this caption index.')
+  parser.add_argument('--filter_figures', type=figure_filter.parse_thresholds, nargs='?', const='',
+                      help='Drop blank, tiny, thin and mostly white figures before encoding; '
+                           'optionally override thresholds, e.g. min_side=48,max_aspect=8.')
+  parser.add_argument('--partitioned', action='store_true', help='Write outputs under yymm (or category/yymm) directories, with a catalog.')
+  parser.add_argument('--partitions', type=partitions.parse_partitions, help='Only process these months, e.g. 2301,2303-2306.')
+  parser.add_argument('--ir_dir', type=str, help='Also write each paper\'s parsed items here, see figure_ir.py.')
+  args = parser.parse_args()
+
+  if args.metrics_dir:
+    metrics.configure(args.metrics_dir, profile_top=args.profile)
+  if args.memory_budget_gb:
+    memory_budget.configure(args.memory_budget_gb * 1024 ** 3)
+
+  main(args.tarfile_path, shard=args.shard, queue=args.queue, upload_bucket=args.upload_bucket,
+       cache_dir=args.result_cache, cache_max_bytes=int(args.result_cache_gb * 1024 ** 3), ir=args.ir_dir,
+       index_dir=args.index_dir, thresholds=args.filter_figures, partitioned=args.partitioned, wanted=args.partitions)
+  print(f"Failed tars: {pipeline.failed}")
@@ -0,0 +1,51 @@
+import os
+import sys
+import stat
+
+import pytest
+
+# shared modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import postscript  # noqa: E402
+
+# Answers converter jobs like gs: renders a page of the job's size, blank unless
+# the figure says INK, and prints the job's marker, so the protocol and the
+# figure filter are tested without Ghostscript
+FAKE_GS = r'''#!{python}
+import re, sys, time
+from PIL import Image
+job = ''
+for line in sys.stdin:
+    job += line
+    if 'print flush' not in line:
+        continue
+    out = re.search(r'/OutputFile \((.*?)\)', job).group(1).replace('%d', '1')
+    dpi = float(re.search(r'/HWResolution \[(\S+)', job).group(1))
+    width, height = map(float, re.search(r'/PageSize \[(\S+) (\S+)\]', job).groups())
+    source = re.search(r'\{{ \((.*?)\) run \}}', job).group(1)
+    body = open(source, 'rb').read()
+    time.sleep(0.01)
+    status = 'error' if b'ERROR' in body else 'ok'
+    page = Image.new('RGB', (int(width / 72 * dpi), int(height / 72 * dpi)), 'white')
+    if b'INK' in body:
+        # a figure that draws something: a dark diagonal band
+        for x in range(page.width):
+            for y in range(max(0, x * page.height // page.width - 3), min(page.height, x * page.height // page.width + 3)):
+                page.putpixel((x, y), (20, 20, 20))
+    page.save(out)
+    marker = re.search(r'\(\\n(\S+) ok', job).group(1)
+    sys.stdout.write(f'figure output\n{{marker}} {{status}}\n')
+    sys.stdout.flush()
+    job = ''
+'''
+
+
+@pytest.fixture
+def fake_gs(tmp_path, monkeypatch):
+    path = tmp_path / 'gs'
+    path.write_text(FAKE_GS.format(python=sys.executable))
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(postscript, 'GHOSTSCRIPT', str(path))
+    yield path
+    postscript.close()
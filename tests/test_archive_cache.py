@@ -0,0 +1,71 @@
+import os
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor
+
+import archive_cache
+import storage_backend
+
+
+def make_bucket(root, contents):
+    bucket = storage_backend.LocalBucket(str(root))
+    for name, data in contents.items():
+        bucket.blob(name).upload_from_string(data)
+    return bucket
+
+
+def test_second_fetch_is_a_hit(tmp_path):
+    bucket = make_bucket(tmp_path / 'bucket', {'src/a.gz': 'aaaa'})
+    cache = archive_cache.ArchiveCache(str(tmp_path / 'cache'))
+    assert not cache.fetch(bucket, 'src/a.gz', str(tmp_path / 'first'))
+    assert cache.fetch(bucket, 'src/a.gz', str(tmp_path / 'second'))
+    assert (tmp_path / 'second').read_text() == 'aaaa'
+    assert cache.totals()['hits'] == 1 and cache.totals()['bytes_saved'] == 4
+
+
+def test_overwritten_object_is_downloaded_again(tmp_path):
+    bucket = make_bucket(tmp_path / 'bucket', {'a.gz': 'old'})
+    cache = archive_cache.ArchiveCache(str(tmp_path / 'cache'))
+    cache.fetch(bucket, 'a.gz', str(tmp_path / 'first'))
+    time.sleep(0.01)
+    bucket.blob('a.gz').upload_from_string('new')
+    assert not cache.fetch(bucket, 'a.gz', str(tmp_path / 'second'))
+    assert (tmp_path / 'second').read_text() == 'new'
+    # the first copy is a link to the old entry and stays as it was
+    assert (tmp_path / 'first').read_text() == 'old'
+
+
+def test_least_recently_used_is_evicted(tmp_path, monkeypatch):
+    bucket = make_bucket(tmp_path / 'bucket', {name: 'x' * 100 for name in ('a', 'b', 'c')})
+    cache = archive_cache.ArchiveCache(str(tmp_path / 'cache'), max_bytes=250)
+    clock = [0.0]
+    monkeypatch.setattr(archive_cache, 'time', types.SimpleNamespace(time=lambda: clock[0]))
+    for name in ('a', 'b'):
+        clock[0] += 10 * archive_cache.TOUCH_INTERVAL
+        cache.fetch(bucket, name, str(tmp_path / name))
+    clock[0] += 10 * archive_cache.TOUCH_INTERVAL
+    assert cache.fetch(bucket, 'a', str(tmp_path / 'a'))
+    clock[0] += 10 * archive_cache.TOUCH_INTERVAL
+    cache.fetch(bucket, 'c', str(tmp_path / 'c'))
+    assert cache.total_bytes() == 200
+    assert cache.fetch(bucket, 'a', str(tmp_path / 'a'))
+    assert not cache.fetch(bucket, 'b', str(tmp_path / 'b'))
+    # evicted entries stay readable through the links handed out before
+    assert (tmp_path / 'c').read_text() == 'x' * 100
+
+
+def _fetch(args):
+    bucket_root, cache_root, destination = args
+    return archive_cache.ArchiveCache(cache_root).fetch(storage_backend.LocalBucket(bucket_root), 'a.gz', destination)
+
+
+def test_workers_download_a_shared_archive_once(tmp_path):
+    make_bucket(tmp_path / 'bucket', {'a.gz': 'a' * 1000})
+    cache_root = str(tmp_path / 'cache')
+    jobs = [(str(tmp_path / 'bucket'), cache_root, str(tmp_path / f'out{i}')) for i in range(8)]
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        hits = list(pool.map(_fetch, jobs))
+    assert hits.count(False) == 1
+    totals = archive_cache.ArchiveCache(cache_root).totals()
+    assert (totals['misses'], totals['hits'], totals['bytes_downloaded']) == (1, 7, 1000)
+    assert all(os.path.getsize(job[2]) == 1000 for job in jobs)
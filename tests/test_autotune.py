@@ -0,0 +1,38 @@
+import autotune
+
+
+def test_cpu_pool_grows_while_tasks_wait():
+    controller = autotune.Controller('workers', 1, 64, kind='cpu', interval=0, cores=4)
+    for _ in range(20):
+        controller.observe(10.0, 2.5)
+    for _ in range(10):
+        controller.update(backlog=100, running=controller.target)
+    assert controller.target == 16
+
+
+def test_io_pool_stops_growing_at_the_io_share():
+    controller = autotune.Controller('upload', 1, 64, kind='io', interval=0, cores=2)
+    for _ in range(20):
+        controller.observe(1.0, 0.5, {'upload': 0.5})
+    for _ in range(20):
+        controller.update(backlog=100, running=controller.target)
+    # half of each batch is CPU, so two cores keep four batches going
+    assert controller.target == 4
+
+
+def test_io_pool_grows_further_when_batches_only_wait():
+    controller = autotune.Controller('upload', 1, 64, kind='io', interval=0, cores=2)
+    for _ in range(20):
+        controller.observe(1.0, 0.01, {'upload': 0.99})
+    for _ in range(20):
+        controller.update(backlog=100, running=controller.target)
+    assert controller.target == 40
+
+
+def test_io_pool_shrinks_without_backlog():
+    controller = autotune.Controller('upload', 1, 8, initial=8, kind='io', interval=0)
+    for _ in range(10):
+        controller.update(backlog=0, running=0)
+    assert controller.target == 1
+    assert controller.settings()['changes']
+
@@ -0,0 +1,95 @@
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import caption_index
+
+
+def write_output(output_dir, paper_id, captions):
+    record = {
+        'texts': ['Intro'] + [None] * len(captions),
+        'images': [None] + [f'{paper_id}_{i}.png' for i in range(len(captions))],
+        'captions': captions,
+    }
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with open(output_dir / f'{paper_id}.json', 'w') as f:
+        json.dump(record, f)
+
+
+def test_postings_round_trip():
+    doc_ids = [0, 1, 5, 127, 128, 300, 70000, 2 ** 40]
+    assert caption_index.decode_postings(caption_index.encode_postings(doc_ids)).tolist() == doc_ids
+    assert len(caption_index.decode_postings(b'')) == 0
+
+
+def test_tokenize_drops_tex_commands():
+    assert caption_index.tokenize(r'\textbf{Loss} curves of the \emph{ResNet}') == \
+        ['loss', 'curves', 'of', 'the', 'resnet']
+
+
+def test_update_and_query(tmp_path):
+    output_dir, index_dir = tmp_path / 'out', str(tmp_path / 'index')
+    write_output(output_dir, '2301_00001', ['Training loss curves', 'Validation accuracy'])
+    write_output(output_dir, '2301_00002', ['Loss landscape of a ResNet'])
+    assert caption_index.update(index_dir, str(output_dir)) == 3
+    # nothing changed, nothing to index
+    assert caption_index.update(index_dir, str(output_dir)) == 0
+    index = caption_index.CaptionIndex(index_dir)
+    assert index.count('loss') == 2
+    assert [doc['ref'] for doc in index.search('resnet loss')] == ['2301_00002_0.png']
+    assert index.search('missing') == []
+
+
+def test_changed_files_replace_their_old_figures(tmp_path):
+    output_dir, index_dir = tmp_path / 'out', str(tmp_path / 'index')
+    write_output(output_dir, '2301_00001', ['Training loss curves'])
+    caption_index.update(index_dir, str(output_dir))
+    write_output(output_dir, '2301_00001', ['Training accuracy curves', 'Another figure'])
+    assert caption_index.update(index_dir, str(output_dir)) == 2
+    index = caption_index.CaptionIndex(index_dir)
+    assert index.count('loss') == 0
+    assert index.count('curves') == 1
+
+    assert caption_index.compact(index_dir) == 2
+    compacted = caption_index.CaptionIndex(index_dir)
+    assert len(compacted.segments) == 1
+    assert [doc['caption'] for doc in compacted.search('curves')] == ['Training accuracy curves']
+    # compacting keeps track of what was indexed
+    assert caption_index.update(index_dir, str(output_dir)) == 0
+
+
+def _update(args):
+    return caption_index.update(*args)
+
+
+def test_concurrent_updates_keep_every_segment(tmp_path):
+    index_dir = str(tmp_path / 'index')
+    outputs = []
+    for worker in range(6):
+        output_dir = tmp_path / f'out{worker}'
+        for paper in range(10):
+            write_output(output_dir, f'23{worker:02d}_{paper:05d}', ['Loss curves', 'A table'])
+        outputs.append((index_dir, str(output_dir)))
+    with ProcessPoolExecutor(max_workers=6) as pool:
+        assert sum(pool.map(_update, outputs)) == 120
+    assert caption_index.CaptionIndex(index_dir).count('loss') == 60
+
+
+def test_indexer_waits_for_the_interval(tmp_path, monkeypatch):
+    output_dir = tmp_path / 'out'
+    indexer = caption_index.Indexer(str(tmp_path / 'index'), str(output_dir))
+    write_output(output_dir, '2301_00001', ['One'])
+    assert indexer.update() == 1
+    write_output(output_dir, '2301_00002', ['Two'])
+    assert indexer.update() == 0
+    assert indexer.update(force=True) == 1
+    monkeypatch.setattr(caption_index, 'UPDATE_INTERVAL', 0.0)
+    write_output(output_dir, '2301_00003', ['Three'])
+    assert indexer.update() == 1
+    assert indexer.docs == 3
+
+
+def test_decode_is_vectorized_over_large_lists():
+    doc_ids = np.unique(np.random.default_rng(0).integers(0, 10 ** 7, 10000))
+    assert np.array_equal(caption_index.decode_postings(caption_index.encode_postings(doc_ids.tolist())), doc_ids)
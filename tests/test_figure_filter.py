@@ -0,0 +1,73 @@
+import shutil
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image, ImageDraw
+
+import figure_filter
+from engine import pipeline, render
+
+needs_poppler = pytest.mark.skipif(shutil.which('pdftoppm') is None, reason='needs poppler-utils')
+
+
+def figure(blank):
+    image = Image.new('RGB', (400, 300), 'white')
+    if not blank:
+        draw = ImageDraw.Draw(image)
+        draw.line([(20, 280), (120, 150), (220, 200), (380, 20)], fill='black', width=4)
+        draw.rectangle([10, 10, 390, 290], outline='black', width=2)
+    return image
+
+
+def write(tmp_path, blank, extension):
+    path = str(tmp_path / f"{'blank' if blank else 'plot'}.{extension}")
+    figure(blank).save(path)
+    return path
+
+
+def filter_figures(paths):
+    paper = SimpleNamespace(engine=SimpleNamespace(figure_thresholds=figure_filter.DEFAULT_THRESHOLDS))
+    return pipeline.Paper.filter_figures(paper, paths)
+
+
+@pytest.mark.parametrize('extension', ['png', 'jpg'])
+def test_raster_figures(tmp_path, extension):
+    reasons = filter_figures([write(tmp_path, True, extension), write(tmp_path, False, extension)])
+    assert reasons[0] in ('blank', 'mostly_white')
+    assert reasons[1] is None
+
+
+def test_postscript_figures(tmp_path, fake_gs):
+    blank, plot = tmp_path / 'blank.eps', tmp_path / 'plot.eps'
+    blank.write_text("%!PS-Adobe-3.0 EPSF-3.0\n%%BoundingBox: 0 0 200 150\n%%EOF\n")
+    plot.write_text("%!PS-Adobe-3.0 EPSF-3.0\n%%BoundingBox: 0 0 200 150\nINK\n%%EOF\n")
+    reasons = filter_figures([str(blank), str(plot)])
+    assert reasons[0] in ('blank', 'mostly_white')
+    assert reasons[1] is None
+
+
+@needs_poppler
+def test_pdf_figures(tmp_path):
+    reasons = filter_figures([write(tmp_path, True, 'pdf'), write(tmp_path, False, 'pdf')])
+    assert reasons[0] in ('blank', 'mostly_white')
+    assert reasons[1] is None
+
+
+def test_pdf_previews_are_checked_at_their_full_size(tmp_path, monkeypatch):
+    # without poppler: the preview stands in for the rendered page, its size for the page's
+    previews = {'blank.pdf': figure(True).resize((128, 96)), 'plot.pdf': figure(False).resize((128, 96)),
+                'icon.pdf': figure(False).resize((128, 96))}
+    sizes = {'blank.pdf': (400, 300), 'plot.pdf': (400, 300), 'icon.pdf': (8, 6)}
+    monkeypatch.setattr(render, 'pdf_page_size', lambda path: (1, *sizes[path.rsplit('/', 1)[-1]]))
+    monkeypatch.setattr(render, 'raster_dpi', lambda width, height: 72)
+    monkeypatch.setattr(render, 'convert_from_path', lambda path, **options: [previews[path.rsplit('/', 1)[-1]]])
+    reasons = filter_figures([str(tmp_path / name) for name in ('blank.pdf', 'plot.pdf', 'icon.pdf')])
+    assert reasons[0] in ('blank', 'mostly_white')
+    assert reasons[1] is None
+    assert reasons[2] == 'tiny'
+
+
+def test_unreadable_figures_are_kept(tmp_path):
+    broken = tmp_path / 'broken.pdf'
+    broken.write_bytes(b'not a pdf')
+    assert filter_figures([str(broken)]) == [None]
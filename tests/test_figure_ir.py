@@ -0,0 +1,43 @@
+import json
+
+import pandas as pd
+
+import figure_ir
+from engine import records
+
+ITEMS = [
+    ('section', 'Introduction', None, None, None, 0),
+    ('text', r'We \emph{show} $x^2$ results   in  figure~\ref{fig:a}.', None, None, None, 5),
+    ('figure', r'\textbf{Plot} of 3.5pt width=0.5 data.pdf', '0.png', 'data.pdf', 'fig:a', 40),
+    ('text', 'Température élevée   des résultats — voir ci-dessous.', None, None, None, 60),
+    ('figure', 'A blank figure', '1.png', 'blank.png', 'fig:b', 80),
+    ('text', 'Conclusion.', None, None, None, 90),
+]
+
+
+def test_clean_column_matches_clean_text_content():
+    texts = [item[1] for item in ITEMS if item[0] != 'section'] + [None]
+    cleaned = figure_ir.clean_column(pd.Series(texts), records.CLEAN_RULES)
+    assert list(cleaned[:-1]) == [records.clean_text_content(text) for text in texts[:-1]]
+    assert pd.isna(cleaned.iloc[-1])
+
+
+def test_rebuild_gives_the_record_the_pipeline_wrote(tmp_path):
+    parsed = [('main.tex', ITEMS, [])]
+    rendered = [('main.tiff', {'1.png'})]
+    figure_ir.write_ir(str(tmp_path / 'ir'), '2301_00001', parsed, rendered)
+    frame = figure_ir.read_ir([figure_ir.ir_path(str(tmp_path / 'ir'), '2301_00001')])
+    assert list(frame.columns) == figure_ir.COLUMNS
+    assert list(frame['rejected']) == [False, False, False, False, True, False]
+
+    assert figure_ir.rebuild(str(tmp_path / 'ir'), str(tmp_path / 'out')) == 1
+    with open(tmp_path / 'out' / '2301_00001.json') as f:
+        rebuilt = json.load(f)
+    expected = records.drop_figures(records.build_record(ITEMS), {'1.png'})
+    expected['images'] = [f'2301_00001_{image}' if image else None for image in expected['images']]
+    assert rebuilt == expected
+
+
+def test_papers_without_a_tiff_are_not_rebuilt(tmp_path):
+    figure_ir.write_ir(str(tmp_path / 'ir'), '2301_00002', [('main.tex', ITEMS, [])], [(None, set())])
+    assert figure_ir.rebuild(str(tmp_path / 'ir'), str(tmp_path / 'out')) == 0
@@ -0,0 +1,73 @@
+import os
+import time
+import multiprocessing
+
+import pytest
+
+import memory_budget
+
+
+@pytest.fixture
+def budget(tmp_path, monkeypatch):
+    # configure() sets the variable for the workers, this puts it back afterwards
+    monkeypatch.setenv(memory_budget.BUDGET_ENV, '')
+    memory_budget.configure(100, str(tmp_path / 'test.budget'))
+    return memory_budget
+
+
+def _hold(nbytes, seconds, started):
+    with memory_budget.reserve(nbytes, 'test'):
+        started.set()
+        time.sleep(seconds)
+
+
+def _die_holding(nbytes, started):
+    with memory_budget.reserve(nbytes, 'test'):
+        started.set()
+        os._exit(0)
+
+
+def test_without_a_budget_nothing_is_reserved(monkeypatch):
+    monkeypatch.delenv(memory_budget.BUDGET_ENV, raising=False)
+    with memory_budget.reserve(10 ** 12, 'test'):
+        assert memory_budget.usage() is None
+    assert memory_budget.format_usage() == ''
+
+
+def test_reservations_are_released(budget):
+    with budget.reserve(40, 'test'):
+        with budget.reserve(30, 'test'):
+            assert budget.usage() == (70, 70, 100)
+    assert budget.usage() == (0, 70, 100)
+
+
+def test_oversized_reservation_runs_alone(budget):
+    with budget.reserve(500, 'test'):
+        assert budget.usage()[0] == 500
+
+
+def test_waits_for_another_process(budget):
+    context = multiprocessing.get_context('fork')
+    started = context.Event()
+    worker = context.Process(target=_hold, args=(80, 0.3, started))
+    worker.start()
+    started.wait(5)
+    start = time.perf_counter()
+    with budget.reserve(50, 'test'):
+        waited = time.perf_counter() - start
+    worker.join()
+    assert waited > 0.1
+    assert budget.usage()[1] <= 100
+
+
+def test_budget_of_a_dead_process_is_reclaimed(budget):
+    context = multiprocessing.get_context('fork')
+    started = context.Event()
+    worker = context.Process(target=_die_holding, args=(80, started))
+    worker.start()
+    started.wait(5)
+    worker.join()
+    start = time.perf_counter()
+    with budget.reserve(50, 'test'):
+        assert time.perf_counter() - start < 1
+    assert budget.usage()[0] == 0
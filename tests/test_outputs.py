@@ -0,0 +1,67 @@
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from engine import outputs
+
+
+class FakePaper:
+    def __init__(self, name, parsed=(), directory=None):
+        self.name = name
+        self.parsed = list(parsed)
+        self.directory = directory
+
+    def resolve(self, path):
+        return os.path.join(self.directory, path)
+
+    def filter_figures(self, paths):
+        return [None] * len(paths)
+
+
+class SlowOutput(outputs.Output):
+    """Writes one file per paper, slowly, so papers of several threads overlap."""
+
+    def write(self, paper):
+        path = self.path(f"{outputs.output_paper_id(paper.name)}.txt")
+        time.sleep(0.01)
+        with open(path, 'w') as f:
+            f.write(paper.name)
+        self.count_records(1)
+
+
+def test_emit_keeps_each_threads_paper_apart(tmp_path):
+    output = SlowOutput(str(tmp_path), partitioned=True)
+    names = [f"{yymm}.{i:05d}.gz" for yymm in ('2301', '2302', '2303') for i in range(10)]
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        list(executor.map(lambda name: output.emit(FakePaper(name)), names))
+    for name in names:
+        assert os.path.exists(os.path.join(str(tmp_path), name[:4], f"{name[:-3].replace('.', '_')}.txt"))
+    catalog = output.catalog.partitions()
+    assert {partition: entry['papers'] for partition, entry in catalog.items()} == {'2301': 10, '2302': 10, '2303': 10}
+    assert all(entry['records'] == 10 and entry['files'] == 10 for entry in catalog.values())
+
+
+def test_first_images_keeps_one_item_per_figure():
+    items = [('text', 'a', None, None, None, None),
+             ('figure', 'two panels', 'a.jpeg', 'a.png', None, 10),
+             ('figure', 'two panels', 'b.jpeg', 'b.png', None, 10),
+             ('figure', 'one panel', 'c.jpeg', 'c.png', None, 50)]
+    assert outputs.first_images(items) == {1, 3}
+
+
+def test_images_only_skips_figures_that_cannot_be_converted(tmp_path):
+    from PIL import Image
+    source = tmp_path / 'source'
+    source.mkdir()
+    Image.new('RGB', (40, 30), 'red').save(source / 'good.png')
+    (source / 'broken.png').write_bytes(b'not an image')
+    items = [('figure', 'a broken figure', None, 'broken.png', 'fig:a', 0),
+             ('figure', 'a good figure', None, 'good.png', 'fig:b', 10)]
+    output_dir = tmp_path / 'out'
+    output = outputs.ImagesOnlyJsonOutput(str(output_dir))
+    output.emit(FakePaper('2301.00001.gz', [('main.tex', items, [])], str(source)))
+    with open(output_dir / '2301_00001_imagesonly.json') as f:
+        dataset = json.load(f)
+    assert [record['caption'] for record in dataset] == ['a good figure']
+    assert os.path.exists(dataset[0]['image_filename'])
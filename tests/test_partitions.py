@@ -0,0 +1,68 @@
+import os
+import sqlite3
+
+import partitions
+import sharding
+
+
+def test_partition_of_new_and_old_style_names():
+    assert partitions.partition('arXiv-2301.01234.tar.gz') == '2301'
+    assert partitions.partition('2301_01234.gz') == '2301'
+    assert partitions.partition('hep-th9901001.gz') == 'hep-th/9901'
+    assert partitions.partition('notes.tar.gz') == partitions.UNKNOWN
+
+
+def test_paper_id_is_the_same_for_archive_and_output_names():
+    assert partitions.paper_id('arXiv-2301.01234.tar.gz') == partitions.paper_id('2301_01234_main.json') == '2301_01234'
+
+
+def test_parse_partitions_ranges_and_single_months():
+    wanted = partitions.parse_partitions('2301,2303-2305,hep-th/9901')
+    assert partitions.matches('2301', wanted)
+    assert partitions.matches('2304', wanted)
+    assert partitions.matches('math/2301', wanted)
+    assert not partitions.matches('2302', wanted)
+    assert partitions.matches('hep-th/9901', wanted)
+    assert not partitions.matches('hep-th/9902', wanted)
+
+
+def test_two_shards_writing_to_one_root_add_up(tmp_path):
+    root = str(tmp_path)
+    names = [f"arXiv-{yymm}.{i:05d}.tar.gz" for yymm in ('2301', '2302') for i in range(12)]
+    for index in range(2):
+        shard = (index, 2)
+        catalog = partitions.Catalog(root, shard)
+        for name in sharding.select_shard(names, shard):
+            catalog.add(partitions.paper_id(name), partitions.partition(name), 3, 100, 2)
+        catalog.export()
+        catalog.close()
+
+    merged = partitions.load_catalog(root)
+    assert {name: entry['papers'] for name, entry in merged.items()} == {'2301': 12, '2302': 12}
+    assert merged['2301']['records'] == 36
+    assert merged['2301']['min_paper_id'] == '2301_00000'
+    assert merged['2301']['max_paper_id'] == '2301_00011'
+    assert sorted(os.listdir(os.path.join(root, partitions.CATALOG_DIR))) == [
+        'catalog.db', 'shard-00000-of-00002.json', 'shard-00001-of-00002.json']
+
+
+def test_paper_rewritten_by_another_shard_moves(tmp_path):
+    root = str(tmp_path)
+    first, second = partitions.Catalog(root, (0, 2)), partitions.Catalog(root, (1, 2))
+    first.add('2301_00001', '2301', 1, 10, 1)
+    second.add('2301_00001', '2301', 1, 10, 1)
+    assert first.partitions() == {}
+    assert second.partitions()['2301']['papers'] == 1
+
+
+def test_catalog_without_shard_column_is_upgraded(tmp_path):
+    os.makedirs(tmp_path / partitions.CATALOG_DIR)
+    conn = sqlite3.connect(str(tmp_path / partitions.CATALOG_DIR / 'catalog.db'))
+    conn.execute('CREATE TABLE papers (paper_id TEXT PRIMARY KEY, partition TEXT NOT NULL, records INTEGER NOT NULL, '
+                 'bytes INTEGER NOT NULL, files INTEGER NOT NULL)')
+    conn.execute("INSERT INTO papers VALUES ('2301_00001', '2301', 1, 10, 1)")
+    conn.commit()
+    conn.close()
+    catalog = partitions.Catalog(str(tmp_path))
+    catalog.add('2301_00002', '2301', 1, 10, 1)
+    assert catalog.partitions()['2301']['papers'] == 2
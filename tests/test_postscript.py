@@ -0,0 +1,59 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from engine import postscript
+
+
+def eps(directory, name, width, height, body='0 0 moveto'):
+    path = os.path.join(directory, name)
+    with open(path, 'w') as f:
+        f.write(f"%!PS-Adobe-3.0 EPSF-3.0\n%%BoundingBox: 0 0 {width} {height}\n{body}\n%%EOF\n")
+    return path
+
+
+def test_bounding_box_prefers_hires(tmp_path):
+    path = tmp_path / 'f.eps'
+    path.write_text("%!PS-Adobe-3.0 EPSF-3.0\n%%BoundingBox: 0 0 10 20\n%%HiResBoundingBox: 0 0 10.5 20.5\n")
+    assert postscript.bounding_box(str(path)) == (0, 0, 10.5, 20.5)
+
+
+def test_bounding_box_atend(tmp_path):
+    path = tmp_path / 'f.eps'
+    path.write_text("%!PS-Adobe-3.0 EPSF-3.0\n%%BoundingBox: (atend)\nshowpage\n%%Trailer\n%%BoundingBox: 1 2 30 40\n")
+    assert postscript.bounding_box(str(path)) == (1, 2, 30, 40)
+
+
+def test_rasterize_reports_failures_as_none(fake_gs, tmp_path):
+    good = eps(str(tmp_path), 'good.eps', 30, 20)
+    bad = eps(str(tmp_path), 'bad.eps', 30, 20, body='ERROR')
+    images = postscript.rasterize([good, bad], lambda width, height: 72)
+    assert images[0].size == (30, 20)
+    assert images[1] is None
+
+
+def test_threads_do_not_share_a_converter(fake_gs, tmp_path):
+    # every figure has its own width, a mixed-up reply would give another figure's size
+    paths = [eps(str(tmp_path), f'{i}.eps', 10 + i, 20) for i in range(32)]
+    used = set()
+
+    def render(path):
+        image = postscript.rasterize([path], lambda width, height: 72)[0]
+        used.add((threading.get_ident(), id(postscript._get_converter())))
+        return image.size
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        sizes = list(executor.map(render, paths))
+    assert sizes == [(10 + i, 20) for i in range(32)]
+    # one converter per thread
+    assert len({converter for _, converter in used}) == len({thread for thread, _ in used})
+
+
+def test_cpu_of_the_live_converter_is_counted(fake_gs, tmp_path):
+    postscript.rasterize([eps(str(tmp_path), 'f.eps', 30, 20)], lambda width, height: 72)
+    converter = postscript._local.converter
+    # the fake converter spent CPU on starting Python, and it has not been reaped
+    assert postscript.cpu_seconds() > 0
+    assert postscript.cpu_seconds() == postscript._process_cpu(converter.process.pid)
+    postscript.close()
+    assert postscript.cpu_seconds() == 0
@@ -0,0 +1,49 @@
+import types
+
+import result_cache
+
+VERSIONS = {'extractor': 2, 'cleaner': 5, 'renderer': 1}
+
+
+def test_fingerprint_covers_only_the_named_components():
+    assert result_cache.fingerprint(VERSIONS, ('cleaner', 'extractor')) == 'cleaner=5,extractor=2'
+    assert result_cache.fingerprint({**VERSIONS, 'renderer': 9}, ('extractor',)) == \
+        result_cache.fingerprint(VERSIONS, ('extractor',))
+
+
+def test_file_digest_depends_on_content_only(tmp_path):
+    (tmp_path / 'a').write_bytes(b'same')
+    (tmp_path / 'b').write_bytes(b'same')
+    (tmp_path / 'c').write_bytes(b'other')
+    assert result_cache.file_digest(str(tmp_path / 'a')) == result_cache.file_digest(str(tmp_path / 'b'))
+    assert result_cache.file_digest(str(tmp_path / 'a')) != result_cache.file_digest(str(tmp_path / 'c'))
+
+
+def test_hit_miss_and_stale(tmp_path):
+    cache = result_cache.ResultCache(str(tmp_path))
+    cache.put('k' * 64, 'parse', 'extractor=2', {'items': [1, 2]})
+    assert cache.get('k' * 64, 'parse', 'extractor=2') == {'items': [1, 2]}
+    assert cache.get('k' * 64, 'parse', 'extractor=3') is None
+    assert cache.get('k' * 64, 'clean', 'cleaner=5') is None
+    assert cache.stats == {'hits': 1, 'misses': 1, 'stale': 1, 'stored': 1, 'evicted': 0}
+    cache.close()
+    # the cache outlives the process that filled it
+    reopened = result_cache.ResultCache(str(tmp_path))
+    assert reopened.get('k' * 64, 'parse', 'extractor=2') == {'items': [1, 2]}
+
+
+def test_least_recently_used_is_evicted_first(tmp_path, monkeypatch):
+    clock = types.SimpleNamespace(now=0.0)
+    monkeypatch.setattr(result_cache, 'time', types.SimpleNamespace(time=lambda: clock.now))
+    cache = result_cache.ResultCache(str(tmp_path), max_bytes=10 ** 9)
+    for i, key in enumerate(['aa', 'bb', 'cc']):
+        clock.now = i * 10 * result_cache.TOUCH_INTERVAL
+        cache.put(key, 'parse', 'fp', b'x' * 1000)
+    # reading 'aa' makes it the most recently used
+    clock.now = 100 * result_cache.TOUCH_INTERVAL
+    assert cache.get('aa', 'parse', 'fp') is not None
+    cache.evict(cache.total_bytes() - 1)
+    assert cache.get('bb', 'parse', 'fp') is None
+    assert cache.get('aa', 'parse', 'fp') is not None
+    assert cache.get('cc', 'parse', 'fp') is not None
+    assert cache.stats['evicted'] == 1
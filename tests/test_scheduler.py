@@ -0,0 +1,91 @@
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import autotune
+import scheduler
+
+
+def test_small_corpus_is_spread_over_all_workers():
+    items = [f'arXiv-2301.{i:05d}.tar.gz' for i in range(12)]
+    sizes = [200 * 1024] * len(items)
+    chunks = scheduler.plan_chunks(items, sizes, num_workers=4)
+    assert len(chunks) >= 4
+    assert sorted(item for _, chunk in chunks for item in chunk) == items
+
+
+def test_chunks_per_worker_on_a_larger_corpus():
+    items = list(range(1000))
+    sizes = [10 * 1024] * len(items)
+    chunks = scheduler.plan_chunks(items, sizes, num_workers=8)
+    assert len(chunks) >= scheduler.CHUNKS_PER_WORKER * 8
+    assert all(len(chunk) <= scheduler.MAX_CHUNK_ITEMS for _, chunk in chunks)
+
+
+def test_without_workers_limits_are_unchanged():
+    items = list(range(12))
+    chunks = scheduler.plan_chunks(items, [1024] * len(items))
+    assert len(chunks) == 1
+
+
+def test_predicted_makespan_beats_fixed_order_on_small_corpus():
+    sizes = [3 * 1024 * 1024] + [100 * 1024] * 11
+    chunks = scheduler.plan_chunks(list(range(12)), sizes, num_workers=4)
+    costs = [cost for cost, _ in chunks]
+    assert scheduler.predict_makespan(costs, 4) < sum(costs)
+
+
+def test_cpu_seconds_include_the_live_converter(monkeypatch):
+    monkeypatch.setattr(scheduler.postscript, 'cpu_seconds', lambda: 0.0)
+    without = scheduler._cpu_seconds()
+    monkeypatch.setattr(scheduler.postscript, 'cpu_seconds', lambda: 100.0)
+    assert scheduler._cpu_seconds() - without >= 100.0
+
+
+def test_chunks_are_ordered_largest_first():
+    sizes = [10, 50 * 1024 * 1024, 20 * 1024 * 1024, 10]
+    chunks = scheduler.plan_chunks(['a', 'b', 'c', 'd'], sizes)
+    assert [chunk for _, chunk in chunks] == [['b'], ['c'], ['a', 'd']]
+    assert [cost for cost, _ in chunks] == sorted((cost for cost, _ in chunks), reverse=True)
+
+
+def square(item):
+    return item * item
+
+
+def test_every_item_is_run_once_on_processes_and_threads():
+    items = list(range(40))
+    sizes = [(i % 7) * 100 * 1024 for i in items]
+    with multiprocessing.get_context('fork').Pool(3) as pool:
+        results, report = scheduler.run_scheduled(pool, square, items, sizes, num_workers=3)
+    assert sorted(results) == sorted(square(i) for i in items)
+    assert report['items'] == 40 and report['predicted_makespan_bytes'] <= report['naive_makespan_bytes']
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        results, _ = scheduler.run_scheduled(pool, len, items, sizes, num_workers=3, per_chunk=True)
+    assert sum(results) == 40
+
+
+def test_streamed_pages_and_controller_limit():
+    pages = [[(f'{page}-{i}', 1024) for i in range(10)] for page in range(3)]
+    controller = autotune.Controller('workers', 1, 2, initial=2, interval=3600)
+    in_flight, peak, done = [0], [0], []
+    lock = threading.Lock()
+
+    def work(item):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        time.sleep(0.002)
+        with lock:
+            in_flight[0] -= 1
+        return item
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results, report = scheduler.run_streamed(pool, work, iter(pages), 8, on_chunk_done=done.extend,
+                                                 controller=controller)
+    assert sorted(results) == sorted(item for page in pages for item, _ in page)
+    assert sorted(done) == sorted(results)
+    assert peak[0] <= 2
+    assert report['workers'] == 2
+    assert controller.cpu_share is not None
@@ -0,0 +1,52 @@
+import argparse
+
+import pytest
+
+import sharding
+
+NAMES = [f'arXiv_src_2301_{i:03d}/2301.{i:05d}.tar.gz' for i in range(200)]
+
+
+def test_paper_id_from_name():
+    assert sharding.paper_id_from_name('src/2301.01234.tar.gz') == '2301_01234'
+    assert sharding.paper_id_from_name('2301.01234v2.gz') == '2301_01234'
+    assert sharding.paper_id_from_name('hep-th9901001.gz') == 'hep-th9901001'
+
+
+@pytest.mark.parametrize('value, expected', [('0/4', (0, 4)), (' 3 / 4 ', (3, 4)), ('0/1', (0, 1))])
+def test_parse_shard(value, expected):
+    assert sharding.parse_shard(value) == expected
+
+
+@pytest.mark.parametrize('value', ['4/4', '1/0', '1', 'a/b', ''])
+def test_parse_shard_rejects(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        sharding.parse_shard(value)
+
+
+def test_shards_cover_the_listing_exactly_once():
+    shards = [sharding.select_shard(NAMES, (i, 4)) for i in range(4)]
+    assert sorted(name for shard in shards for name in shard) == sorted(NAMES)
+    assert all(shards)
+    assert sharding.select_shard(NAMES, None) == NAMES
+
+
+def test_versions_of_a_paper_land_on_the_same_shard():
+    assert sharding.in_shard('a/2301.00001.tar.gz', (1, 3)) == sharding.in_shard('b/2301.00001.gz', (1, 3))
+
+
+def test_merge_reports_full_coverage(tmp_path):
+    for i in range(3):
+        sharding.write_shard_manifest(str(tmp_path), (i, 3), sharding.select_shard(NAMES, (i, 3)))
+    summary = sharding.merge_shards(str(tmp_path), 3, NAMES)
+    assert summary['ok']
+    assert summary['papers'] == len(NAMES)
+
+
+def test_merge_reports_missing_and_duplicated_work(tmp_path):
+    sharding.write_shard_manifest(str(tmp_path), (0, 3), NAMES[:150])
+    sharding.write_shard_manifest(str(tmp_path), (1, 3), sharding.select_shard(NAMES, (1, 3)))
+    summary = sharding.merge_shards(str(tmp_path), 3, NAMES)
+    assert not summary['ok']
+    assert summary['missing_shards'] == [2]
+    assert summary['duplicates'] and summary['misplaced'] and summary['uncovered']
@@ -0,0 +1,67 @@
+import os
+import sys
+import glob
+import subprocess
+import multiprocessing
+
+import shm_transport
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def segments(transport):
+    return glob.glob(f"/dev/shm/{transport.prefix}-*")
+
+
+def read(transport, handle, results):
+    results.put(transport.get(handle))
+
+
+def test_small_payloads_are_inline():
+    transport = shm_transport.Transport(inline_bytes=1024)
+    handle = transport.put(b'x' * 10)
+    assert handle.name is None
+    assert transport.get(handle) == b'x' * 10
+
+
+def test_last_reader_unlinks():
+    with shm_transport.Transport(inline_bytes=0, prefix=f"test-{os.getpid()}") as transport:
+        handle = transport.put(b'figure' * 1000, readers=2)
+        assert len(segments(transport)) == 1
+        with transport.view(handle) as view:
+            assert bytes(view[:6]) == b'figure'
+        assert len(segments(transport)) == 1
+        assert transport.get(handle) == b'figure' * 1000
+        assert segments(transport) == []
+
+
+def test_payload_read_in_another_process():
+    with shm_transport.Transport(inline_bytes=0, prefix=f"test-{os.getpid()}") as transport:
+        payload = os.urandom(256 * 1024)
+        results = multiprocessing.Queue()
+        reader = multiprocessing.Process(target=read, args=(transport, transport.put(payload), results))
+        reader.start()
+        assert results.get(timeout=30) == payload
+        reader.join()
+        assert segments(transport) == []
+
+
+def test_no_resource_tracker_warnings():
+    # segments unlinked by a reader must not be left registered with the writer's tracker
+    script = (
+        "import multiprocessing, shm_transport\n"
+        "def read(t, q):\n"
+        "    for _ in range(20):\n"
+        "        t.get(q.get())\n"
+        "if __name__ == '__main__':\n"
+        "    t = shm_transport.Transport(inline_bytes=0)\n"
+        "    q = multiprocessing.Queue()\n"
+        "    p = multiprocessing.Process(target=read, args=(t, q))\n"
+        "    p.start()\n"
+        "    for _ in range(20):\n"
+        "        q.put(t.put(b'x' * 4096))\n"
+        "    p.join()\n"
+    )
+    result = subprocess.run([sys.executable, '-c', script], cwd=REPO_ROOT, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0
+    assert 'resource_tracker' not in result.stderr
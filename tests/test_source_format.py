@@ -0,0 +1,71 @@
+import io
+import gzip
+import tarfile
+
+import pytest
+
+import source_format
+
+TEX = b'\\documentclass{article}\n\\begin{document}\nHello\n\\end{document}\n'
+
+
+def make_tar(path, compress, tar_format=tarfile.USTAR_FORMAT):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w', format=tar_format) as tar:
+        info = tarfile.TarInfo('main.tex')
+        info.size = len(TEX)
+        tar.addfile(info, io.BytesIO(TEX))
+    data = buffer.getvalue()
+    if tar_format == tarfile.GNU_FORMAT:
+        # strip the magic, as old v7 tars have none, and fix up the header checksum
+        header = bytearray(data[:512])
+        header[257:265] = b'\0' * 8
+        header[148:156] = b' ' * 8
+        header[148:156] = b'%06o\0 ' % sum(header)
+        data = bytes(header) + data[512:]
+    path.write_bytes(gzip.compress(data) if compress else data)
+    return str(path)
+
+
+@pytest.mark.parametrize('compress, kind', [(True, source_format.TAR_GZ), (False, source_format.TAR)])
+def test_tar_sources(tmp_path, compress, kind):
+    path = make_tar(tmp_path / '2301.00001', compress)
+    assert source_format.sniff(path) == kind
+    assert source_format.extract_source(path, str(tmp_path / 'out')) == kind
+    assert (tmp_path / 'out' / 'main.tex').read_bytes() == TEX
+
+
+def test_tar_without_ustar_magic(tmp_path):
+    path = make_tar(tmp_path / '9901001', True, tarfile.GNU_FORMAT)
+    assert source_format.sniff(path) == source_format.TAR_GZ
+
+
+def test_single_gzip_file_is_streamed_to_tex(tmp_path):
+    path = tmp_path / '2301.00002.gz'
+    path.write_bytes(gzip.compress(TEX))
+    assert source_format.sniff(str(path)) == source_format.GZIP
+    assert source_format.extract_source(str(path), str(tmp_path / 'out')) == source_format.GZIP
+    assert (tmp_path / 'out' / '2301.00002.tex').read_bytes() == TEX
+
+
+def test_pdf_sources_are_not_unpacked(tmp_path):
+    plain, packed = tmp_path / 'a', tmp_path / 'b.gz'
+    plain.write_bytes(b'%PDF-1.5\n')
+    packed.write_bytes(gzip.compress(b'%PDF-1.5\n'))
+    assert source_format.sniff(str(plain)) == source_format.PDF
+    assert source_format.sniff(str(packed)) == source_format.PDF
+    assert source_format.extract_source(str(plain), str(tmp_path / 'out')) == source_format.PDF
+    assert not (tmp_path / 'out').exists()
+    assert source_format.unpacked_size(str(plain)) == 0
+
+
+def test_unknown_source(tmp_path):
+    path = tmp_path / 'notes.txt'
+    path.write_bytes(b'just text')
+    assert source_format.sniff(str(path)) == source_format.UNKNOWN
+
+
+def test_unpacked_size_reads_the_gzip_trailer(tmp_path):
+    path = tmp_path / 'a.gz'
+    path.write_bytes(gzip.compress(TEX * 100))
+    assert source_format.unpacked_size(str(path)) == len(TEX) * 100
@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+import storage_backend
+
+
+def make_bucket(root, names):
+    bucket = storage_backend.LocalBucket(str(root))
+    for name in names:
+        bucket.blob(name).upload_from_string(name)
+    return bucket
+
+
+def test_local_bucket_round_trip(tmp_path):
+    bucket = storage_backend.LocalBucket(str(tmp_path / 'bucket'))
+    blob = bucket.blob('a/b.txt')
+    blob.upload_from_string('hello')
+    assert bucket.get_blob('a/b.txt').download_as_bytes() == b'hello'
+    assert blob.size == 5
+    assert blob.md5_hash == 'XUFAKrxLKna5cZ2REBfFkg=='
+    assert bucket.get_blob('missing') is None
+    blob.delete()
+    assert not blob.exists()
+
+
+def test_full_listing_is_not_cut_off(tmp_path):
+    names = [f'{i % 10}/{i:04d}.gz' for i in range(1200)]
+    bucket = make_bucket(tmp_path / 'bucket', names)
+    assert sorted(info.name for info in storage_backend.iter_blobs(bucket, page_size=100)) == sorted(names)
+    split = storage_backend.iter_blobs_partitioned(bucket, [str(i) for i in range(10)], page_size=50, num_threads=4)
+    assert sorted(info.name for info in split) == sorted(names)
+
+
+def test_listing_cache_is_reused_and_keyed_on_the_request(tmp_path):
+    bucket = make_bucket(tmp_path / 'bucket', ['a/1.gz', 'b/2.gz'])
+    cache_dir = str(tmp_path / 'cache')
+    assert [info.name for info in storage_backend.iter_listing(bucket, cache_dir=cache_dir)] == ['a/1.gz', 'b/2.gz']
+    bucket.blob('a/3.gz').upload_from_string('new')
+    # a later run reads the cache, not the bucket
+    assert len(list(storage_backend.iter_listing(bucket, cache_dir=cache_dir))) == 2
+    assert len(list(storage_backend.iter_listing(bucket, cache_dir=cache_dir, refresh=True))) == 3
+    # another prefix is another listing
+    assert [info.name for info in storage_backend.iter_listing(bucket, 'a/', cache_dir=cache_dir)] == ['a/1.gz', 'a/3.gz']
+    # so is a bucket of the same name elsewhere
+    other = make_bucket(tmp_path / 'other' / 'bucket', ['c/4.gz'])
+    assert storage_backend.listing_cache_path(other, cache_dir=cache_dir) != \
+        storage_backend.listing_cache_path(bucket, cache_dir=cache_dir)
+
+
+def test_abandoned_listing_is_not_cached(tmp_path):
+    bucket = make_bucket(tmp_path / 'bucket', ['a/1.gz', 'b/2.gz'])
+    cache_dir = str(tmp_path / 'cache')
+    listing = storage_backend.iter_listing(bucket, cache_dir=cache_dir)
+    next(listing)
+    listing.close()
+    assert os.listdir(cache_dir) == []
+
+
+def test_check_location(tmp_path):
+    assert storage_backend.check_location(str(tmp_path)) == str(tmp_path)
+    assert storage_backend.check_location('gs://arxiv-dataset') == 'gs://arxiv-dataset'
+    with pytest.raises(ValueError):
+        storage_backend.check_location('./not/created/yet')
+
+
+def test_iter_pages():
+    assert list(storage_backend.iter_pages(range(5), 2)) == [[0, 1], [2, 3], [4]]
@@ -0,0 +1,51 @@
+import tex_macros
+
+
+def test_figure_macro_is_expanded_and_its_definition_dropped():
+    text = (r'\newcommand{\fig}[2]{\begin{figure}\includegraphics{#1}\caption{#2}\end{figure}}' '\n'
+            r'Text. \fig{plot.pdf}{Loss curves} More text.')
+    assert tex_macros.expand(text) == ('\n' r'Text. \begin{figure}\includegraphics{plot.pdf}'
+                                       r'\caption{Loss curves}\end{figure} More text.')
+
+
+def test_optional_argument_and_default():
+    text = (r'\newcommand{\img}[2][width=5cm]{\includegraphics[#1]{#2}}'
+            r'\img{a.png} \img[scale=0.5]{b.png}')
+    assert tex_macros.expand(text) == r'\includegraphics[width=5cm]{a.png} \includegraphics[scale=0.5]{b.png}'
+
+
+def test_def_and_nested_macros():
+    text = r'\def\figdir{figures/}\def\pic#1{\includegraphics{\figdir #1}}\pic{x.png}'
+    macros = tex_macros.macro_table(text)
+    assert set(macros) == {'pic'}
+    assert tex_macros.expand(text) == r'\def\figdir{figures/}\includegraphics{\figdir x.png}'
+
+
+def test_macros_unrelated_to_figures_are_left_alone():
+    text = r'\newcommand{\R}{\mathbb{R}} Let $x \in \R$.'
+    assert tex_macros.macro_table(text) == {}
+    assert tex_macros.expand(text) is text
+
+
+def test_providecommand_does_not_override():
+    macros = tex_macros.macro_table([r'\newcommand{\pic}[1]{\includegraphics{#1}}',
+                                     r'\providecommand{\pic}[1]{\includegraphics{other/#1}}'])
+    assert tex_macros.expand(r'\pic{a.png}', macros) == r'\includegraphics{a.png}'
+
+
+def test_recursive_macro_is_left_as_written():
+    text = r'\newcommand{\loop}{\loop\caption{x}}\loop \newcommand{\pic}[1]{\includegraphics{#1}}\pic{a.png}'
+    assert tex_macros.expand(text) == r'\loop \includegraphics{a.png}'
+
+
+def test_commented_definitions_are_ignored():
+    text = '%\\newcommand{\\pic}[1]{\\includegraphics{#1}}\n\\pic{a.png}'
+    assert tex_macros.expand(text) is text
+
+
+def test_macros_from_the_preamble_reach_input_files(tmp_path):
+    (tmp_path / 'main.tex').write_text(r'\newcommand{\pic}[1]{\includegraphics{#1}}\input{body}')
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'body.tex').write_text(r'\pic{a.png}')
+    macros = tex_macros.archive_macros(str(tmp_path))
+    assert tex_macros.expand(r'\pic{a.png}', macros) == r'\includegraphics{a.png}'
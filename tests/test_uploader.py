@@ -0,0 +1,63 @@
+import autotune
+import storage_backend
+import uploader
+
+
+def make_outputs(root, count=5, size=100):
+    for i in range(count):
+        path = root / f'2301/{i}.json'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(str(i) * size)
+    (root / '2301' / 'catalog.db').write_bytes(b'sqlite')
+    (root / 'scratch.tmp').write_text('partial')
+
+
+def run(local_root, bucket_root, **kwargs):
+    up = uploader.Uploader(str(bucket_root), str(local_root), **kwargs)
+    up.sync(force=True)
+    return up.close()
+
+
+def test_unchanged_files_are_skipped(tmp_path):
+    make_outputs(tmp_path / 'out')
+    (tmp_path / 'bucket').mkdir()
+    assert run(tmp_path / 'out', tmp_path / 'bucket', prefix='v1')['uploaded'] == 5
+    bucket = storage_backend.LocalBucket(str(tmp_path / 'bucket'))
+    assert sorted(info.name for info in storage_backend.iter_blobs(bucket)) == [f'v1/2301/{i}.json' for i in range(5)]
+
+    (tmp_path / 'out' / '2301' / '0.json').write_text('changed')
+    stats = run(tmp_path / 'out', tmp_path / 'bucket', prefix='v1')
+    assert (stats.get('uploaded'), stats.get('skipped')) == (1, 4)
+    assert bucket.get_blob('v1/2301/0.json').download_as_bytes() == b'changed'
+
+
+def test_packed_files_are_skipped_by_their_manifest(tmp_path):
+    make_outputs(tmp_path / 'out', count=10)
+    (tmp_path / 'bucket').mkdir()
+    assert run(tmp_path / 'out', tmp_path / 'bucket', pack=True)['uploaded'] == 10
+    bucket = storage_backend.LocalBucket(str(tmp_path / 'bucket'))
+    assert all(info.name.startswith(uploader.PACKED_PREFIX) for info in storage_backend.iter_blobs(bucket))
+    stats = run(tmp_path / 'out', tmp_path / 'bucket', pack=True)
+    assert (stats.get('uploaded', 0), stats.get('skipped')) == (0, 10)
+
+
+def test_sync_walks_at_most_once_per_interval(tmp_path):
+    make_outputs(tmp_path / 'out', count=2)
+    (tmp_path / 'bucket').mkdir()
+    up = uploader.Uploader(str(tmp_path / 'bucket'), str(tmp_path / 'out'))
+    assert up.sync() == 2
+    (tmp_path / 'out' / 'late.json').write_text('late')
+    assert up.sync() == 0
+    assert up.sync(force=True) == 1
+    assert up.sync(force=True) == 0
+    assert up.close()['uploaded'] == 3
+
+
+def test_autotuned_uploads_report_their_io_share(tmp_path):
+    make_outputs(tmp_path / 'out', count=20, size=300000)
+    (tmp_path / 'bucket').mkdir()
+    controller = autotune.Controller('upload', 1, 4, kind='io', interval=0)
+    stats = run(tmp_path / 'out', tmp_path / 'bucket', controller=controller)
+    assert stats['uploaded'] == 20
+    assert controller.cpu_share is not None and controller.io_share is not None
+    assert 0 <= controller.cpu_share + controller.io_share <= 1.01
@@ -0,0 +1,63 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import work_queue
+
+
+def test_largest_input_is_leased_first(tmp_path):
+    db_path = str(tmp_path / 'queue.db')
+    work_queue.seed_queue(db_path, ['small', 'large', 'medium'], [1, 100, 10])
+    conn = work_queue.connect(db_path)
+    assert [work_queue.lease(conn, 'w') for _ in range(4)] == ['large', 'medium', 'small', None]
+
+
+def test_seeding_again_keeps_state(tmp_path):
+    db_path = str(tmp_path / 'queue.db')
+    work_queue.seed_queue(db_path, ['a', 'b'])
+    conn = work_queue.connect(db_path)
+    work_queue.complete(conn, work_queue.lease(conn, 'w'), 'w')
+    work_queue.seed_queue(db_path, ['a', 'b', 'c'])
+    assert work_queue.queue_stats(db_path) == {'done': 1, 'pending': 2}
+
+
+def test_expired_lease_is_handed_out_again(tmp_path):
+    db_path = str(tmp_path / 'queue.db')
+    work_queue.seed_queue(db_path, ['a'])
+    conn = work_queue.connect(db_path)
+    assert work_queue.lease(conn, 'dead', visibility_timeout=-1) == 'a'
+    assert work_queue.lease(conn, 'alive') == 'a'
+    # the first owner lost it, its heartbeat and completion no longer count
+    assert not work_queue.heartbeat(conn, 'a', 'dead')
+    assert work_queue.heartbeat(conn, 'a', 'alive')
+
+
+def test_failures_are_retried_then_given_up(tmp_path):
+    db_path = str(tmp_path / 'queue.db')
+    work_queue.seed_queue(db_path, ['a'])
+    conn = work_queue.connect(db_path)
+    for _ in range(2):
+        work_queue.fail(conn, work_queue.lease(conn, 'w', max_attempts=2), 'w', 'boom', max_attempts=2)
+    assert work_queue.lease(conn, 'w') is None
+    assert work_queue.queue_stats(db_path) == {'failed': 1}
+    assert work_queue.requeue_failed(db_path) == 1
+    assert work_queue.lease(conn, 'w') == 'a'
+
+
+def test_workers_process_each_input_once(tmp_path):
+    db_path = str(tmp_path / 'queue.db')
+    names = [f'paper-{i}' for i in range(50)]
+    work_queue.seed_queue(db_path, names, list(range(50)))
+    seen = []
+    lock = threading.Lock()
+
+    def process(name):
+        if name == 'paper-7':
+            raise ValueError('broken archive')
+        with lock:
+            seen.append(name)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        processed = work_queue.run_queue_workers(pool, db_path, process, 4)
+    assert processed == 49
+    assert sorted(seen) == sorted(set(names) - {'paper-7'})
+    assert work_queue.queue_stats(db_path) == {'done': 49, 'failed': 1}
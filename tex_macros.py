@@ -0,0 +1,271 @@
+import os
+import re
+from collections import namedtuple
+import metrics
+
+# Author macros are only expanded when they (eventually) produce one of these;
+# everything else is left for TexSoup to see as written
+FIGURE_COMMANDS = {'includegraphics', 'caption', 'epsfig', 'epsfbox'}
+FIGURE_PATTERN = re.compile(r'\\(?:includegraphics|caption|epsfig|epsfbox)(?![A-Za-z@])|\\(?:begin|end)\s*\{figure\*?\}')
+
+# Cheap test for files that define nothing, the common case
+DEFINITION = re.compile(r'\\(?:(?:re|provide)?newcommand\*?|[gex]?def|let)(?![A-Za-z@])')
+CONTROL_SEQUENCE = re.compile(r'\\([A-Za-z@]+|.)', re.DOTALL)
+PARAMETER = re.compile(r'#(#|[1-9])')
+
+# Expansions nested deeper than this are taken to be recursive macros, and
+# the text is then left as written
+MAX_DEPTH = 20
+
+# nargs counts every argument including the optional one, whose default is
+# None for macros that take none
+Macro = namedtuple('Macro', ['nargs', 'default', 'body'])
+
+
+class _Runaway(Exception):
+    pass
+
+
+def _skip_space(text, i):
+    while i < len(text) and text[i] in ' \t\r\n':
+        i += 1
+    return i
+
+
+def _group(text, i, open='{', close='}'):
+    """(content, end) of the balanced group starting at text[i], or None."""
+    if i >= len(text) or text[i] != open:
+        return None
+    depth = 0
+    j = i
+    while j < len(text):
+        c = text[j]
+        if c == '\\':
+            j += 2
+            continue
+        if c == open:
+            depth += 1
+        elif c == close:
+            depth -= 1
+            if depth == 0:
+                return text[i + 1:j], j + 1
+        j += 1
+    return None
+
+
+def _control_sequence(text, i):
+    """(name, end) of the control sequence at text[i], or None."""
+    match = CONTROL_SEQUENCE.match(text, i)
+    if not match:
+        return None
+    return match.group(1), match.end()
+
+
+def _commented(text, i):
+    line = text[text.rfind('\n', 0, i) + 1:i]
+    return re.search(r'(?<!\\)%', line) is not None
+
+
+def _parse_newcommand(text, i):
+    i = _skip_space(text, i)
+    braced = _group(text, i)
+    if braced:
+        name = _control_sequence(braced[0].strip(), 0)
+        i = braced[1]
+    else:
+        name = _control_sequence(text, i)
+        i = name[1] if name else i
+    if not name:
+        return None
+    nargs, default = 0, None
+    i = _skip_space(text, i)
+    count = _group(text, i, '[', ']')
+    if count:
+        if not count[0].strip().isdigit():
+            return None
+        nargs = int(count[0])
+        i = _skip_space(text, count[1])
+        optional = _group(text, i, '[', ']')
+        if optional:
+            default = optional[0]
+            i = _skip_space(text, optional[1])
+    body = _group(text, i)
+    if not body:
+        return None
+    return name[0], Macro(nargs, default, body[0]), body[1]
+
+
+def _parse_def(text, i):
+    name = _control_sequence(text, _skip_space(text, i))
+    if not name:
+        return None
+    start = text.find('{', name[1])
+    if start == -1:
+        return None
+    # only undelimited parameters, #1#2...; delimited ones need a real TeX
+    parameters = re.sub(r'\s', '', text[name[1]:start])
+    if not re.fullmatch(r'(?:#[1-9])*', parameters):
+        return None
+    body = _group(text, start)
+    if not body:
+        return None
+    return name[0], Macro(len(parameters) // 2, None, body[0]), body[1]
+
+
+def _parse_let(text, i):
+    name = _control_sequence(text, _skip_space(text, i))
+    if not name:
+        return None
+    i = _skip_space(text, name[1])
+    if text.startswith('=', i):
+        i = _skip_space(text, i + 1)
+    target = _control_sequence(text, i)
+    if not target or not text.startswith('\\', i):
+        return None
+    return name[0], Macro(0, None, '\\' + target[0]), target[1]
+
+
+def _definitions(text):
+    """(name, Macro, start, end, is providecommand) of every macro definition text makes."""
+    for match in DEFINITION.finditer(text):
+        if _commented(text, match.start()):
+            continue
+        command = match.group()
+        if command == '\\let':
+            parsed = _parse_let(text, match.end())
+        elif command.endswith('def'):
+            parsed = _parse_def(text, match.end())
+        else:
+            parsed = _parse_newcommand(text, match.end())
+        if parsed:
+            name, macro, end = parsed
+            yield name, macro, match.start(), end, command.startswith('\\providecommand')
+
+
+def macro_table(texts):
+    """The macros defined in texts (a string or several) that end up in a figure, caption or includegraphics."""
+    if isinstance(texts, str):
+        texts = [texts]
+    table = {}
+    for text in texts:
+        if not DEFINITION.search(text):
+            continue
+        for name, macro, start, end, provide in _definitions(text):
+            # redefinitions of the figure commands themselves wrap the original
+            if name in FIGURE_COMMANDS or (provide and name in table):
+                continue
+            table[name] = macro
+
+    relevant = {name for name, macro in table.items() if FIGURE_PATTERN.search(macro.body)}
+    uses = {name: set(CONTROL_SEQUENCE.findall(macro.body)) for name, macro in table.items()}
+    changed = True
+    while changed:
+        changed = False
+        for name in table.keys() - relevant:
+            if uses[name] & relevant:
+                relevant.add(name)
+                changed = True
+    return {name: table[name] for name in relevant}
+
+
+def archive_macros(root):
+    """macro_table() of every .tex and .sty file under root, so macros from a preamble reach \\input files."""
+    texts = []
+    for directory, dirs, files in sorted(os.walk(root)):
+        for file in sorted(files):
+            if file.endswith(('.tex', '.sty')):
+                with open(os.path.join(directory, file), 'r', encoding='utf-8', errors='replace') as f:
+                    texts.append(f.read())
+    return macro_table(texts)
+
+
+def _use_pattern(macros):
+    names = sorted(macros, key=len, reverse=True)
+    return re.compile(r'\\(' + '|'.join(re.escape(name) for name in names) + r')(?![A-Za-z@])')
+
+
+def _arguments(text, i, macro):
+    """(arguments, end) for a use of macro whose name ends at text[i], or None if text ends first."""
+    args = []
+    if macro.default is not None:
+        optional = _group(text, _skip_space(text, i), '[', ']')
+        if optional:
+            args.append(optional[0])
+            i = optional[1]
+        else:
+            args.append(macro.default)
+    while len(args) < macro.nargs:
+        i = _skip_space(text, i)
+        if i >= len(text):
+            return None
+        braced = _group(text, i)
+        if braced:
+            args.append(braced[0])
+            i = braced[1]
+        elif text[i] == '\\':
+            token = _control_sequence(text, i)
+            args.append('\\' + token[0])
+            i = token[1]
+        else:
+            args.append(text[i])
+            i += 1
+    return args, i
+
+
+def _substitute(body, args):
+    return PARAMETER.sub(lambda m: '#' if m.group(1) == '#' else
+                         (args[int(m.group(1)) - 1] if int(m.group(1)) <= len(args) else ''), body)
+
+
+def _expand(text, macros, pattern, depth):
+    if depth > MAX_DEPTH:
+        raise _Runaway()
+    pieces = []
+    i = 0
+    for match in pattern.finditer(text):
+        if match.start() < i:
+            continue
+        macro = macros[match.group(1)]
+        parsed = _arguments(text, match.end(), macro)
+        if parsed is None:
+            continue
+        args, end = parsed
+        pieces.append(text[i:match.start()])
+        try:
+            pieces.append(_expand(_substitute(macro.body, args), macros, pattern, depth + 1))
+        except _Runaway:
+            if depth:
+                raise
+            # a recursive macro is left as written, the rest is still expanded
+            metrics.count('figure_macros_recursive')
+            pieces.append(text[match.start():end])
+        else:
+            if not depth:
+                metrics.count('figure_macros_expanded')
+        i = end
+    pieces.append(text[i:])
+    return ''.join(pieces)
+
+
+@metrics.timed('macros')
+def expand(text, macros=None):
+    """text with the uses of figure macros replaced by their bodies and their definitions removed.
+
+    macros defaults to the figure macros text defines itself. Text that uses
+    none of them is returned as is.
+    """
+    if macros is None:
+        macros = macro_table(text)
+    if not macros:
+        return text
+    pattern = _use_pattern(macros)
+    if not pattern.search(text):
+        return text
+    # drop the definitions so their bodies are not taken for real figures
+    kept, i = [], 0
+    for name, macro, start, end, provide in _definitions(text):
+        if name in macros and start >= i:
+            kept.append(text[i:start])
+            i = end
+    kept.append(text[i:])
+    return _expand(''.join(kept), macros, pattern, 0)
@@ -0,0 +1,278 @@
+import os
+import io
+import json
+import base64
+import hashlib
+import logging
+import time
+import tarfile
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import storage_backend
+
+try:
+    import google_crc32c
+except ImportError:
+    google_crc32c = None
+
+# Files below this size are uploaded several to a task (or packed together)
+SMALL_FILE_BYTES = 256 * 1024
+# How many small files go into one upload task or packed shard
+FILES_PER_BATCH = 64
+# Object prefix packed shards are written under
+PACKED_PREFIX = '_packed'
+
+# A full walk of the output tree for sync() runs at most this often, see sync()
+SYNC_INTERVAL = 30.0
+
+# Never ship scratch files, or local SQLite indexes such as the partition catalog's
+SKIP_SUFFIXES = ('.tmp', '.lock', '.db', '.db-wal', '.db-shm')
+SKIP_DIRS = ('.listing_cache',)
+
+
+def list_files(directory):
+    """Recursively list all files in a directory."""
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+        for file in files:
+            if not file.endswith(SKIP_SUFFIXES):
+                yield os.path.join(root, file)
+
+
+def file_checksums(path):
+    """Return (crc32c, md5) of a file, base64 encoded like GCS reports them. crc32c is None without google-crc32c."""
+    md5 = hashlib.md5()
+    crc = google_crc32c.Checksum() if google_crc32c else None
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            md5.update(block)
+            if crc is not None:
+                crc.update(block)
+    crc32c = base64.b64encode(crc.digest()).decode('ascii') if crc is not None else None
+    return crc32c, base64.b64encode(md5.digest()).decode('ascii')
+
+
+class Uploader:
+    """Ships files from a local directory to a bucket in the background.
+
+    Each upload thread keeps its own client and bucket handle. Files whose size
+    and checksum already match the remote object are skipped, small files are
+    grouped into batches (or packed into tar shards with pack=True), and sync()
+    can be called repeatedly while the processors are still writing, so
+    finished outputs leave the machine soon after they exist.
+    The destination is checked, and the client created, before any work
+    starts, so a wrong --upload_bucket fails right away.
+    """
+
+    def __init__(self, bucket_location, local_root, prefix='', num_threads=None,
+                 small_file_bytes=SMALL_FILE_BYTES, files_per_batch=FILES_PER_BATCH, pack=False, controller=None):
+        self.bucket_location = bucket_location
+        self.local_root = local_root
+        self.prefix = prefix
+        self.small_file_bytes = small_file_bytes
+        self.files_per_batch = files_per_batch
+        self.pack = pack
+        # with an autotune.Controller only its target number of batches is uploading at a time
+        self.controller = controller
+        self.executor = ThreadPoolExecutor(max_workers=controller.maximum if controller else num_threads or os.cpu_count())
+        self.futures = []
+        self.backlog = deque()
+        self.running = 0
+        # re-entrant, a batch that is already done runs its callback right away
+        self._dispatch_lock = threading.RLock()
+        self.stats = Counter()
+        self.remote = None
+        self.submitted = {}
+        self.last_sync = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        storage_backend.check_location(bucket_location)
+        self.bucket()
+
+    def bucket(self):
+        if not hasattr(self._local, 'bucket'):
+            client = None if storage_backend.is_local(self.bucket_location) else storage_backend.new_client()
+            self._local.bucket = storage_backend.open_bucket(self.bucket_location, client=client)
+        return self._local.bucket
+
+    def remote_name(self, path):
+        name = os.path.relpath(path, self.local_root).replace(os.sep, '/')
+        return f"{self.prefix.rstrip('/')}/{name}" if self.prefix else name
+
+    def packed_prefix(self):
+        return f"{self.prefix.rstrip('/') + '/' if self.prefix else ''}{PACKED_PREFIX}/"
+
+    def load_remote_index(self):
+        """One listing of the destination instead of a metadata request per file.
+
+        Files shipped inside packed shards count as present too, with the size
+        and MD5 their shard's manifest recorded.
+        """
+        if self.remote is None:
+            self.remote = {}
+            manifests = []
+            for blob in self.bucket().list_blobs(prefix=self.prefix or None):
+                self.remote[blob.name] = (blob.size, blob.crc32c, blob.md5_hash)
+                if blob.name.startswith(self.packed_prefix()) and blob.name.endswith('.json'):
+                    manifests.append(blob)
+            for blob in manifests:
+                for entry in json.loads(blob.download_as_bytes()):
+                    # shards written before manifests carried checksums only list names
+                    if isinstance(entry, list) and entry[0] not in self.remote:
+                        name, size, md5 = entry
+                        self.remote[name] = (size, None, md5)
+        return self.remote
+
+    def is_current(self, path, name):
+        remote = self.remote.get(name) if self.remote is not None else None
+        if remote is None:
+            return False
+        size, crc32c, md5 = remote
+        if size != os.path.getsize(path):
+            return False
+        local_crc32c, local_md5 = file_checksums(path)
+        if crc32c and local_crc32c:
+            return crc32c == local_crc32c
+        return md5 is not None and md5 == local_md5
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self.stats[key] += value
+
+    def upload_batch(self, paths):
+        bucket = self.bucket()
+        for path in paths:
+            name = self.remote_name(path)
+            try:
+                if self.is_current(path, name):
+                    self._count('skipped')
+                    continue
+                bucket.blob(name).upload_from_filename(path)
+                self._count('uploaded')
+                self._count('bytes', os.path.getsize(path))
+            except Exception as e:
+                logging.error(f"Failed to upload {path} to {name}: {e}")
+                self._count('failed')
+
+    def upload_packed(self, paths):
+        """Upload small files as one tar shard, named after its contents so unchanged shards are skipped."""
+        entries = sorted((self.remote_name(path), path) for path in paths)
+        current = [entry for entry in entries if self.is_current(entry[1], entry[0])]
+        if current:
+            self._count('skipped', len(current))
+            entries = [entry for entry in entries if entry not in current]
+        if not entries:
+            return
+        digest = hashlib.md5()
+        manifest = []
+        for name, path in entries:
+            md5 = file_checksums(path)[1]
+            digest.update(name.encode('utf-8'))
+            digest.update(md5.encode('ascii'))
+            manifest.append([name, os.path.getsize(path), md5])
+        shard_name = f"{self.packed_prefix()}{digest.hexdigest()}.tar"
+        if self.remote is not None and shard_name in self.remote:
+            self._count('skipped', len(entries))
+            return
+
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w') as tar:
+            for name, path in entries:
+                tar.add(path, arcname=name)
+        # what the shard holds, so later runs skip these files, see load_remote_index()
+        index = json.dumps(manifest)
+        try:
+            bucket = self.bucket()
+            bucket.blob(shard_name).upload_from_string(buffer.getvalue())
+            bucket.blob(shard_name[:-len('.tar')] + '.json').upload_from_string(index)
+            self._count('uploaded', len(entries))
+            self._count('bytes', buffer.tell())
+        except Exception as e:
+            logging.error(f"Failed to upload packed shard {shard_name}: {e}")
+            self._count('failed', len(entries))
+
+    def submit(self, paths):
+        """Queue paths for upload; returns immediately."""
+        self.load_remote_index()
+        small = []
+        for path in paths:
+            if os.path.getsize(path) >= self.small_file_bytes:
+                self._queue(self.upload_batch, [path])
+            else:
+                small.append(path)
+        upload = self.upload_packed if self.pack else self.upload_batch
+        for i in range(0, len(small), self.files_per_batch):
+            self._queue(upload, small[i:i + self.files_per_batch])
+
+    def _queue(self, upload, paths):
+        if not self.controller:
+            self.futures.append(self.executor.submit(upload, paths))
+            return
+        with self._dispatch_lock:
+            self.backlog.append((upload, paths))
+        self._dispatch()
+
+    def _dispatch(self, finished=None):
+        """Start queued batches up to the controller's target, also called as each batch finishes."""
+        with self._dispatch_lock:
+            if finished is not None:
+                self.running -= 1
+            limit = self.controller.update(len(self.backlog), self.running)
+            while self.backlog and self.running < limit:
+                upload, paths = self.backlog.popleft()
+                self.running += 1
+                future = self.executor.submit(self._measured, upload, paths)
+                self.futures.append(future)
+                future.add_done_callback(self._dispatch)
+
+    def _measured(self, upload, paths):
+        """Run one batch and tell the controller how much of it was spent waiting on the upload."""
+        start, cpu_start = time.perf_counter(), time.thread_time()
+        upload(paths)
+        wall, cpu = time.perf_counter() - start, time.thread_time() - cpu_start
+        with self._dispatch_lock:
+            self.controller.observe(wall, cpu, {'upload': max(wall - cpu, 0.0)})
+
+    def sync(self, force=False):
+        """Queue every file under local_root that is new or changed since the last sync.
+
+        Each call walks the whole output tree, so calls within SYNC_INTERVAL
+        seconds of the last walk do nothing; the final call passes force=True.
+        """
+        now = time.monotonic()
+        if not force and self.last_sync is not None and now - self.last_sync < SYNC_INTERVAL:
+            return 0
+        self.last_sync = now
+        changed = []
+        for path in list_files(self.local_root):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            key = (stat.st_size, stat.st_mtime_ns)
+            if self.submitted.get(path) != key:
+                self.submitted[path] = key
+                changed.append(path)
+        if changed:
+            self.submit(changed)
+        return len(changed)
+
+    def close(self):
+        """Wait for queued uploads and return the counters."""
+        while True:
+            with self._dispatch_lock:
+                futures = list(self.futures)
+                idle = not self.backlog and self.running == 0
+            wait(futures)
+            if idle:
+                break
+            time.sleep(0.01)
+        self.executor.shutdown()
+        return dict(self.stats)
+
+
+def format_stats(stats):
+    return (f"uploaded {stats.get('uploaded', 0)} files ({stats.get('bytes', 0) / 1e6:.1f} MB), "
+            f"skipped {stats.get('skipped', 0)} unchanged, {stats.get('failed', 0)} failed")
@@ -1,128 +1,23 @@
 # %%
 import os
-import tarfile
-import tempfile
-from TexSoup import TexSoup, TexNode
-import json
-import shutil
-import re
 import argparse
 from multiprocessing import Pool
+import scheduler
+import sharding
+import partitions
+import work_queue
+import uploader
+import metrics
+import autotune
+import memory_budget
+import engine
+
+# The engine every paper goes through, set up from the options before the pool starts
+pipeline = None
 
 # %%
 def process_tar_gz_file(tar_gz_file):
-    papers_dir = args.papers_dir
-    tar_gz_path = os.path.join(papers_dir, tar_gz_file)
-    with tempfile.TemporaryDirectory() as temp_dir:
-        extract_tar_gz(tar_gz_path, temp_dir)
-        process_extracted_files(temp_dir, tar_gz_file)
-
-def extract_tar_gz(tar_gz_path, extract_path):
-    with tarfile.open(tar_gz_path, mode='r:gz') as tar:
-        tar.extractall(path=extract_path)
-
-def process_extracted_files(extract_path, tar_gz_file):
-    for root, dirs, files in os.walk(extract_path):
-        for file in files:
-            if file.endswith(".tex"):
-                tex_path = os.path.join(root, file)
-                process_tex_file(tex_path, tar_gz_file, extract_path)
-
-def process_tex_file(tex_path, tar_gz_file, extract_path):
-    with open(tex_path, 'r', encoding='utf-8') as f:
-        tex_content = f.read()
-
-        tex_content = tex_content[tex_content.find(r'\begin{document}'):]
-
-        soup = TexSoup(tex_content, tolerance=1)
-        interleaved_list = []
-
-        match = re.search(r'(?:arXiv-)?(\d+\.\d+)', tar_gz_file)
-        if match:
-            paper_id = match.group(1).replace('.', '_')
-        else:
-            paper_id = 'unknown'
-
-        def traverse_and_interleave(node):
-            if isinstance(node, TexNode):
-                if node.name == 'section':
-                    section_title = node.string
-                    if section_title:
-                        interleaved_list.append(section_title)
-                elif node.name == 'figure':
-                    image_filename = node.find('includegraphics')
-                    if image_filename:
-                        image_options = image_filename.args
-                        if isinstance(image_options, list) and len(image_options) > 0:
-                            image_filename = str(image_options[-1]).strip()
-                            if image_filename.startswith('{') and image_filename.endswith('}'):
-                                image_filename = image_filename[1:-1]
-                            if image_filename:
-                                prefixed_image_filename = f"{paper_id}_{os.path.basename(image_filename)}"
-                                copy_image_file(extract_path, image_filename, prefixed_image_filename)
-                                img = ('FIGURE:', f'{prefixed_image_filename}')
-                                interleaved_list.append(img)
-            elif isinstance(node, str):
-                text_content = node.strip()
-                if text_content:
-                    text_content = clean_text_content(text_content)
-                    if text_content:
-                        interleaved_list.append(text_content)
-
-            for child in getattr(node, 'contents', []):
-                traverse_and_interleave(child)
-
-        traverse_and_interleave(soup)
-
-        if not interleaved_list:
-            return
-
-        for i in range(len(interleaved_list) - 1):
-            if i >= len(interleaved_list) - 1:
-                break
-            if isinstance(interleaved_list[i], str) and isinstance(interleaved_list[i + 1], str) and interleaved_list[i] == interleaved_list[i + 1]:
-                interleaved_list.pop(i + 1)
-
-        i = 0
-        while i < len(interleaved_list) - 1:
-            if isinstance(interleaved_list[i], str) and isinstance(interleaved_list[i + 1], str) and not interleaved_list[i].endswith(' ') and not interleaved_list[i + 1].startswith(' '):
-                interleaved_list[i] = interleaved_list[i] + ' ' + interleaved_list[i + 1]
-                interleaved_list.pop(i + 1)
-            else:
-                i += 1
-
-        save_interleaved_list(tex_path, paper_id, interleaved_list)
-
-def copy_image_file(extract_path, image_filename, prefixed_image_filename):
-    image_path = os.path.join(extract_path, image_filename)
-    output_image_path = os.path.join(args.output_dir, 'figures', prefixed_image_filename)
-
-    os.makedirs(os.path.dirname(output_image_path), exist_ok=True)
-
-    shutil.copy(image_path, output_image_path)
-
-def save_interleaved_list(tex_path, paper_id, interleaved_list):
-    output_filename = f"{paper_id}_{os.path.splitext(os.path.basename(tex_path))[0]}.json"
-    output_path = os.path.join(args.output_dir, output_filename)
-
-    os.makedirs(args.output_dir, exist_ok=True)
-
-    with open(output_path, 'w') as f:
-        json.dump(interleaved_list, f, indent=2)
-
-def clean_text_content(text):
-    text = re.sub(r'\\[a-zA-Z]+', '', text)
-    text = re.sub(r'\\[^a-zA-Z]', '', text)
-    text = re.sub(r'\{[^}]*\}', '', text)
-    text = re.sub(r'\$.*?\$', '', text)
-    text = re.sub(r'%.*', '', text)
-    text = re.sub(r'width=[\d.]+', '', text)
-    text = re.sub(r'[\d.]+pt', '', text)
-    text = re.sub(r'[\d.]+in', '', text)
-    text = re.sub(r'[\d.]+em', '', text)
-    text = re.sub(r'\s+', ' ', text).strip()
-
-    return text
+    pipeline.process(os.path.join(args.papers_dir, tar_gz_file))
 
 # %%
 # papers_dir = "papers"
@@ -133,12 +28,67 @@ if __name__ == "__main__":
     parser.add_argument('--papers_dir', type=str, required=True, help='Directory containing the tar.gz files.')
     parser.add_argument('--output_dir', type=str, required=True, help='Directory to store the output files.')
     parser.add_argument('--num_processes', type=int, default=4, help='Number of processes to use for parallel processing.')
+    parser.add_argument('--autotune', type=autotune.parse_range,
+                        help='Adjust the number of processes between MIN:MAX to how CPU or I/O bound the run is.')
+    parser.add_argument('--shard', type=sharding.parse_shard, help='Only process shard i of N, e.g. --shard 0/4.')
+    parser.add_argument('--queue', type=str, help='Pull papers from this work queue database instead of a fixed list.')
+    parser.add_argument('--upload_bucket', type=str, help='Upload outputs to this bucket while processing runs.')
+    parser.add_argument('--upload_threads', type=int, help='Upload threads (default: one per core).')
+    parser.add_argument('--autotune_upload', type=autotune.parse_range,
+                        help='Adjust the number of upload threads between MIN:MAX to the upload backlog.')
+    parser.add_argument('--partitioned', action='store_true', help='Write outputs under yymm (or category/yymm) directories, with a catalog.')
+    parser.add_argument('--partitions', type=partitions.parse_partitions, help='Only process these months, e.g. 2301,2303-2306.')
+    parser.add_argument('--metrics_dir', type=str, help='Write per-stage timings, counters and RSS here.')
+    parser.add_argument('--profile', type=int, default=0, help='Keep cProfile dumps of the N slowest papers (needs --metrics_dir).')
+    parser.add_argument('--memory_budget_gb', type=float, help='Wait before unpacking while this much is reserved.')
     args = parser.parse_args()
+    if args.metrics_dir:
+        metrics.configure(args.metrics_dir, profile_top=args.profile)
+    if args.memory_budget_gb:
+        memory_budget.configure(args.memory_budget_gb * 1024 ** 3)
+    pipeline = engine.Engine([engine.InterleavedListOutput(args.output_dir, args.partitioned, args.shard)])
 
     tar_gz_files = [file for file in os.listdir(args.papers_dir) if file.endswith(".tar.gz")]
-
-    with Pool(processes=args.num_processes) as pool:
-        pool.map(process_tar_gz_file, tar_gz_files)
+    tar_gz_files = [file for file in sharding.select_shard(tar_gz_files, args.shard)
+                    if partitions.in_partitions(file, args.partitions)]
+    sizes = scheduler.file_sizes([os.path.join(args.papers_dir, file) for file in tar_gz_files])
+
+    # With ranges, process and upload concurrency follow what the run turns out to be bound by
+    workers = autotune.Controller('workers', *args.autotune, initial=args.num_processes) if args.autotune else None
+    uploads = autotune.Controller('upload_threads', *args.autotune_upload, kind='io') if args.autotune_upload else None
+
+    # Finished outputs are shipped in the background while later chunks run
+    upload = uploader.Uploader(args.upload_bucket, args.output_dir, num_threads=args.upload_threads,
+                               controller=uploads) if args.upload_bucket else None
+    on_chunk_done = (lambda chunk: upload.sync()) if upload else None
+
+    with metrics.Reporter() as reporter, Pool(processes=workers.maximum if workers else args.num_processes) as pool:
+        if args.queue:
+            # other workers may already be draining the same queue, seeding is idempotent
+            work_queue.seed_queue(args.queue, tar_gz_files, sizes)
+            # the queue workers drain until it is empty, their number is fixed
+            work_queue.run_queue_workers(pool, args.queue, process_tar_gz_file,
+                                         workers.target if workers else args.num_processes)
+            print(f"Queue {args.queue}: {work_queue.queue_stats(args.queue)}")
+        else:
+            _, report = scheduler.run_scheduled(pool, process_tar_gz_file, tar_gz_files, sizes, args.num_processes,
+                                                on_chunk_done=on_chunk_done, controller=workers)
+            print(scheduler.format_report(report))
+            if workers:
+                print(autotune.format_settings(workers.settings(), '--num_processes'))
+    sharding.write_shard_manifest(args.output_dir, args.shard, tar_gz_files)
+    catalog = pipeline.outputs[0].catalog
+    if catalog:
+        print(f"Catalog of {len(catalog.partitions())} partitions written to {catalog.export()}")
+    if reporter.summary:
+        print(metrics.format_summary(reporter.summary))
+    if memory_budget.enabled():
+        print(memory_budget.format_usage())
+    if upload:
+        upload.sync(force=True)
+        print(uploader.format_stats(upload.close()))
+        if uploads:
+            print(autotune.format_settings(uploads.settings(), '--upload_threads'))
 
 # %%
 
@@ -0,0 +1,188 @@
+import os
+import time
+import socket
+import sqlite3
+import logging
+import argparse
+import threading
+import metrics
+
+# A lease that has not been renewed for this long is handed to another worker
+VISIBILITY_TIMEOUT = 600
+# Renew leases this often while a paper is being processed
+HEARTBEAT_INTERVAL = 30
+# Give up on an input after this many leases
+MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, size);
+"""
+
+
+def connect(db_path):
+    """Open the queue database, creating it if needed."""
+    conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def seed_queue(db_path, names, sizes=None):
+    """Add inputs to the queue. Inputs already present keep their state."""
+    if sizes is None:
+        sizes = [0] * len(names)
+    conn = connect(db_path)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.executemany('INSERT OR IGNORE INTO tasks (name, size) VALUES (?, ?)',
+                         [(name, size or 0) for name, size in zip(names, sizes)])
+        conn.execute('COMMIT')
+    finally:
+        conn.close()
+
+
+def lease(conn, owner, visibility_timeout=VISIBILITY_TIMEOUT, max_attempts=MAX_ATTEMPTS):
+    """Lease the largest available input to owner. Returns its name or None when the queue is drained."""
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # Leases that expired on their last allowed attempt are not retried again
+        conn.execute("UPDATE tasks SET state = 'failed', last_error = COALESCE(last_error, 'lease expired') "
+                     "WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?", (now, max_attempts))
+        row = conn.execute("SELECT name FROM tasks "
+                           "WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?) "
+                           "ORDER BY size DESC LIMIT 1", (now,)).fetchone()
+        if row is None:
+            conn.execute('COMMIT')
+            return None
+        conn.execute("UPDATE tasks SET state = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                     "WHERE name = ?", (owner, now + visibility_timeout, row[0]))
+        conn.execute('COMMIT')
+        return row[0]
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+
+def heartbeat(conn, name, owner, visibility_timeout=VISIBILITY_TIMEOUT):
+    """Extend a lease. Returns False if the lease was lost to another worker."""
+    cursor = conn.execute("UPDATE tasks SET lease_expires = ? WHERE name = ? AND owner = ? AND state = 'leased'",
+                          (time.time() + visibility_timeout, name, owner))
+    return cursor.rowcount == 1
+
+
+def complete(conn, name, owner):
+    conn.execute("UPDATE tasks SET state = 'done', lease_expires = NULL WHERE name = ? AND owner = ?",
+                 (name, owner))
+
+
+def fail(conn, name, owner, error, max_attempts=MAX_ATTEMPTS):
+    """Release a lease after an error, so the input is retried until it runs out of attempts."""
+    conn.execute("UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                 "lease_expires = NULL, last_error = ? WHERE name = ? AND owner = ?",
+                 (max_attempts, str(error)[:1000], name, owner))
+
+
+def queue_stats(db_path):
+    conn = connect(db_path)
+    try:
+        return dict(conn.execute('SELECT state, COUNT(*) FROM tasks GROUP BY state').fetchall())
+    finally:
+        conn.close()
+
+
+def requeue_failed(db_path):
+    conn = connect(db_path)
+    try:
+        return conn.execute("UPDATE tasks SET state = 'pending', attempts = 0 WHERE state = 'failed'").rowcount
+    finally:
+        conn.close()
+
+
+def _keep_alive(db_path, name, owner, visibility_timeout, interval, stop):
+    conn = connect(db_path)
+    try:
+        while not stop.wait(interval):
+            if not heartbeat(conn, name, owner, visibility_timeout):
+                logging.warning(f"Lost lease on {name}")
+                return
+    finally:
+        conn.close()
+
+
+def drain_queue(db_path, func, per_chunk=False, visibility_timeout=VISIBILITY_TIMEOUT,
+                heartbeat_interval=HEARTBEAT_INTERVAL, max_attempts=MAX_ATTEMPTS):
+    """Lease inputs and run func on them until the queue is empty.
+
+    Safe to run in any number of processes and machines sharing db_path; a
+    worker that dies simply stops heartbeating and its lease is picked up by
+    someone else once the visibility timeout passes. With per_chunk=True func
+    is called with a one-element list, for batch functions.
+    Returns the number of inputs this worker completed.
+    """
+    owner = worker_name()
+    conn = connect(db_path)
+    processed = 0
+    try:
+        while True:
+            name = lease(conn, owner, visibility_timeout, max_attempts)
+            if name is None:
+                metrics.flush()
+                return processed
+
+            stop = threading.Event()
+            keep_alive = threading.Thread(target=_keep_alive, daemon=True,
+                                          args=(db_path, name, owner, visibility_timeout, heartbeat_interval, stop))
+            keep_alive.start()
+            try:
+                if per_chunk:
+                    func([name])
+                else:
+                    func(name)
+            except Exception as e:
+                logging.error(f"Error processing {name}: {e}")
+                fail(conn, name, owner, e, max_attempts)
+            else:
+                complete(conn, name, owner)
+                processed += 1
+            finally:
+                stop.set()
+                keep_alive.join()
+                metrics.maybe_flush()
+    finally:
+        conn.close()
+
+
+def run_queue_workers(pool, db_path, func, num_workers, per_chunk=False):
+    """Start num_workers drain_queue loops on a Pool or executor and wait for them."""
+    if hasattr(pool, 'apply_async'):
+        pending = [pool.apply_async(drain_queue, (db_path, func, per_chunk)) for _ in range(num_workers)]
+        return sum(result.get() for result in pending)
+    futures = [pool.submit(drain_queue, db_path, func, per_chunk) for _ in range(num_workers)]
+    return sum(future.result() for future in futures)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect or reset a processing work queue.')
+    parser.add_argument('command', choices=['status', 'requeue-failed'])
+    parser.add_argument('--queue', type=str, required=True, help='Path to the queue database.')
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        print(queue_stats(args.queue))
+    else:
+        print(f"Requeued {requeue_failed(args.queue)} failed inputs")